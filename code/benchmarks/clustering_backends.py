@@ -0,0 +1,155 @@
+"""Benchmark of the lightweight clustering backend against BERTopic.
+
+The information nuggets of every query in the generated responses file are
+clustered with BERTopic and with agglomerative clustering over the same
+(cached) embeddings. Per-query clustering latency (embeddings excluded) and
+the agreement of both clusterings, measured with the adjusted Rand index
+(ARI), are reported per nugget set size bucket.
+
+Usage:
+    python code/benchmarks/clustering_backends.py --max_size 15 \
+        --embedding_model all-MiniLM-L6-v2 --n_neighbors 3 --n_components 2 \
+        --min_cluster_size 2 --seed 42
+"""
+
+import argparse
+import ast
+import time
+from typing import List, Sequence
+
+import numpy as np
+import pandas as pd
+
+from ginger.response_generation.pipeline.components.agglomerative_clustering import (  # noqa: E501
+    agglomerative_labels,
+)
+from ginger.response_generation.pipeline.components.cached_clustering import (
+    CachedBERTopicClustering,
+)
+from ginger.response_generation.utilities.embedding_cache import (
+    EmbeddingCache,
+)
+
+
+def load_nugget_sets(path: str) -> List[List[str]]:
+    """Loads the information nuggets of every query."""
+    data = pd.read_csv(path)
+    return [
+        [
+            nugget
+            for nuggets in ast.literal_eval(nuggets_per_doc).values()
+            for nugget in nuggets
+        ]
+        for nuggets_per_doc in data["information_nuggets"]
+    ]
+
+
+def _pairs(counts: np.ndarray) -> float:
+    """Returns the number of unordered pairs for every count."""
+    return (counts * (counts - 1) / 2).sum()
+
+
+def adjusted_rand_index(
+    labels_a: Sequence[int], labels_b: Sequence[int]
+) -> float:
+    """Computes the adjusted Rand index of two clusterings.
+
+    Args:
+        labels_a: Cluster labels of the first clustering.
+        labels_b: Cluster labels of the second clustering.
+
+    Returns:
+        Adjusted Rand index; 1.0 for identical partitions.
+    """
+    _, codes_a = np.unique(labels_a, return_inverse=True)
+    _, codes_b = np.unique(labels_b, return_inverse=True)
+    contingency = np.zeros((codes_a.max() + 1, codes_b.max() + 1))
+    np.add.at(contingency, (codes_a, codes_b), 1)
+    index = _pairs(contingency)
+    pairs_a = _pairs(contingency.sum(axis=1))
+    pairs_b = _pairs(contingency.sum(axis=0))
+    expected = pairs_a * pairs_b / _pairs(np.array([len(codes_a)]))
+    maximum = (pairs_a + pairs_b) / 2
+    if maximum == expected:
+        return 1.0
+    return (index - expected) / (maximum - expected)
+
+
+def main(args: argparse.Namespace) -> None:
+    clustering = CachedBERTopicClustering(
+        embedding_model=args.embedding_model,
+        n_neighbors=args.n_neighbors,
+        n_components=args.n_components,
+        min_cluster_size=args.min_cluster_size,
+        seed=args.seed,
+        embedding_cache=EmbeddingCache(args.embedding_cache_path),
+    )
+    rows = []
+    for nuggets in load_nugget_sets(args.input_path):
+        if len(nuggets) < 4:
+            continue
+        embeddings = clustering.embed(nuggets)
+
+        start = time.perf_counter()
+        bertopic_labels = list(clustering.cluster(nuggets, embeddings)["Topic"])
+        bertopic_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        labels = agglomerative_labels(embeddings, args.similarity_threshold)
+        agglomerative_seconds = time.perf_counter() - start
+
+        rows.append(
+            {
+                "size": "<= {}".format(args.max_size)
+                if len(nuggets) <= args.max_size
+                else "> {}".format(args.max_size),
+                "bertopic_ms": 1000 * bertopic_seconds,
+                "agglomerative_ms": 1000 * agglomerative_seconds,
+                "ari": adjusted_rand_index(bertopic_labels, labels),
+            }
+        )
+
+    results = pd.DataFrame(rows)
+    summary = results.groupby("size").agg(
+        queries=("ari", "size"),
+        bertopic_ms=("bertopic_ms", "median"),
+        agglomerative_ms=("agglomerative_ms", "median"),
+        mean_ari=("ari", "mean"),
+    )
+    print(summary.round(3).to_string())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark agglomerative clustering against BERTopic"
+    )
+    parser.add_argument(
+        "--input_path",
+        type=str,
+        default="data/generated_responses/generated_responses_all_variants.csv",
+        help="CSV file with an information_nuggets column",
+    )
+    parser.add_argument(
+        "--embedding_cache_path",
+        type=str,
+        default="data/cache/nugget_embeddings",
+    )
+    parser.add_argument(
+        "--max_size",
+        type=int,
+        default=15,
+        help="Largest nugget set size handled by the lightweight backend",
+    )
+    parser.add_argument("--similarity_threshold", type=float, default=0.5)
+    parser.add_argument(
+        "--embedding_model",
+        type=str,
+        required=True,
+        help="Sentence-transformers model of the BERTopic clustering",
+    )
+    parser.add_argument("--n_neighbors", type=int, required=True)
+    parser.add_argument("--n_components", type=int, required=True)
+    parser.add_argument("--min_cluster_size", type=int, required=True)
+    parser.add_argument("--seed", type=int, required=True)
+
+    main(parser.parse_args())
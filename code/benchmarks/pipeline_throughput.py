@@ -0,0 +1,384 @@
+"""End-to-end throughput benchmark of the pipeline with a mock LLM.
+
+The OpenAI clients are replaced by a deterministic local stand-in with
+configurable latency and completion length, so that the pipeline can be
+benchmarked without API calls. Every target is run on synthetic data of each
+requested size in a fresh process, inside a temporary working directory:
+
+- ginger: generate_ginger_responses.main on synthetic queries with three
+  passages each (clustering and reranking models run for real),
+- explanations: generate_explanations.main on synthetic response pairs,
+- rephrase: rephrase_response on synthetic responses.
+
+Reported are items (queries or responses) per second, p50/p95 latency and
+peak memory (RSS). Latency is per query for ginger, taken from the stage
+trace of the run, and per model request for the other targets, as observed
+by the caller.
+
+Usage (with the repository root, ginger/ and code/ on PYTHONPATH):
+    python code/benchmarks/pipeline_throughput.py --targets ginger \\
+        --num_items 30 1000 10000 --latency 0.5
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import resource
+import tempfile
+import threading
+import time
+from functools import partial
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+import numpy as np
+import pandas as pd
+
+from ginger.response_generation.utilities.openai_batch import mock_response
+
+TARGETS = ("ginger", "explanations", "rephrase")
+
+_WORDS = (
+    "energy climate market policy health research water city data school "
+    "history music travel food science sport design film ocean planet law "
+    "economy language network memory culture forest voter engine"
+).split()
+_EXPLANATION_TYPES = ["grounding", "source_attribution", "coverage"]
+
+
+def _rng(*parts: Any) -> random.Random:
+    """Returns a random generator seeded by a hash of the given parts."""
+    digest = hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()
+    return random.Random(int(digest[:16], 16))
+
+
+def _sentence(rng: random.Random, num_words: int) -> str:
+    """Returns a synthetic sentence."""
+    words = [rng.choice(_WORDS) for _ in range(num_words)]
+    return " ".join(words).capitalize() + "."
+
+
+def _text(rng: random.Random, num_sentences: int) -> str:
+    """Returns a synthetic text."""
+    return " ".join(
+        _sentence(rng, rng.randint(8, 16)) for _ in range(num_sentences)
+    )
+
+
+def make_queries(num_queries: int, seed: int = 0) -> pd.DataFrame:
+    """Generates input queries in the format of input_queries.csv."""
+    rows = []
+    for i in range(num_queries):
+        rng = _rng("query", seed, i)
+        rows.append(
+            {
+                "topic_id": i // 9,
+                "turn_id": i % 9 + 1,
+                "query": "What about " + _sentence(rng, 4).lower()[:-1] + "?",
+                "relevance_scores": str([3, 2, 2]),
+                "passage_ids": str(["p1", "p2", "p3"]),
+                "passages": str([_text(rng, 6) for _ in range(3)]),
+            }
+        )
+    return pd.DataFrame(rows)
+
+
+def make_responses(num_responses: int, seed: int = 0) -> pd.DataFrame:
+    """Generates responses in the format of input_responses.csv.
+
+    The same GINGER response is shared by the conditions of a query, as in
+    the user study data.
+    """
+    rows = []
+    for i in range(num_responses):
+        rng = _rng("response", seed, i // 3)
+        ginger_response = _text(rng, 3)
+        rows.append(
+            {
+                "query_id": "{}-{}".format(i // 3, i % 3),
+                "query": "What about " + _sentence(rng, 4).lower()[:-1] + "?",
+                "ginger_response": ginger_response,
+                "ginger_response_support": ginger_response + " [1]",
+                "source": str(["[1] " + _text(rng, 4)]),
+                "single_aspect_response": _text(rng, 3),
+                "additional_aspects": "Keyword: " + rng.choice(_WORDS),
+                "llm_zero_shot_response": _text(rng, 3),
+                "explanation_type": _EXPLANATION_TYPES[i % 3],
+            }
+        )
+    return pd.DataFrame(rows)
+
+
+class MockOpenAI:
+    # Caller-observed latency of every request, shared by all clients of the
+    # process.
+    request_seconds: List[float] = []
+    _lock = threading.Lock()
+
+    def __init__(
+        self, latency: float, completion_tokens: int, **kwargs: Any
+    ) -> None:
+        """Instantiates a deterministic stand-in for the OpenAI client.
+
+        Args:
+            latency: Response time of every request in seconds.
+            completion_tokens: Length of free-text responses in words.
+            kwargs: Ignored client arguments (api_key, max_retries).
+        """
+        self._latency = latency
+        self._completion_tokens = completion_tokens
+        self.chat = SimpleNamespace(
+            completions=SimpleNamespace(create=self.create)
+        )
+
+    def _response(self, request: Dict[str, Any]) -> Any:
+        """Builds the response to a request."""
+        content = mock_response(
+            request,
+            rng=_rng(json.dumps(request["messages"], sort_keys=True)),
+            num_words=self._completion_tokens,
+        )
+        usage = SimpleNamespace(
+            prompt_tokens=sum(
+                len(m["content"].split()) for m in request["messages"]
+            ),
+            completion_tokens=len(content.split()),
+        )
+        if request.get("stream"):
+            chunks = [
+                SimpleNamespace(
+                    choices=[
+                        SimpleNamespace(delta=SimpleNamespace(content=w + " "))
+                    ],
+                    usage=None,
+                )
+                for w in content.split()
+            ]
+            chunks.append(SimpleNamespace(choices=[], usage=usage))
+            return _MockStream(chunks)
+        message = SimpleNamespace(role="assistant", content=content)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(index=0, message=message)], usage=usage
+        )
+
+    @classmethod
+    def _record(cls, seconds: float) -> None:
+        with cls._lock:
+            cls.request_seconds.append(seconds)
+
+    def create(self, **request: Any) -> Any:
+        start = time.perf_counter()
+        time.sleep(self._latency)
+        response = self._response(request)
+        self._record(time.perf_counter() - start)
+        return response
+
+
+class MockAsyncOpenAI(MockOpenAI):
+    """Asynchronous variant of MockOpenAI."""
+
+    async def create(self, **request: Any) -> Any:
+        start = time.perf_counter()
+        await asyncio.sleep(self._latency)
+        response = self._response(request)
+        self._record(time.perf_counter() - start)
+        return response
+
+    async def close(self) -> None:
+        pass
+
+
+class _MockStream:
+    """Stream of response chunks."""
+
+    def __init__(self, chunks: List[Any]) -> None:
+        self._chunks = chunks
+
+    def __iter__(self):
+        return iter(self._chunks)
+
+    def close(self) -> None:
+        pass
+
+
+def _install_mock_clients(args: argparse.Namespace) -> None:
+    """Replaces the OpenAI client classes with the mock clients."""
+    import openai
+
+    openai.OpenAI = partial(
+        MockOpenAI,
+        latency=args.latency,
+        completion_tokens=args.completion_tokens,
+    )
+    openai.AsyncOpenAI = partial(
+        MockAsyncOpenAI,
+        latency=args.latency,
+        completion_tokens=args.completion_tokens,
+    )
+
+
+def _run_ginger(num_items: int, args: argparse.Namespace) -> List[float]:
+    """Runs the response generation pipeline and returns query latencies."""
+    os.makedirs("data/input_queries", exist_ok=True)
+    os.makedirs("data/generated_responses", exist_ok=True)
+    make_queries(num_items).to_csv(
+        "data/input_queries/input_queries.csv", index=False
+    )
+    from response_generation import generate_ginger_responses
+
+    generate_ginger_responses.main(
+        res_length_limit=3,
+        baseline=True,
+        cache_path=None,
+        max_concurrency=args.max_concurrency,
+        num_workers=args.num_workers,
+        trace_path="trace.jsonl",
+    )
+    trace = pd.read_json("trace.jsonl", lines=True)
+    query_stages = [
+        "nugget_detection",
+        "clustering_and_reranking",
+        "summarization",
+    ]
+    return list(
+        trace[trace["stage"].isin(query_stages)]
+        .groupby("query_id")["seconds"]
+        .sum()
+    )
+
+
+def _run_explanations(num_items: int, args: argparse.Namespace) -> None:
+    """Runs the explanation generator."""
+    os.makedirs("data/user_study", exist_ok=True)
+    make_responses(num_items).to_csv(
+        "data/user_study/input_responses.csv", index=False
+    )
+    from user_study import generate_explanations
+
+    generate_explanations.main(
+        max_workers=args.max_concurrency, aspect_pack_size=args.pack_size
+    )
+
+
+def _run_rephrase(num_items: int, args: argparse.Namespace) -> None:
+    """Rephrases synthetic responses."""
+    from ginger.response_generation.pipeline.components.summarizer import (
+        AsyncGPTSummarizer,
+        rephrase_response,
+    )
+
+    data = make_responses(num_items)
+    summarizer = AsyncGPTSummarizer(
+        api_key="sk-benchmark", max_concurrency=args.max_concurrency
+    )
+    rephrase_response(
+        data, "ginger_response", summarizer, pack_size=args.pack_size
+    )
+    summarizer.close()
+
+
+def _run_scenario(
+    target: str, num_items: int, args: argparse.Namespace, results: dict
+) -> None:
+    """Runs a target in a temporary directory and stores measurements."""
+    _install_mock_clients(args)
+    os.chdir(tempfile.mkdtemp(prefix="benchmark-"))
+    start = time.perf_counter()
+    if target == "ginger":
+        latencies = _run_ginger(num_items, args)
+    elif target == "explanations":
+        _run_explanations(num_items, args)
+        latencies = MockOpenAI.request_seconds
+    else:
+        _run_rephrase(num_items, args)
+        latencies = MockOpenAI.request_seconds
+    elapsed = time.perf_counter() - start
+    results[(target, num_items)] = {
+        "seconds": elapsed,
+        "items_per_second": num_items / elapsed,
+        "latency_unit": "query" if target == "ginger" else "request",
+        "p50_seconds": float(np.percentile(latencies, 50)),
+        "p95_seconds": float(np.percentile(latencies, 95)),
+        "requests": len(MockOpenAI.request_seconds),
+        # ru_maxrss is reported in kilobytes on Linux.
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        / 1024,
+    }
+
+
+def main(args: argparse.Namespace) -> None:
+    context = multiprocessing.get_context("spawn")
+    manager = context.Manager()
+    results = manager.dict()
+    for target in args.targets:
+        for num_items in args.num_items:
+            process = context.Process(
+                target=_run_scenario,
+                args=(target, num_items, args, results),
+            )
+            process.start()
+            process.join()
+
+    rows = []
+    for target in args.targets:
+        for num_items in args.num_items:
+            if (target, num_items) not in results:
+                print("Target {} failed on {} items".format(target, num_items))
+                continue
+            result = results[(target, num_items)]
+            rows.append(
+                {
+                    "target": target,
+                    "items": num_items,
+                    "seconds": round(result["seconds"], 2),
+                    "items_per_second": round(result["items_per_second"], 2),
+                    "latency_unit": result["latency_unit"],
+                    "p50_seconds": round(result["p50_seconds"], 3),
+                    "p95_seconds": round(result["p95_seconds"], 3),
+                    "requests": result["requests"],
+                    "peak_rss_mb": round(result["peak_rss_mb"], 1),
+                }
+            )
+    print(pd.DataFrame(rows).to_string(index=False))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark pipeline throughput with a mock LLM"
+    )
+    parser.add_argument(
+        "--targets", nargs="+", default=list(TARGETS), choices=TARGETS
+    )
+    parser.add_argument(
+        "--num_items",
+        nargs="+",
+        type=int,
+        default=[30],
+        help="Numbers of synthetic queries/responses, e.g., 30 1000 10000",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.5,
+        help="Response time of every mock request in seconds",
+    )
+    parser.add_argument(
+        "--completion_tokens",
+        type=int,
+        default=60,
+        help="Length of free-text mock responses in words",
+    )
+    parser.add_argument("--max_concurrency", type=int, default=8)
+    parser.add_argument("--num_workers", type=int, default=1)
+    parser.add_argument(
+        "--pack_size",
+        type=int,
+        default=1,
+        help="Responses per rephrasing or aspect detection request",
+    )
+
+    main(parser.parse_args())
@@ -0,0 +1,193 @@
+"""Benchmark of the inference backends of the Hugging Face summarizer.
+
+Every backend is run in a separate process so that peak memory (RSS) is
+measured in isolation. Throughput is reported as generated tokens per second
+and the summaries of the optimized backends are compared to the fp32 PyTorch
+baseline with ROUGE-1 and ROUGE-L F1 scores.
+
+Usage:
+    python code/benchmarks/summarizer_backends.py --num_texts 90
+"""
+
+import argparse
+import ast
+import multiprocessing
+import resource
+import time
+from typing import Dict, List
+
+import pandas as pd
+
+from ginger.response_generation.pipeline.components.summarizer import (
+    SUMMARIZER_BACKENDS,
+    HuggingFaceSummarizer,
+)
+
+
+def load_texts(path: str, num_texts: int) -> List[str]:
+    """Loads passages to summarize from the input queries file."""
+    data = pd.read_csv(path)
+    texts = [
+        passage
+        for passages in data["passages"]
+        for passage in ast.literal_eval(passages)
+    ]
+    return texts[:num_texts]
+
+
+def _lcs_length(a: List[str], b: List[str]) -> int:
+    """Returns the length of the longest common subsequence of two lists."""
+    previous = [0] * (len(b) + 1)
+    for token_a in a:
+        current = [0]
+        for j, token_b in enumerate(b):
+            if token_a == token_b:
+                current.append(previous[j] + 1)
+            else:
+                current.append(max(previous[j + 1], current[j]))
+        previous = current
+    return previous[-1]
+
+
+def _f1(overlap: int, reference_length: int, candidate_length: int) -> float:
+    """Computes F1 score from overlap counts."""
+    if overlap == 0:
+        return 0.0
+    precision = overlap / candidate_length
+    recall = overlap / reference_length
+    return 2 * precision * recall / (precision + recall)
+
+
+def rouge_agreement(
+    references: List[str], candidates: List[str]
+) -> Dict[str, float]:
+    """Computes mean ROUGE-1 and ROUGE-L F1 of candidates against references.
+
+    Args:
+        references: Summaries of the baseline backend.
+        candidates: Summaries of the evaluated backend.
+
+    Returns:
+        Dictionary with mean ROUGE-1 and ROUGE-L F1 scores.
+    """
+    rouge_1, rouge_l = [], []
+    for reference, candidate in zip(references, candidates):
+        reference_tokens = reference.lower().split()
+        candidate_tokens = candidate.lower().split()
+        if not reference_tokens or not candidate_tokens:
+            same = reference_tokens == candidate_tokens
+            rouge_1.append(float(same))
+            rouge_l.append(float(same))
+            continue
+        unigram_overlap = sum(
+            min(reference_tokens.count(t), candidate_tokens.count(t))
+            for t in set(candidate_tokens)
+        )
+        rouge_1.append(
+            _f1(unigram_overlap, len(reference_tokens), len(candidate_tokens))
+        )
+        rouge_l.append(
+            _f1(
+                _lcs_length(reference_tokens, candidate_tokens),
+                len(reference_tokens),
+                len(candidate_tokens),
+            )
+        )
+    return {
+        "rouge_1": sum(rouge_1) / len(rouge_1),
+        "rouge_l": sum(rouge_l) / len(rouge_l),
+    }
+
+
+def _run_backend(
+    backend: str, texts: List[str], args: argparse.Namespace, results: dict
+) -> None:
+    """Summarizes texts with a backend and stores measurements in results."""
+    summarizer = HuggingFaceSummarizer(args.model_name, backend=backend)
+    # Warm-up run, excluded from timing.
+    summarizer.summarize_batch(texts[: args.batch_size], max_length=32)
+
+    start = time.perf_counter()
+    summaries = summarizer.summarize_batch(
+        texts,
+        max_length=args.max_length,
+        batch_size=args.batch_size,
+        num_threads=args.num_threads,
+    )
+    elapsed = time.perf_counter() - start
+
+    tokenizer = summarizer._summarizer.tokenizer
+    generated_tokens = sum(
+        len(tokenizer.encode(summary, add_special_tokens=False))
+        for summary in summaries
+    )
+    results[backend] = {
+        "summaries": summaries,
+        "seconds": elapsed,
+        "tokens_per_second": generated_tokens / elapsed,
+        # ru_maxrss is reported in kilobytes on Linux.
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        / 1024,
+    }
+
+
+def main(args: argparse.Namespace) -> None:
+    texts = load_texts(args.input_path, args.num_texts)
+    context = multiprocessing.get_context("spawn")
+    manager = context.Manager()
+    results = manager.dict()
+    for backend in args.backends:
+        process = context.Process(
+            target=_run_backend, args=(backend, texts, args, results)
+        )
+        process.start()
+        process.join()
+
+    baseline = results.get("pytorch")
+    rows = []
+    for backend in args.backends:
+        if backend not in results:
+            print("Backend {} failed".format(backend))
+            continue
+        result = results[backend]
+        row = {
+            "backend": backend,
+            "seconds": round(result["seconds"], 2),
+            "tokens_per_second": round(result["tokens_per_second"], 1),
+            "peak_rss_mb": round(result["peak_rss_mb"], 1),
+        }
+        if baseline is not None:
+            agreement = rouge_agreement(
+                baseline["summaries"], result["summaries"]
+            )
+            row.update({k: round(v, 4) for k, v in agreement.items()})
+        rows.append(row)
+    print(pd.DataFrame(rows).to_string(index=False))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark Hugging Face summarizer backends"
+    )
+    parser.add_argument(
+        "--input_path",
+        type=str,
+        default="data/generated_responses/input_queries.csv",
+        help="CSV file with a passages column to summarize",
+    )
+    parser.add_argument("--num_texts", type=int, default=90)
+    parser.add_argument(
+        "--model_name", type=str, default="Falconsai/text_summarization"
+    )
+    parser.add_argument(
+        "--backends",
+        nargs="+",
+        default=list(SUMMARIZER_BACKENDS),
+        choices=SUMMARIZER_BACKENDS,
+        help="Backends to compare; pytorch is the reference for ROUGE",
+    )
+    parser.add_argument("--batch_size", type=int, default=8)
+    parser.add_argument("--max_length", type=int, default=128)
+    parser.add_argument("--num_threads", type=int, default=None)
+
+    main(parser.parse_args())
@@ -0,0 +1,88 @@
+"""Benchmark of the start-up cost of the summarizer module.
+
+Every scenario is run in a fresh Python process. For each scenario, the wall
+time and the heavy dependencies loaded by the end of it are reported. The
+"eager imports" scenario imports the dependencies that the summarizer module
+used to import at module level, as a reference.
+
+Usage:
+    python code/benchmarks/summarizer_startup.py --repeats 5
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+from statistics import median
+
+import pandas as pd
+
+_SUMMARIZER_MODULE = "ginger.response_generation.pipeline.components.summarizer"
+_HEAVY_MODULES = ["pandas", "torch", "transformers", "openai"]
+
+SCENARIOS = {
+    "eager imports": (
+        "import pandas, torch, openai\n"
+        "from transformers import pipeline\n"
+    ),
+    "import summarizer": "import {module}\n",
+    "GPTSummarizer()": (
+        "from {module} import GPTSummarizer\n"
+        "GPTSummarizer(api_key='sk-benchmark')\n"
+    ),
+    "HuggingFaceSummarizer()": (
+        "from {module} import HuggingFaceSummarizer\n"
+        "HuggingFaceSummarizer()\n"
+    ),
+}
+
+_TEMPLATE = """
+import json, sys, time
+start = time.perf_counter()
+{body}
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    "seconds": elapsed,
+    "loaded": [m for m in {heavy_modules!r} if m in sys.modules],
+}}))
+"""
+
+
+def run_scenario(body: str) -> dict:
+    """Runs a scenario in a fresh interpreter and returns its measurements."""
+    code = _TEMPLATE.format(
+        body=body.format(module=_SUMMARIZER_MODULE),
+        heavy_modules=_HEAVY_MODULES,
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(args: argparse.Namespace) -> None:
+    rows = []
+    for name, body in SCENARIOS.items():
+        measurements = [run_scenario(body) for _ in range(args.repeats)]
+        rows.append(
+            {
+                "scenario": name,
+                "median_seconds": round(
+                    median(m["seconds"] for m in measurements), 3
+                ),
+                "heavy_modules_loaded": ", ".join(measurements[0]["loaded"]),
+            }
+        )
+    print(pd.DataFrame(rows).to_string(index=False))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark start-up time of the summarizer module"
+    )
+    parser.add_argument("--repeats", type=int, default=5)
+
+    main(parser.parse_args())
@@ -1,51 +1,127 @@
+import numpy as np
 import pandas as pd
 
-def main():
-    data = pd.read_csv("data/qualification_task/output.csv")
-    print(len(data))
+NUM_RESPONSES = 5
+NUM_ASPECTS = 4
 
-    ground_truth_scores = [
-        [1,0,0,1],
-        [0,0,1,1],
-        [1,1,1,0],
-        [0,0,0,1],
-        [0,1,0,1]
-    ]
+GROUND_TRUTH_SCORES = np.array(
+    [[1, 0, 0, 1], [0, 0, 1, 1], [1, 1, 1, 0], [0, 0, 0, 1], [0, 1, 0, 1]]
+)
+
+ASPECT_COLUMNS = [
+    "Answer.response_" + str(res_id) + "_aspects.aspect_" + str(aspect_id)
+    for res_id in range(0, NUM_RESPONSES)
+    for aspect_id in range(0, NUM_ASPECTS)
+]
+
+
+def score_workers(data):
+    """Scores the aspect answers of qualification submissions.
+
+    Args:
+        data: MTurk results with one row per submission.
 
-    workers_scores = []
-    points = []
-    approves = []
-
-    for _, row in data.iterrows():
-        worker_scores = []
-        point = 0
-        approve = ""
-        for res_id in range(0, 5):
-            res_scores = []
-            for aspect_id in range(0, 4):
-                if row["Answer.response_" + str(res_id) + "_aspects.aspect_" + str(aspect_id)] == True:
-                    res_scores.append(1)
-                else:
-                    res_scores.append(0)
-            if res_scores == ground_truth_scores[res_id]:
-                point += 1
-            worker_scores.append(res_scores)
-        if point >= 4:
-            approve = "x" 
-    
-        workers_scores.append(worker_scores)
-        points.append(point)
-        approves.append(approve)
-
-    data["Approve"] = approves
-    data["worker_scores"] = workers_scores
+    Returns:
+        Data with the aspect scores of every response (worker_scores), the
+        number of responses scored like the ground truth (points) and "x" in
+        Approve for submissions with at least 4 points.
+    """
+    answers = (
+        data.reindex(columns=ASPECT_COLUMNS)
+        .eq(True)
+        .to_numpy()
+        .reshape(-1, NUM_RESPONSES, NUM_ASPECTS)
+        .astype(int)
+    )
+    points = (answers == GROUND_TRUTH_SCORES).all(axis=2).sum(axis=1)
+
+    data = data.copy()
+    data["Approve"] = np.where(points >= 4, "x", "")
+    data["worker_scores"] = answers.tolist()
     data["points"] = points
+    return data
+
+
+def parquet_writer(path, columns):
+    """Opens a Parquet writer of processed results.
+
+    Answer columns are stored as booleans and other MTurk columns as strings,
+    as read from the export.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError(
+            "Parquet output requires pyarrow: pip install pyarrow"
+        ) from e
+
+    types = {
+        "worker_scores": pa.list_(pa.list_(pa.int8())),
+        "points": pa.int64(),
+    }
+    fields = [
+        (
+            column,
+            pa.bool_()
+            if column in ASPECT_COLUMNS
+            else types.get(column, pa.string()),
+        )
+        for column in columns
+        + [
+            c
+            for c in ["Approve", "worker_scores", "points"]
+            if c not in columns
+        ]
+    ]
+    return pq.ParquetWriter(path, pa.schema(fields))
+
+
+def main(
+    chunk_size=10000,
+    parquet_path="data/qualification_task/output_processed.parquet",
+):
+    path = "data/qualification_task/output.csv"
+    # Answers are read as booleans and all other columns as text, so that
+    # the types of a column do not change between chunks.
+    columns = list(pd.read_csv(path, nrows=0).columns)
+    dtypes = {
+        column: "boolean" if column in ASPECT_COLUMNS else str
+        for column in columns
+    }
+
+    num_submissions = 0
+    writer = parquet_writer(parquet_path, columns) if parquet_path else None
+    try:
+        chunks = pd.read_csv(path, dtype=dtypes, chunksize=chunk_size)
+        for chunk_id, data in enumerate(chunks):
+            data = score_workers(data)
+
+            num_submissions += len(data)
+            print(data["points"].tolist())
+            print(data["Approve"].tolist())
+
+            data.to_csv(
+                "data/qualification_task/output_processed.csv",
+                sep=";",
+                index=False,
+                mode="w" if chunk_id == 0 else "a",
+                header=chunk_id == 0,
+            )
+            if writer is not None:
+                import pyarrow as pa
+
+                writer.write_table(
+                    pa.Table.from_pandas(
+                        data, schema=writer.schema, preserve_index=False
+                    )
+                )
+    finally:
+        if writer is not None:
+            writer.close()
 
-    print(points)
-    print(approves)
+    print(num_submissions)
 
-    data.to_csv("data/qualification_task/output_processed.csv", sep=";", index=False)
-    
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,59 @@
+"""Attribution of nugget clusters to the passages the nuggets come from."""
+
+from typing import Dict, Hashable, Iterable, List
+
+
+class AttributionIndex:
+    def __init__(
+        self, information_nuggets_per_doc: Dict[int, List[str]]
+    ) -> None:
+        """Builds an index from information nuggets to their source passages.
+
+        The index is built once per query. Supporting passages of a cluster are
+        then resolved from its member nuggets in time linear in the size of the
+        cluster, instead of scanning the cluster text for every nugget of every
+        passage. Attribution is exact: a nugget that merely occurs as a
+        substring of another cluster's text is not counted.
+
+        Args:
+            information_nuggets_per_doc: Nuggets detected in each passage,
+              keyed by passage id (in passage order).
+        """
+        self._doc_order = {
+            doc_id: position
+            for position, doc_id in enumerate(information_nuggets_per_doc)
+        }
+        self._docs_by_nugget: Dict[str, List[int]] = {}
+        for doc_id, nuggets in information_nuggets_per_doc.items():
+            for nugget in nuggets:
+                docs = self._docs_by_nugget.setdefault(nugget, [])
+                if not docs or docs[-1] != doc_id:
+                    docs.append(doc_id)
+        self._cluster_nuggets: Dict[Hashable, List[str]] = {}
+
+    def add_cluster(
+        self, cluster_id: Hashable, nuggets: Iterable[str]
+    ) -> None:
+        """Registers the member nuggets of a cluster.
+
+        Args:
+            cluster_id: Cluster identifier.
+            nuggets: Nuggets assigned to the cluster.
+        """
+        self._cluster_nuggets[cluster_id] = list(nuggets)
+
+    def supporting_docs(self, cluster_id: Hashable) -> List[int]:
+        """Returns ids of the passages a cluster's nuggets come from.
+
+        Args:
+            cluster_id: Cluster identifier.
+
+        Returns:
+            Passage ids in passage order.
+        """
+        doc_ids = {
+            doc_id
+            for nugget in self._cluster_nuggets.get(cluster_id, [])
+            for doc_id in self._docs_by_nugget.get(nugget, [])
+        }
+        return sorted(doc_ids, key=self._doc_order.__getitem__)
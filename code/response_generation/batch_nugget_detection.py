@@ -0,0 +1,95 @@
+"""Concurrent, memoized information nugget detection."""
+
+import contextvars
+import hashlib
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple
+
+from response_generation.utilities import profiling
+
+
+class BatchNuggetDetector:
+    def __init__(self, nugget_detector, max_workers: int = 8) -> None:
+        """Wraps a nugget detector with concurrent, memoized detection.
+
+        Detection results are memoized by query and passage hash, so passages
+        repeated within a topic are sent to the model only once. Identical
+        requests that are in flight at the same time share a single call.
+
+        Args:
+            nugget_detector: Detector exposing detect_nuggets(query, passage),
+              e.g., GPTNuggetDetector.
+            max_workers (optional): Maximum number of concurrent detection
+              calls. Defaults to 8.
+        """
+        self._nugget_detector = nugget_detector
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._memo: Dict[Tuple[str, str], Future] = {}
+        self._lock = threading.RLock()
+
+    def _submit(self, query: str, passage: str) -> Future:
+        """Returns the (possibly shared) future of a detection call."""
+        key = (query, hashlib.sha256(passage.encode("utf-8")).hexdigest())
+        with self._lock:
+            future = self._memo.get(key)
+            if future is not None:
+                profiling.record_cache_hit()
+            else:
+                # The call runs in the caller's context, so that it is
+                # attributed to the caller's profiling stage.
+                future = self._executor.submit(
+                    contextvars.copy_context().run,
+                    self._nugget_detector.detect_nuggets,
+                    query,
+                    passage,
+                )
+                self._memo[key] = future
+                future.add_done_callback(
+                    lambda done: self._forget_failure(key, done)
+                )
+        return future
+
+    def _forget_failure(self, key: Tuple[str, str], future: Future) -> None:
+        """Removes a failed call from the memo so that it can be retried."""
+        if future.exception() is not None:
+            with self._lock:
+                if self._memo.get(key) is future:
+                    del self._memo[key]
+
+    def detect_nuggets(self, query: str, passage: str) -> List[str]:
+        """Detects information nuggets in a single passage.
+
+        Args:
+            query: Query.
+            passage: Passage to detect nuggets in.
+
+        Returns:
+            List of information nuggets.
+        """
+        return list(self._submit(query, passage).result())
+
+    def detect_nuggets_many(
+        self, query: str, passages: List[str]
+    ) -> List[List[str]]:
+        """Detects information nuggets in passages concurrently.
+
+        Args:
+            query: Query.
+            passages: Passages to detect nuggets in.
+
+        Returns:
+            Lists of information nuggets in the same order as the passages.
+        """
+        futures = [self._submit(query, passage) for passage in passages]
+        return [list(future.result()) for future in futures]
+
+    def close(self) -> None:
+        """Shuts down the thread pool once running calls are done."""
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self) -> "BatchNuggetDetector":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
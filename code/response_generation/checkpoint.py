@@ -0,0 +1,114 @@
+"""Append-only checkpoint store with one record per processed query."""
+
+import ast
+import json
+import os
+from typing import Any, Dict, List, Set
+
+
+def _to_builtin(value: Any) -> Any:
+    """Converts NumPy scalars nested in containers to built-in types."""
+    if isinstance(value, dict):
+        return {_to_builtin(k): _to_builtin(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(_to_builtin(v) for v in value)
+    if hasattr(value, "item") and not isinstance(value, (str, bytes)):
+        return value.item()
+    return value
+
+
+class CheckpointStore:
+    def __init__(self, path: str, key: str = "query_id") -> None:
+        """Instantiates a JSONL checkpoint store.
+
+        Every line holds the key of a record and the record itself serialized
+        as a Python literal, so that tuples and non-string dictionary keys
+        survive a round trip unchanged (as in the CSV files read with
+        ast.literal_eval elsewhere in the code). Records are only ever
+        appended; if a key occurs more than once, the last record wins.
+
+        Args:
+            path: Path to the JSONL file.
+            key (optional): Name of the record field identifying a record.
+              Defaults to "query_id".
+        """
+        self._path = path
+        self._key = key
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def reset(self) -> None:
+        """Removes all stored records."""
+        open(self._path, "w").close()
+
+    def recover(self) -> Set[str]:
+        """Drops a partially written last line and returns completed keys.
+
+        Should be called before appending to a store left by an interrupted
+        run.
+
+        Returns:
+            Keys of all stored records.
+        """
+        if os.path.exists(self._path):
+            with open(self._path, "rb+") as f:
+                content = f.read()
+                if content and not content.endswith(b"\n"):
+                    f.truncate(content.rfind(b"\n") + 1)
+        return self.completed_keys()
+
+    def append(self, record: Dict[str, Any]) -> None:
+        """Appends a record and flushes it to disk.
+
+        Args:
+            record: Record to store. Must contain the key field.
+        """
+        line = json.dumps(
+            {
+                "key": record[self._key],
+                "record": repr(_to_builtin(record)),
+            },
+            ensure_ascii=False,
+        )
+        with open(self._path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def load(self) -> Dict[str, Dict[str, Any]]:
+        """Loads stored records.
+
+        A partially written last line (e.g., after a crash) is ignored.
+
+        Returns:
+            Records by key.
+        """
+        records: Dict[str, Dict[str, Any]] = {}
+        if not os.path.exists(self._path):
+            return records
+        with open(self._path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    records[entry["key"]] = ast.literal_eval(entry["record"])
+                except (ValueError, SyntaxError, KeyError):
+                    continue
+        return records
+
+    def completed_keys(self) -> Set[str]:
+        """Returns keys of all stored records."""
+        return set(self.load())
+
+    def ordered_records(self, keys: List[str]) -> List[Dict[str, Any]]:
+        """Returns stored records in the given key order.
+
+        Args:
+            keys: Keys of the records to return. Keys without a stored record
+              are skipped.
+
+        Returns:
+            List of records.
+        """
+        records = self.load()
+        return [records[key] for key in keys if key in records]
@@ -1,13 +1,18 @@
 """Class for detecting information nuggets in passage given a query."""
 
+import json
 import re
 from abc import ABC, abstractmethod
-from typing import Dict
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
 from openai import OpenAI
 
 from response_generation.config import DEFAULT_GPT_VERSION, OPENAI_API_KEY
-from response_generation.utilities.generation import num_tokens_from_messages
+from response_generation.utilities.openai_batch import PendingRequestError
+from response_generation.utilities.token_budget import TokenBudget
 
 _DEFAULT_PROMPT = [
     {
@@ -16,10 +21,251 @@ _DEFAULT_PROMPT = [
             "Generate two lists of aspects, points of view or facets "
             "that are related to the topic of the provided passage. The first list "
             "should contain 2-5 items that are covered in the passage. The second "
-            "list should contain 2-5 items that are not covered in the passage."
+            "list should contain 2-5 items that are not covered in the passage. "
+            'Answer only with a JSON object with the keys "covered" and '
+            '"not_covered", each mapping to a list of strings.'
         ),
     },
 ]
+_PACKED_PROMPT = [
+    {
+        "role": "system",
+        "content": (
+            "You are given a JSON list of passages, each with an id. For "
+            "every passage, generate two lists of aspects, points of view or "
+            "facets that are related to the topic of the passage. The first "
+            "list should contain 2-5 items that are covered in the passage. "
+            "The second list should contain 2-5 items that are not covered in "
+            "the passage. Answer only with a JSON object that maps the id of "
+            'every passage to an object with the keys "covered" and '
+            '"not_covered", each mapping to a list of strings.'
+        ),
+    },
+]
+# Tokens of a passage in a packed request besides its JSON item (separator).
+_TOKENS_PER_PACKED_ITEM = 2
+# JSON object in a response, possibly surrounded by other text.
+_JSON_OBJECT_PATTERN = re.compile(r"\{.*\}", re.DOTALL)
+# Complete JSON string followed by the delimiter that ends it in an object
+# ("key": or "item", or "item"]), so that partial strings are not matched.
+_JSON_STRING_PATTERN = re.compile(r'"((?:[^"\\]|\\.)*)"\s*([:,\]}])')
+# Item of a numbered or bulleted list in a plain-text response.
+_LIST_ITEM_PATTERN = re.compile(r"^\s*(?:\d+[.)]|[-*\u2022])\s*(.*?)\s*$")
+# Header of the list of aspects not covered in a plain-text response.
+_NOT_COVERED_PATTERN = re.compile(r"not[\s_]+covered", re.IGNORECASE)
+# Header of a list of aspects in a plain-text response, once emphasis and
+# list markers are removed, e.g., "Covered aspects:" or "Not covered:".
+_HEADER_PATTERN = re.compile(r"\bcovered\b.*:$", re.IGNORECASE)
+# Bold or italic text in a plain-text response, e.g., "**Not covered:**".
+_EMPHASIS_PATTERN = re.compile(
+    r"(?<!\w)(\*\*|__|\*|_)(?=\S)(.+?)(?<=\S)\1(?!\w)"
+)
+
+
+@dataclass(frozen=True)
+class AspectDetectionResult(Mapping):
+    """Aspects detected in a passage.
+
+    The result is a read-only mapping from aspect to 1 (covered in the
+    passage) or 0 (not covered). A passage that does not fit the context
+    window of the model has no aspects and overflow set.
+    """
+
+    covered: Tuple[str, ...] = ()
+    not_covered: Tuple[str, ...] = ()
+    overflow: bool = False
+
+    @classmethod
+    def from_pairs(
+        cls, pairs: Iterable[Tuple[str, int]]
+    ) -> "AspectDetectionResult":
+        """Creates a result from (aspect, covered) pairs.
+
+        An aspect listed more than once keeps its last label.
+        """
+        labels = dict(pairs)
+        return cls(
+            covered=tuple(a for a, label in labels.items() if label == 1),
+            not_covered=tuple(a for a, label in labels.items() if label == 0),
+        )
+
+    def __getitem__(self, aspect: str) -> int:
+        if aspect in self.covered:
+            return 1
+        if aspect in self.not_covered:
+            return 0
+        raise KeyError(aspect)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.covered + self.not_covered)
+
+    def __len__(self) -> int:
+        return len(self.covered) + len(self.not_covered)
+
+
+class _AspectStreamParser:
+    def __init__(self, json_format: bool = None) -> None:
+        """Instantiates an incremental parser of aspect detection responses.
+
+        JSON responses are parsed string by string: a string followed by a
+        colon is a key and selects the list, any other string is an aspect.
+        Plain-text responses (numbered or bulleted lists, with headers,
+        possibly bulleted or bold, announcing the aspects covered and not
+        covered) are parsed line by line.
+
+        Args:
+            json_format (optional): Whether the response is JSON. Defaults to
+              None (detected from the first character of the response).
+        """
+        self._buffer = ""
+        self._position = 0
+        self._json = json_format
+        self._covered = 1
+
+    def feed(self, text: str) -> List[Tuple[str, int]]:
+        """Adds a part of the response.
+
+        Args:
+            text: Next part of the response.
+
+        Returns:
+            (aspect, covered) pairs completed by the part.
+        """
+        self._buffer += text
+        if self._json is None:
+            start = self._buffer.lstrip()
+            if not start:
+                return []
+            self._json = start[0] in "{`"
+        if self._json:
+            return self._parse_json()
+        return self._parse_lines(final=False)
+
+    def close(self) -> List[Tuple[str, int]]:
+        """Returns the pairs of the remaining, unterminated part."""
+        if self._json:
+            # A truncated JSON response may end in a complete string.
+            self._buffer += "]"
+            return self._parse_json()
+        return self._parse_lines(final=True)
+
+    def _parse_json(self) -> List[Tuple[str, int]]:
+        pairs = []
+        while True:
+            # Scanning resumes after the last complete string, so the next
+            # quote always opens a string.
+            start = self._buffer.find('"', self._position)
+            match = _JSON_STRING_PATTERN.match(self._buffer, max(start, 0))
+            if start < 0 or match is None:
+                return pairs
+            value = json.loads('"' + match.group(1) + '"')
+            if match.group(2) == ":":
+                self._covered = 0 if _NOT_COVERED_PATTERN.search(value) else 1
+            elif value:
+                pairs.append((value, self._covered))
+            # The delimiter is not consumed, so that the closing "]" of a
+            # truncated response can be appended after it.
+            self._position = match.end() - 1
+
+    def _parse_lines(self, final: bool) -> List[Tuple[str, int]]:
+        end = len(self._buffer) if final else self._buffer.rfind("\n") + 1
+        lines = self._buffer[self._position : end].splitlines()
+        self._position = end
+        pairs = []
+        for line in lines:
+            line = _EMPHASIS_PATTERN.sub(r"\2", line)
+            match = _LIST_ITEM_PATTERN.match(line)
+            # Headers may be bulleted, e.g., "- Not covered:", so they are
+            # recognized before list items.
+            if match is None or _HEADER_PATTERN.search(match.group(1)):
+                if _NOT_COVERED_PATTERN.search(line):
+                    self._covered = 0
+                elif _HEADER_PATTERN.search(line.strip()):
+                    self._covered = 1
+            elif match.group(1):
+                pairs.append((match.group(1), self._covered))
+        return pairs
+
+
+def _result_from_json(output: Any) -> Optional[AspectDetectionResult]:
+    """Returns the result encoded in a decoded JSON object, if well-formed."""
+    if not isinstance(output, dict):
+        return None
+    covered = output.get("covered") or []
+    not_covered = output.get("not_covered") or []
+    if (
+        isinstance(covered, list)
+        and isinstance(not_covered, list)
+        and all(isinstance(a, str) for a in covered + not_covered)
+    ):
+        return AspectDetectionResult.from_pairs(
+            [(aspect, 1) for aspect in covered]
+            + [(aspect, 0) for aspect in not_covered]
+        )
+    return None
+
+
+def parse_packed_aspects(
+    text: str, item_ids: List[str]
+) -> Dict[str, AspectDetectionResult]:
+    """Parses the response of a packed aspect detection request.
+
+    Args:
+        text: Response of the model, expected to contain a JSON object mapping
+          passage ids to aspect lists.
+        item_ids: Ids of the passages in the request.
+
+    Returns:
+        Detected aspects by passage id. Passages that are missing or
+        malformed in the response are left out.
+    """
+    match = _JSON_OBJECT_PATTERN.search(text or "")
+    if match is None:
+        return {}
+    try:
+        output = json.loads(match.group(0))
+    except ValueError:
+        return {}
+    if not isinstance(output, dict):
+        return {}
+    results = {
+        item_id: _result_from_json(output.get(item_id))
+        for item_id in item_ids
+    }
+    return {
+        item_id: result
+        for item_id, result in results.items()
+        if result is not None
+    }
+
+
+def parse_aspects(text: Optional[str]) -> AspectDetectionResult:
+    """Parses the response of an aspect detection request.
+
+    JSON responses are decoded as a whole; responses that are not valid JSON
+    are parsed as plain-text lists, so a malformed response does not need to
+    be requested again.
+
+    Args:
+        text: Response of the model; None if the response has no content.
+
+    Returns:
+        Detected aspects, empty if the response has no content.
+    """
+    if text is None:
+        return AspectDetectionResult.from_pairs([])
+    match = _JSON_OBJECT_PATTERN.search(text)
+    if match is not None:
+        try:
+            result = _result_from_json(json.loads(match.group(0)))
+        except ValueError:
+            result = None
+        if result is not None:
+            return result
+    parser = _AspectStreamParser(json_format=False)
+    return AspectDetectionResult.from_pairs(
+        parser.feed(text) + parser.close()
+    )
 
 
 class AspectsDetector(ABC):
@@ -27,14 +273,14 @@ class AspectsDetector(ABC):
         pass
 
     @abstractmethod
-    def detect_aspects(self, passage: str,) -> Dict[str, int]:
+    def detect_aspects(self, passage: str,) -> AspectDetectionResult:
         """Lists aspects covered and not covered in a passage.
 
         Args:
             passage: Passage to detect aspects in.
 
         Returns:
-            List of aspects/points of view/facets covered and not covered in the
+            Aspects/points of view/facets covered and not covered in the
             passage.
         """
         raise NotImplementedError
@@ -45,6 +291,7 @@ class GTPAspectsDetector(AspectsDetector):
         self,
         api_key: str = OPENAI_API_KEY,
         gpt_version: str = DEFAULT_GPT_VERSION,
+        json_mode: bool = False,
     ) -> None:
         """Instantiates an aspect detector using OpenAI GPT model.
 
@@ -52,52 +299,208 @@ class GTPAspectsDetector(AspectsDetector):
             api_key: OpenAI API key.
             gpt_version (optional): OpenAI GPT model version. Defaults to
               file-level constant DEFAULT_GPT_VERSION.
+            json_mode (optional): Whether to request a JSON object response
+              format, which needs a model supporting it (e.g., gpt-4o).
+              Otherwise, JSON output is only asked for in the prompt. Defaults
+              to False.
         """  # noqa
         self._openai_client = OpenAI(api_key=api_key)
         self._gpt_version = gpt_version
+        self._json_mode = json_mode
+        self._token_budget = TokenBudget(gpt_version)
+
+    def token_counters(self) -> Dict[str, int]:
+        """Returns the number of calls, used tokens and trimmed inputs."""
+        return self._token_budget.counters()
+
+    def _request(self, content: str, prompt: str) -> Dict:
+        """Returns the parameters of a request with an input that fits."""
+        request = {
+            "model": self._gpt_version,
+            "messages": prompt + [{"role": "user", "content": content}],
+        }
+        if self._json_mode:
+            request["response_format"] = {"type": "json_object"}
+        return request
 
     def detect_aspects(
         self, passage: str, prompt: str = _DEFAULT_PROMPT,
-    ) -> Dict[str, int]:
+    ) -> AspectDetectionResult:
         """Lists aspects covered and not covered in a passage.
 
+        Passages exceeding the context window of the model are trimmed.
+
         Args:
             passage: Passage to detect aspects in.
             prompt (optional): Prompt to use for the OpenAI GPT model.
               Defaults to file-level constant _DEFAULT_PROMPT.
-            
+
         Returns:
-            List of aspects/points of view/facets covered and not covered in the
-            passage.
+            Aspects/points of view/facets covered and not covered in the
+            passage; empty with overflow set if the prompt alone exceeds the
+            context window.
         """
-        input_sample = {
-            "role": "user",
-            "content": "Passage: {}".format(passage),
-        }
-        if (
-            num_tokens_from_messages(
-                prompt + [input_sample], model=self._gpt_version
-            )
-            > 4095
-        ):
-            return "-1"
-        else:
-            response = self._openai_client.chat.completions.create(
-                model=self._gpt_version, messages=prompt + [input_sample],
+        passage = self._token_budget.fit(prompt, "Passage: ", passage)
+        if passage is None:
+            return AspectDetectionResult(overflow=True)
+        response = self._openai_client.chat.completions.create(
+            **self._request("Passage: " + passage, prompt)
+        )
+        self._token_budget.record_usage(getattr(response, "usage", None))
+        return parse_aspects(response.choices[0].message.content)
+
+    def detect_aspects_streaming(
+        self, passage: str, prompt: str = _DEFAULT_PROMPT,
+    ) -> Iterator[Tuple[str, int]]:
+        """Yields aspects of a passage as they are generated.
+
+        Args:
+            passage: Passage to detect aspects in.
+            prompt (optional): Prompt to use for the OpenAI GPT model.
+              Defaults to file-level constant _DEFAULT_PROMPT.
+
+        Yields:
+            Pairs of aspect and 1 (covered in the passage) or 0 (not
+            covered). Nothing is yielded if the prompt alone exceeds the
+            context window.
+        """
+        passage = self._token_budget.fit(prompt, "Passage: ", passage)
+        if passage is None:
+            return
+        stream = self._openai_client.chat.completions.create(
+            stream=True,
+            stream_options={"include_usage": True},
+            **self._request("Passage: " + passage, prompt),
+        )
+        parser = _AspectStreamParser()
+        usage = None
+        try:
+            for chunk in stream:
+                usage = getattr(chunk, "usage", None) or usage
+                if chunk.choices:
+                    yield from parser.feed(chunk.choices[0].delta.content or "")
+            yield from parser.close()
+        finally:
+            stream.close()
+        self._token_budget.record_usage(usage)
+
+    def detect_aspects_batch(
+        self,
+        passages: List[str],
+        max_pack_size: int = 8,
+        max_workers: int = 8,
+        prompt: str = _PACKED_PROMPT,
+    ) -> List[AspectDetectionResult]:
+        """Lists aspects of several passages, packing passages into requests.
+
+        Consecutive passages are packed into a single request as a JSON list
+        of passages with ids, up to max_pack_size passages and the input
+        limit of the model, so that the prompt is sent once per pack. The
+        model is asked for a JSON object with the aspects of every passage
+        id. Passages whose aspects cannot be attributed from the response are
+        requested again in packs split in two, down to single passages, which
+        are detected with detect_aspects. Passages that do not fit a request
+        on their own are also detected with detect_aspects (and trimmed).
+
+        Args:
+            passages: Passages to detect aspects in.
+            max_pack_size (optional): Maximum number of passages per request.
+              Defaults to 8.
+            max_workers (optional): Maximum number of concurrent requests.
+              Defaults to 8.
+            prompt (optional): Prompt for packed requests. Defaults to
+              file-level constant _PACKED_PROMPT.
+
+        Returns:
+            Aspects of every passage, in the order of passages.
+        """
+        limit = self._token_budget.input_limit()
+        base_tokens = self._token_budget.count_messages(
+            prompt, {"role": "user", "content": "Passages: []"}
+        )
+        packs: List[List[int]] = []
+        pack_tokens = base_tokens
+        for i, passage in enumerate(passages):
+            item = json.dumps({"id": str(i), "passage": passage})
+            item_tokens = (
+                self._token_budget.count_text(item) + _TOKENS_PER_PACKED_ITEM
             )
-            system_response = response.choices[0].message.content
+            if (
+                packs
+                and len(packs[-1]) < max_pack_size
+                and pack_tokens + item_tokens <= limit
+            ):
+                packs[-1].append(i)
+                pack_tokens += item_tokens
+            else:
+                packs.append([i])
+                pack_tokens = base_tokens + item_tokens
 
-            response_list = system_response.split("\n")
-            covered = 1
-            aspects = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(self._detect_pack, passages, pack, prompt)
+                for pack in packs
+            ]
+        # All packs are requested even if some await batch results, so that
+        # a single pass records the requests of every pack.
+        results: Dict[int, AspectDetectionResult] = {}
+        pending: Optional[PendingRequestError] = None
+        for future in futures:
+            try:
+                results.update(future.result())
+            except PendingRequestError as e:
+                pending = pending or e
+        if pending is not None:
+            raise pending
+        return [results[i] for i in range(len(passages))]
 
-            for item in response_list:
-                if "not covered in the passage" in item.lower():
-                    covered = 0
-                if len(re.findall("[1-9]\.", item)) > 0:
-                    aspects[re.sub("[1-9]\. ", "", item)] = covered
+    def _detect_pack(
+        self, passages: List[str], pack: List[int], prompt: str
+    ) -> Dict[int, AspectDetectionResult]:
+        """Detects aspects of a pack of passages, splitting it on failures.
 
-            return aspects
+        Args:
+            passages: All passages.
+            pack: Indices of the passages in the pack.
+            prompt: Prompt for packed requests.
+
+        Returns:
+            Aspects by passage index.
+        """
+        if len(pack) == 1:
+            return {pack[0]: self.detect_aspects(passages[pack[0]])}
+        content = "Passages: " + json.dumps(
+            [{"id": str(i), "passage": passages[i]} for i in pack],
+            ensure_ascii=False,
+        )
+        results: Dict[int, AspectDetectionResult] = {}
+        if self._token_budget.count_messages(
+            prompt, {"role": "user", "content": content}
+        ) <= self._token_budget.input_limit():
+            response = self._openai_client.chat.completions.create(
+                **self._request(content, prompt)
+            )
+            self._token_budget.record_usage(getattr(response, "usage", None))
+            parsed = parse_packed_aspects(
+                response.choices[0].message.content, [str(i) for i in pack]
+            )
+            results = {i: parsed[str(i)] for i in pack if str(i) in parsed}
+        missing = [i for i in pack if i not in results]
+        if missing:
+            # Both halves are requested even if the first awaits batch
+            # results, so that a single pass records all split requests.
+            middle = (len(missing) + 1) // 2
+            pending: Optional[PendingRequestError] = None
+            for half in (missing[:middle], missing[middle:]):
+                if not half:
+                    continue
+                try:
+                    results.update(self._detect_pack(passages, half, prompt))
+                except PendingRequestError as e:
+                    pending = pending or e
+            if pending is not None:
+                raise pending
+        return results
 
 
 if __name__ == "__main__":
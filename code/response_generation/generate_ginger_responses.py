@@ -1,269 +1,923 @@
 import argparse
 import ast
+from dataclasses import replace
+from functools import partial
+from itertools import chain, repeat
 
 import pandas as pd
 from transformers import set_seed
 
 from ginger.response_generation.config import OPENAI_API_KEY
-from ginger.response_generation.pipeline.components.clustering import BERTopicClustering
-from ginger.response_generation.pipeline.components.nugget_detection import GPTNuggetDetector
+from ginger.response_generation.pipeline.components.agglomerative_clustering import (
+    AdaptiveClustering,
+)
+from ginger.response_generation.pipeline.components.cached_clustering import (
+    CachedBERTopicClustering,
+)
+from ginger.response_generation.pipeline.components.clustering import (
+    BERTopicClustering,
+)
+from ginger.response_generation.pipeline.components.nugget_detection import (
+    GPTNuggetDetector,
+)
+from ginger.response_generation.pipeline.components.batched_ranker import (
+    BatchedDuoT5Reranker,
+)
 from ginger.response_generation.pipeline.components.ranker import DuoT5Reranker
 from ginger.response_generation.pipeline.components.summarizer import (
-    GPTSummarizer,
+    AsyncGPTSummarizer,
+    SummarizationRequest,
     rephrase_response,
 )
-from ginger.response_generation.utilities.ranking import Query, Ranking, ScoredDocument
+from ginger.response_generation.utilities.ranking import (
+    Query,
+    Ranking,
+    ScoredDocument,
+)
+from ginger.response_generation.utilities.embedding_cache import EmbeddingCache
+from ginger.response_generation.utilities.openai_batch import (
+    BatchingClient,
+    LocalBatchBackend,
+    PendingRequestError,
+    install_batching_client,
+    run_in_batches,
+)
+from ginger.response_generation.utilities.response_cache import ResponseCache
+from response_generation.attribution import AttributionIndex
+from response_generation.batch_nugget_detection import BatchNuggetDetector
+from response_generation.checkpoint import CheckpointStore
+from response_generation.query_scheduler import (
+    CPU_STAGE,
+    IO_STAGE,
+    QueryScheduler,
+)
+from response_generation.response_builder import ResponseBuilder
+
+# Imported under the same name as in the GINGER components, so that their
+# model calls and cache hits are reported to the same profiling stages.
+from response_generation.utilities import profiling
+from response_generation.utilities.profiling import StageProfiler
 
 from nltk import tokenize
 
 set_seed(42)
 
-def main(res_length_limit, baseline):
-    data_sample = pd.read_csv("data/input_queries/input_queries.csv")
+PROMPT_SNIPPETS = [
+    {
+        "role": "system",
+        "content": "Summarize the provided information that answers the query into a single sentence (approximately 20 words). Generate one-sentence long summary that is short, concise and only contains the information that answers the query.",
+    },
+]
+PROMPT_TOP_CLUSTER = [
+    {
+        "role": "system",
+        "content": "Generate the answer to a query that is 3 sentences long (approximately 100 words in total) using the provided information. Use only the provided information. You can expand the provided information but do not add any additional information.",
+    },
+]
+PROMPT_MAIN_ASPECT_EXTRACTION = [
+    {
+        "role": "system",
+        "content": "You are provided with some relevant information to answer the question. Extract from this relevant information the most important aspect to be discussed in an answer to this query. Provide this aspect in a keyword form.",
+    },
+]
+PROMPT_PASSAGES_ZERO_SHOT = [
+    {
+        "role": "system",
+        "content": "Answer the query in 3 sentences (approximately 100 words in total).",
+    },
+]
 
-    queries = []
-    queries_ids = []
-    passages_used = []
-    passages_used_ids = []
-    information_nuggets = []
-    retrieved_clusters = []
-    ranked_clusters = []
-    clusters_summaries = []
-    clusters_based_responses = []
-    passages_summary_zero_shot = []
-    support_passages = []
-    following_clusters = []
-    responses = []
-    sources_ids = []
-    sources = []
-    single_aspect_responses = []
-    remaining_clusters = []
-    additional_aspects = []
+OUTPUT_COLUMNS = [
+    "query_id",
+    "query",
+    "passage_id",
+    "passage",
+    "information_nuggets",
+    "clusters",
+    "ranked_clusters",
+    "clusters_summaries",
+    "clusters_based_response",
+    "ginger_response",
+    "support_passages",
+    "source_ids",
+    "source",
+    "following_clusters",
+    "single_aspect_responses",
+    "remaining_clusters",
+    "additional_aspects",
+]
 
-    ginger_version = "ginger"
-    nugget_detector = GPTNuggetDetector(api_key=OPENAI_API_KEY)
-    clusterer = BERTopicClustering()
-    ranker = DuoT5Reranker()
-    summarizer = GPTSummarizer(api_key=OPENAI_API_KEY)
-
-    for _, row in data_sample.iterrows():
-        data_so_far = pd.DataFrame()
-        query = row["query"]
-        queries.append(query)
-        query_id = str(row["topic_id"]) + str(row["turn_id"])
-        queries_ids.append(query_id)
-        passages = ast.literal_eval(row["passages"])
-        passages_used.append(passages)
-        passage_ids = [1,2,3]
-        passages_used_ids.append(passage_ids)
-
-        information_nuggets_per_doc = {}
-        query_information_nuggets = []
-        for passage, passage_id in zip(passages, passage_ids):
-            detected_nuggets = nugget_detector.detect_nuggets(query, passage)
-            information_nuggets_per_doc[passage_id] = detected_nuggets
-            query_information_nuggets.extend(detected_nuggets)
-        
-        information_nuggets.append(information_nuggets_per_doc)
-
-        print("------------------")
-        print("Generating response for query: " + query + " ID: " + query_id)
-        if len(query_information_nuggets) <= 1:
-            retrieved_clusters.append([])
-            ranked_clusters.append([])
-            clusters_summaries.append([])
-            clusters_based_responses.append([])
-            if baseline:
-                passages_summary_zero_shot.append([])
-        else:
-            if len(query_information_nuggets) >= 4:
-                clusters = clusterer.cluster(query_information_nuggets)
-                information_nugget_clusters = []
-                for cluster_id in list(set(clusters["Topic"])):
-                    cluster_docs = list(
-                        clusters[clusters["Topic"] == cluster_id]["Document"]
-                    )
-                    doc = ScoredDocument(
-                        cluster_id, "; ".join(cluster_docs), len(cluster_docs)
-                    )
-                    information_nugget_clusters.append(doc)
-            else:
-                information_nugget_clusters = []
-                for cluster_id in range(0, len(query_information_nuggets)):
-                    doc = ScoredDocument(
-                        cluster_id, query_information_nuggets[cluster_id]
-                    )
-                    information_nugget_clusters.append(doc)
-
-            retrieved_clusters.append(
-                [
-                    (cluster.doc_id, cluster.content)
-                    for cluster in information_nugget_clusters
-                ]
-            )
+# Settings of the clustering over cached embeddings. The upstream
+# BERTopicClustering does not expose its configuration, so it is spelled out
+# here and must be kept in line with it: --embedding_cache_path changes how
+# embeddings are obtained, not how nuggets are clustered.
+CACHED_CLUSTERING_SETTINGS = {
+    "embedding_model": "all-MiniLM-L6-v2",
+    "n_neighbors": 3,
+    "n_components": 2,
+    "min_cluster_size": 2,
+    "seed": 42,
+}
+
+# Models used by the CPU-bound stage, loaded once per worker process.
+_clusterer = None
+_ranker = None
+
+
+def init_cpu_worker(
+    reranker="duot5", top_k=4, embedding_cache_path=None, small_input_size=0
+):
+    """Loads the clustering and reranking models in the current process.
+
+    With reranker "batched_duot5", clusters are pruned with monoT5 and only
+    the top_k positions are ranked exactly with batched duoT5 comparisons.
+    With an embedding cache path, nuggets are clustered over cached
+    embeddings, with the clustering models kept loaded across queries. With
+    a positive small_input_size, queries with at most that many nuggets are
+    clustered with lightweight agglomerative clustering; larger queries keep
+    the clustering used without it.
+    """
+    global _clusterer, _ranker
+    cached_clusterer = CachedBERTopicClustering(
+        embedding_cache=EmbeddingCache(embedding_cache_path)
+        if embedding_cache_path
+        else None,
+        **CACHED_CLUSTERING_SETTINGS,
+    )
+    _clusterer = (
+        cached_clusterer if embedding_cache_path else BERTopicClustering()
+    )
+    if small_input_size > 0:
+        # Only small inputs are clustered differently; larger ones keep the
+        # clustering chosen above.
+        _clusterer = AdaptiveClustering(
+            _clusterer, cached_clusterer, small_input_size=small_input_size
+        )
+    if reranker == "batched_duot5":
+        _ranker = BatchedDuoT5Reranker(top_k=top_k)
+    else:
+        _ranker = DuoT5Reranker()
+
+
+def get_query_id(row):
+    """Returns the identifier of an input query."""
+    return str(row["topic_id"]) + str(row["turn_id"])
+
+
+def detect_query_nuggets(row, nugget_detector):
+    """Detects information nuggets in the passages of a query (API-bound)."""
+    query = row["query"]
+    query_id = get_query_id(row)
+    passages = ast.literal_eval(row["passages"])
+    passage_ids = [1, 2, 3]
+
+    information_nuggets_per_doc = dict(
+        zip(passage_ids, nugget_detector.detect_nuggets_many(query, passages))
+    )
 
-            information_nuggets_ranking = Ranking(
-                query_id=query_id, scored_docs=information_nugget_clusters
+    return {
+        "query_id": query_id,
+        "query": query,
+        "passage_id": passage_ids,
+        "passage": passages,
+        "information_nuggets": information_nuggets_per_doc,
+    }
+
+
+def cluster_and_rank(record):
+    """Clusters the nuggets of a query and reranks the clusters (CPU-bound)."""
+    # Seeded for every query, so that its clusters do not depend on the
+    # queries run before it in the same worker process.
+    set_seed(42)
+    query_information_nuggets = [
+        nugget
+        for nuggets in record["information_nuggets"].values()
+        for nugget in nuggets
+    ]
+    record["clusters"] = []
+    record["ranked_clusters"] = []
+    record["cluster_nuggets"] = {}
+    if len(query_information_nuggets) <= 1:
+        return record
+
+    if len(query_information_nuggets) >= 4:
+        with profiling.stage("clustering"):
+            clusters = _clusterer.cluster(query_information_nuggets)
+        information_nugget_clusters = []
+        for cluster_id in list(set(clusters["Topic"])):
+            cluster_docs = list(
+                clusters[clusters["Topic"] == cluster_id]["Document"]
             )
-            clusters_ranking = ranker.rerank(
-                Query(query_id, query),
-                information_nuggets_ranking,
-                len(clusters),
+            doc = ScoredDocument(
+                cluster_id, "; ".join(cluster_docs), len(cluster_docs)
             )
-            clusters_ranking_docs = clusters_ranking.documents()
-            ranked_clusters.append(
-                [
-                    (cluster_id, cluster_content)
-                    for cluster_id, cluster_content in zip(
-                        clusters_ranking_docs[0], clusters_ranking_docs[1]
-                    )
-                ]
+            information_nugget_clusters.append(doc)
+            record["cluster_nuggets"][cluster_id] = cluster_docs
+    else:
+        information_nugget_clusters = []
+        for cluster_id in range(0, len(query_information_nuggets)):
+            doc = ScoredDocument(
+                cluster_id, query_information_nuggets[cluster_id]
             )
-
-            prompt_snippets = [
-                {
-                    "role": "system",
-                    "content": "Summarize the provided information that answers the query into a single sentence (approximately 20 words). Generate one-sentence long summary that is short, concise and only contains the information that answers the query.",
-                },
+            information_nugget_clusters.append(doc)
+            record["cluster_nuggets"][cluster_id] = [
+                query_information_nuggets[cluster_id]
             ]
 
-            support_passage = {}
-
-            summaries = []
-            length_limit_reached = False
-            for cluster_id, cluster_content in zip(
-                clusters_ranking_docs[0], clusters_ranking_docs[1]
-            ):
-                if not length_limit_reached:
-                    cluster_summary = summarizer.summarize_passages(
-                        query=query,
-                        passages=cluster_content,
-                        prompt=prompt_snippets,
-                        max_length=1000,
-                    )
-                    summaries.append(cluster_summary)
-        
-                    response_till_now = " ".join(summaries)
-
-                    if len(response_till_now.split()) > 400 or len(summaries) > res_length_limit:
-                        summaries = summaries[:-1]
-                        length_limit_reached = True
-                    else:
-                        support_passage[cluster_content] = []
-                        for doc_id, nuggets in information_nuggets_per_doc.items():
-                            if any(nugget in cluster_content for nugget in nuggets):
-                                support_passage[cluster_content].append(doc_id)
-
-            response = ""      
-            for summary, sup_passages in zip(summaries, support_passage.values()):
-                response += summary +  " " + str(sup_passages) + " "
-            responses.append(response)
-
-            source = []
-            for s_ps in support_passage.values():
-                source.extend(s_ps)
-            source = list(set(source))
-            sources_ids.append(source)
-            sources.append(["[" + str(i) + "] " + passages[i-1] for i in source])
-            
-            if len(clusters_ranking_docs[1]) >= 4:
-                following_clusters.append(clusters_ranking_docs[1][3])
-            elif len(clusters_ranking_docs[1]) == 3:
-                following_clusters.append("all clusters used")
-            else:
-                following_clusters.append("fewer than 3 clusters found")
-            clusters_summaries.append(summaries)
-            clusters_based_responses.append(" ".join(summaries[:res_length_limit]))
-            support_passages.append(support_passage)
-
-            prompt_top_cluster = [
-                {
-                    "role": "system",
-                    "content": "Generate the answer to a query that is 3 sentences long (approximately 100 words in total) using the provided information. Use only the provided information. You can expand the provided information but do not add any additional information.",
-                },
-            ]
-            single_aspect_response = summarizer.summarize_passages(
-                query=query,
-                passages=clusters_ranking_docs[1][0],
-                prompt=prompt_top_cluster,
+    record["clusters"] = [
+        (cluster.doc_id, cluster.content)
+        for cluster in information_nugget_clusters
+    ]
+
+    information_nuggets_ranking = Ranking(
+        query_id=record["query_id"], scored_docs=information_nugget_clusters
+    )
+    with profiling.stage("reranking"):
+        clusters_ranking = _ranker.rerank(
+            Query(record["query_id"], record["query"]),
+            information_nuggets_ranking,
+            len(information_nugget_clusters),
+        )
+    clusters_ranking_docs = clusters_ranking.documents()
+    record["ranked_clusters"] = [
+        (cluster_id, cluster_content)
+        for cluster_id, cluster_content in zip(
+            clusters_ranking_docs[0], clusters_ranking_docs[1]
+        )
+    ]
+    return record
+
+
+def empty_responses(record, baseline):
+    """Fills in the responses of a query without clusters."""
+    record.update(
+        {
+            "clusters_summaries": [],
+            "clusters_based_response": "",
+            "ginger_response": "",
+            "support_passages": {},
+            "source_ids": [],
+            "source": [],
+            "following_clusters": "fewer than 3 clusters found",
+            "single_aspect_responses": "",
+            "remaining_clusters": [],
+            "additional_aspects": "",
+        }
+    )
+    if baseline:
+        record["baseline_zero_shot"] = ""
+    return record
+
+
+def cluster_summary_request(query, cluster_content):
+    """Returns the request summarizing a cluster into a response sentence."""
+    return replace(
+        SummarizationRequest.passages(
+            query, cluster_content, PROMPT_SNIPPETS, max_length=1000
+        ),
+        stage="cluster_summaries",
+    )
+
+
+def independent_requests(
+    query, passages, ranked_cluster_contents, summarized_clusters, baseline
+):
+    """Returns the requests of a query that do not depend on each other.
+
+    These are the summaries of the clusters predicted to fit the response,
+    the single-aspect response, the aspect extraction and the baseline.
+    """
+    requests = [
+        cluster_summary_request(query, cluster_content)
+        for _, cluster_content in summarized_clusters
+    ]
+    requests.append(
+        replace(
+            SummarizationRequest.passages(
+                query,
+                ranked_cluster_contents[0],
+                PROMPT_TOP_CLUSTER,
                 max_length=1000,
-            )
-            single_aspect_responses.append(single_aspect_response)
-            remaining_clusters.append(clusters_ranking_docs[1][:1])
-
-            prompt_main_aspect_extraction = [
-                {
-                    "role": "system",
-                    "content": "You are provided with some relevant information to answer the question. Extract from this relevant information the most important aspect to be discussed in an answer to this query. Provide this aspect in a keyword form.",
-                },
-            ]
-            additional_aspect = summarizer.summarize_aspects(
-                query=query,
-                passages=" ".join(clusters_ranking_docs[1][:1]),
-                prompt=prompt_main_aspect_extraction,
+            ),
+            stage="single_aspect_response",
+        )
+    )
+    requests.append(
+        replace(
+            SummarizationRequest.aspects(
+                query,
+                " ".join(ranked_cluster_contents[:1]),
+                PROMPT_MAIN_ASPECT_EXTRACTION,
                 max_length=1000,
+            ),
+            stage="aspect_extraction",
+        )
+    )
+    if baseline:
+        requests.append(
+            replace(
+                SummarizationRequest.passages(
+                    query,
+                    "".join(passages),
+                    PROMPT_PASSAGES_ZERO_SHOT,
+                    max_length=1000,
+                ),
+                stage="baseline",
             )
-            additional_aspects.append(additional_aspect)
-            
-            if baseline:
-                prompt_passages_zero_shot = [
-                    {
-                        "role": "system",
-                        "content": "Answer the query in 3 sentences (approximately 100 words in total).",
-                    },
-                ]
-
-                passages_summary_zero_shot.append(
-                    summarizer.summarize_passages(
-                        query=query,
-                        passages="".join(passages),
-                        prompt=prompt_passages_zero_shot,
-                        max_length=1000,
-                    )
-                )
-        
-        data_so_far["query_id"] = queries_ids
-        data_so_far["query"] = queries
-        data_so_far["passage_id"] = passages_used_ids
-        data_so_far["passage"] = passages_used
-        data_so_far["information_nuggets"] = information_nuggets
-        data_so_far["clusters"] = retrieved_clusters
-        data_so_far["ranked_clusters"] = ranked_clusters
-        data_so_far["clusters_summaries"] = clusters_summaries
-        data_so_far["clusters_based_response"] = clusters_based_responses
-        data_so_far["ginger_response"] = responses
-        data_so_far["support_passages"] = support_passages
-        data_so_far["source_ids"] = sources_ids
-        data_so_far["source"] = sources
-        data_so_far["following_clusters"] = following_clusters
-        data_so_far["single_aspect_responses"] = single_aspect_responses
-        data_so_far["remaining_clusters"] = remaining_clusters
-        data_so_far["additional_aspects"] = additional_aspects
-        if baseline:
-            data_so_far["baseline_zero_shot"] = passages_summary_zero_shot
-        
-        top_n = 3
-        data_so_far.to_csv("res_" + ginger_version + "_top_+ " + str(top_n) + "-" + str(res_length_limit) + "_sentences_max" + "-output.csv",index=False)
-
-    rephrased_ginger_responses =  rephrase_response(
-        data_so_far, "clusters_based_response", summarizer
-    )
-    data_so_far["rephrased_clusters_based_response"] = rephrased_ginger_responses
+        )
+    return requests
+
+
+def build_response(
+    record,
+    summarizer,
+    builder,
+    summarized_clusters,
+    cluster_summaries,
+    attribution_index,
+):
+    """Adds cluster summaries to a response until it reaches its limit.
+
+    Summaries requested upfront are added first. Further summaries may not
+    fit, so they are streamed one at a time and cancelled as soon as the
+    response would exceed the word limit.
+
+    Returns:
+        Supporting passages by the content of every summarized cluster.
+    """
+    support_passage = {}
+    for (cluster_id, cluster_content), cluster_summary in zip(
+        summarized_clusters, cluster_summaries
+    ):
+        if not builder.add(cluster_summary):
+            return support_passage
+        support_passage[cluster_content] = attribution_index.supporting_docs(
+            cluster_id
+        )
+
+    remaining_clusters = record["ranked_clusters"][len(summarized_clusters) :]
+    for cluster_id, cluster_content in remaining_clusters:
+        if builder.closed:
+            break
+        cluster_summary = summarizer.summarize_streaming(
+            cluster_summary_request(record["query"], cluster_content),
+            stop=builder.exceeds_budget,
+        )
+        if cluster_summary is None or not builder.add(cluster_summary):
+            break
+        support_passage[cluster_content] = attribution_index.supporting_docs(
+            cluster_id
+        )
+    return support_passage
+
+
+def following_clusters(ranked_cluster_contents):
+    """Returns the cluster following those used in the response."""
+    if len(ranked_cluster_contents) >= 4:
+        return ranked_cluster_contents[3]
+    elif len(ranked_cluster_contents) == 3:
+        return "all clusters used"
+    return "fewer than 3 clusters found"
+
+
+def summarize_query(record, summarizer, res_length_limit, baseline):
+    """Generates the responses of a query from its clusters (API-bound)."""
+    query = record["query"]
+    passages = record["passage"]
+    ranked_cluster_contents = [
+        cluster_content for _, cluster_content in record["ranked_clusters"]
+    ]
+
+    print("------------------")
+    print(
+        "Generating response for query: " + query + " ID: " + record["query_id"]
+    )
+    if not ranked_cluster_contents:
+        return empty_responses(record, baseline)
+
+    # Cluster summaries predicted to fit the response, the single-aspect
+    # response, the aspect extraction and the baseline are independent, so
+    # they are requested concurrently.
+    builder = ResponseBuilder(max_words=400, max_summaries=res_length_limit)
+    num_speculative = builder.expected_to_fit(len(record["ranked_clusters"]))
+    summarized_clusters = record["ranked_clusters"][:num_speculative]
+    results = summarizer.summarize_many_sync(
+        independent_requests(
+            query,
+            passages,
+            ranked_cluster_contents,
+            summarized_clusters,
+            baseline,
+        )
+    )
+    single_aspect_response, additional_aspect = results[
+        num_speculative : num_speculative + 2
+    ]
+
+    attribution_index = AttributionIndex(record["information_nuggets"])
+    for cluster_id, nuggets in record["cluster_nuggets"].items():
+        attribution_index.add_cluster(cluster_id, nuggets)
+    support_passage = build_response(
+        record,
+        summarizer,
+        builder,
+        summarized_clusters,
+        results[:num_speculative],
+        attribution_index,
+    )
+    summaries = builder.summaries
+
+    response = ""
+    for summary, sup_passages in zip(summaries, support_passage.values()):
+        response += summary + " " + str(sup_passages) + " "
+    record["ginger_response"] = response
+
+    source = []
+    for s_ps in support_passage.values():
+        source.extend(s_ps)
+    source = list(set(source))
+    record["source_ids"] = source
+    record["source"] = ["[" + str(i) + "] " + passages[i - 1] for i in source]
+
+    record["following_clusters"] = following_clusters(ranked_cluster_contents)
+    record["clusters_summaries"] = summaries
+    record["clusters_based_response"] = " ".join(summaries[:res_length_limit])
+    record["support_passages"] = support_passage
+
+    record["single_aspect_responses"] = single_aspect_response
+    record["remaining_clusters"] = ranked_cluster_contents[:1]
+
+    record["additional_aspects"] = additional_aspect
+
+    if baseline:
+        record["baseline_zero_shot"] = results[-1]
+    return record
+
+
+# Key of the profiling trace carried by a query record between stages.
+TRACE_KEY = "_trace"
+
+
+def run_profiled_stage(stage_name, stage_function, new_trace, job):
+    """Runs a stage of a query within its profiling trace.
+
+    The trace is created by new_trace(query_id) in the first stage and
+    carried in the query record to the following stages.
+    """
+    if isinstance(job, dict):
+        trace = job.pop(TRACE_KEY)
+    else:
+        trace = new_trace(get_query_id(job))
+    with trace.stage(stage_name):
+        result = stage_function(job)
+    if isinstance(result, dict):
+        result[TRACE_KEY] = trace
+    return result
+
+
+class DeferredJob:
+    """Placeholder output of a query waiting for batch results."""
+
+
+def skip_pending(stage_function, job):
+    """Runs a stage, deferring the query if a request awaits batch results."""
+    if isinstance(job, DeferredJob):
+        return job
+    try:
+        return stage_function(job)
+    except PendingRequestError:
+        return DeferredJob()
+
+
+def make_stages(nugget_detector, summarizer, res_length_limit, baseline):
+    """Returns the stages of the pipeline with their types."""
+    return [
+        (
+            partial(detect_query_nuggets, nugget_detector=nugget_detector),
+            IO_STAGE,
+        ),
+        (cluster_and_rank, CPU_STAGE),
+        (
+            partial(
+                summarize_query,
+                summarizer=summarizer,
+                res_length_limit=res_length_limit,
+                baseline=baseline,
+            ),
+            IO_STAGE,
+        ),
+    ]
+
+
+def profile_stages(stages, stage_profiler):
+    """Wraps the stages of the pipeline to record a trace of every query."""
+    stage_names = [
+        "nugget_detection",
+        "clustering_and_reranking",
+        "summarization",
+    ]
+    return [
+        (
+            partial(
+                run_profiled_stage,
+                stage_name,
+                stage_function,
+                # The profiler holds the open trace file and cannot be sent
+                # to worker processes, unlike its trace factory.
+                stage_profiler.trace_factory(),
+            ),
+            stage_type,
+        )
+        for stage_name, (stage_function, stage_type) in zip(stage_names, stages)
+    ]
+
+
+def add_rephrased_responses(
+    data_so_far, summarizer, stage_profiler, rephrase_pack_size
+):
+    """Adds the rephrased responses, with and without supporting passages."""
+    run_trace = (
+        stage_profiler.new_trace("all")
+        if stage_profiler is not None
+        else profiling.QueryTrace("all")
+    )
+    with run_trace.stage("rephrasing"):
+        rephrased_ginger_responses = rephrase_response(
+            data_so_far,
+            "clusters_based_response",
+            summarizer,
+            pack_size=rephrase_pack_size,
+        )
+    if stage_profiler is not None:
+        stage_profiler.add(run_trace)
+    data_so_far[
+        "rephrased_clusters_based_response"
+    ] = rephrased_ginger_responses
     rephrased_ginger_responses_sup = []
-    for res, sup_pas in zip(rephrased_ginger_responses, support_passages):
+    for res, sup_pas in zip(
+        rephrased_ginger_responses, data_so_far["support_passages"]
+    ):
         rep_res = ""
         for res_sent, s in zip(tokenize.sent_tokenize(res), sup_pas.values()):
             rep_res += res_sent + " " + str(s) + " "
         rephrased_ginger_responses_sup.append(rep_res)
     data_so_far["rephrased_ginger_responses"] = rephrased_ginger_responses_sup
-    data_so_far.to_csv("data/generated_responses/ginger_responses.csv",index=False)
+
+
+def generate_responses(
+    resume,
+    data_sample,
+    scheduler,
+    stages,
+    checkpoint,
+    columns,
+    summarizer,
+    stage_profiler=None,
+    rephrase_pack_size=1,
+):
+    """Runs the pipeline on all queries not yet in the checkpoint.
+
+    Raises:
+        PendingRequestError: If queries wait for batch results.
+    """
+    if resume:
+        completed_query_ids = checkpoint.recover()
+        print(
+            "Resuming: "
+            + str(len(completed_query_ids))
+            + " queries already done"
+        )
+    else:
+        checkpoint.reset()
+        completed_query_ids = set()
+
+    rows = [row for _, row in data_sample.iterrows()]
+    query_ids = [get_query_id(row) for row in rows]
+    pending_rows = [
+        row
+        for row, query_id in zip(rows, query_ids)
+        if query_id not in completed_query_ids
+    ]
+    num_deferred = 0
+    for _, record in scheduler.run(pending_rows, stages):
+        if isinstance(record, DeferredJob):
+            num_deferred += 1
+            continue
+        trace = record.pop(TRACE_KEY, None)
+        if trace is not None:
+            stage_profiler.add(trace)
+        checkpoint.append(record)
+    if num_deferred:
+        raise PendingRequestError(
+            str(num_deferred) + " queries wait for batch results"
+        )
+
+    data_so_far = pd.DataFrame(
+        checkpoint.ordered_records(query_ids), columns=columns
+    )
+    add_rephrased_responses(
+        data_so_far, summarizer, stage_profiler, rephrase_pack_size
+    )
+    data_so_far.to_csv(
+        "data/generated_responses/ginger_responses.csv", index=False
+    )
+
+
+def run_batch_passes(
+    generate, resume, batching_client, batch, batch_dir, batch_poll_interval
+):
+    """Runs response generation with GPT requests as batch jobs.
+
+    Every pass after the first one resumes from the checkpoint, so only
+    deferred queries are run again.
+    """
+    resume_flags = chain([resume], repeat(True))
+    if batch == "local":
+        backend = LocalBatchBackend()
+    else:
+        from openai import OpenAI
+
+        backend = OpenAI(api_key=OPENAI_API_KEY)
+    run_in_batches(
+        lambda: generate(next(resume_flags)),
+        batching_client,
+        backend,
+        batch_dir,
+        poll_interval=batch_poll_interval,
+    )
+
+
+def main(
+    res_length_limit,
+    baseline,
+    cache_path=None,
+    replay=False,
+    max_concurrency=8,
+    num_workers=1,
+    resume=False,
+    reranker="duot5",
+    embedding_cache_path=None,
+    small_input_size=0,
+    rephrase_pack_size=1,
+    batch=None,
+    batch_dir="data/cache/batches",
+    batch_poll_interval=30.0,
+    trace_path=None,
+    profile_stage=None,
+    profiler="cprofile",
+):
+    data_sample = pd.read_csv("data/input_queries/input_queries.csv")
+
+    ginger_version = "ginger"
+    gpt_nugget_detector = GPTNuggetDetector(api_key=OPENAI_API_KEY)
+    nugget_detector = BatchNuggetDetector(
+        gpt_nugget_detector, max_workers=max_concurrency
+    )
+    cache = ResponseCache(cache_path, replay=replay) if cache_path else None
+    summarizer = AsyncGPTSummarizer(
+        api_key=OPENAI_API_KEY, cache=cache, max_concurrency=max_concurrency
+    )
+    columns = OUTPUT_COLUMNS + (["baseline_zero_shot"] if baseline else [])
+
+    # The response uses the top res_length_limit + 1 clusters and reports the
+    # fourth one as the following cluster.
+    scheduler = QueryScheduler(
+        num_workers=num_workers,
+        cpu_initializer=partial(
+            init_cpu_worker,
+            reranker=reranker,
+            top_k=max(res_length_limit + 1, 4),
+            embedding_cache_path=embedding_cache_path,
+            small_input_size=small_input_size,
+        ),
+    )
+    stages = make_stages(
+        nugget_detector, summarizer, res_length_limit, baseline
+    )
+    stage_profiler = None
+    if trace_path:
+        stage_profiler = StageProfiler(
+            trace_path, capture_stage=profile_stage, profiler=profiler
+        )
+        profiling.instrument_client(gpt_nugget_detector)
+        stages = profile_stages(stages, stage_profiler)
+    if batch is not None:
+        batching_client = BatchingClient()
+        install_batching_client(gpt_nugget_detector, batching_client)
+        install_batching_client(summarizer, batching_client)
+        stages = [
+            (partial(skip_pending, stage_function), stage_type)
+            for stage_function, stage_type in stages
+        ]
+
+    top_n = 3
+    checkpoint = CheckpointStore(
+        "res_"
+        + ginger_version
+        + "_top_"
+        + str(top_n)
+        + "-"
+        + str(res_length_limit)
+        + "_sentences_max"
+        + "-checkpoint.jsonl"
+    )
+    generate = partial(
+        generate_responses,
+        data_sample=data_sample,
+        scheduler=scheduler,
+        stages=stages,
+        checkpoint=checkpoint,
+        columns=columns,
+        summarizer=summarizer,
+        stage_profiler=stage_profiler,
+        rephrase_pack_size=rephrase_pack_size,
+    )
+    if batch is None:
+        generate(resume)
+    else:
+        run_batch_passes(
+            generate,
+            resume,
+            batching_client,
+            batch,
+            batch_dir,
+            batch_poll_interval,
+        )
+
+    if stage_profiler is not None:
+        print(stage_profiler.summary())
+        stage_profiler.close()
+    nugget_detector.close()
+    summarizer.close()
+    if cache is not None:
+        print("Response cache: " + str(cache.stats()))
+        cache.close()
 
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description='Generate responses for TREC-RAG queries')
-    parser.add_argument('--res_length_limit', type=int, help='Maximum length of the response in sentences. Use 100 if you want to limit the response to 400 words.')
-    parser.add_argument('--baseline', action='store_true', help='Whether to generate baseline responses')
+    parser = argparse.ArgumentParser(
+        description="Generate responses for TREC-RAG queries"
+    )
+    parser.add_argument(
+        "--res_length_limit",
+        type=int,
+        help=(
+            "Maximum length of the response in sentences. Use 100 if you want "
+            "to limit the response to 400 words."
+        ),
+    )
+    parser.add_argument(
+        "--baseline",
+        action="store_true",
+        help="Whether to generate baseline responses",
+    )
+    parser.add_argument(
+        "--cache_path",
+        type=str,
+        default="data/cache/gpt_responses.sqlite",
+        help=(
+            "Path to the on-disk GPT response cache. Use an empty string to "
+            "disable caching."
+        ),
+    )
+    parser.add_argument(
+        "--replay",
+        action="store_true",
+        help=(
+            "Serve GPT responses only from the cache (read-only) without "
+            "calling the API"
+        ),
+    )
+    parser.add_argument(
+        "--max_concurrency",
+        type=int,
+        default=8,
+        help="Maximum number of concurrent GPT requests per query",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help=(
+            "Skip queries already stored in the checkpoint of a previous "
+            "(interrupted) run"
+        ),
+    )
+    parser.add_argument(
+        "--reranker",
+        choices=["duot5", "batched_duot5"],
+        default="duot5",
+        help=(
+            "Cluster reranker: full pairwise duoT5, or monoT5 pruning followed "
+            "by batched duoT5 with early termination"
+        ),
+    )
+    parser.add_argument(
+        "--embedding_cache_path",
+        type=str,
+        default=None,
+        help=(
+            "Directory of the nugget embedding cache; clusters over cached "
+            "embeddings when set (e.g., data/cache/nugget_embeddings)"
+        ),
+    )
+    parser.add_argument(
+        "--small_input_size",
+        type=int,
+        default=0,
+        help=(
+            "Cluster queries with at most this many nuggets with agglomerative "
+            "clustering instead of BERTopic (e.g., 15); 0 disables"
+        ),
+    )
+    parser.add_argument(
+        "--rephrase_pack_size",
+        type=int,
+        default=1,
+        help=(
+            "Number of responses rephrased per GPT request (packed as JSON, "
+            "with per-response fallback)"
+        ),
+    )
+    parser.add_argument(
+        "--batch",
+        choices=["openai", "local"],
+        default=None,
+        help=(
+            "Run GPT requests as offline batch jobs via the OpenAI Batch API, "
+            "or a local stand-in endpoint with placeholder responses"
+        ),
+    )
+    parser.add_argument(
+        "--batch_dir",
+        type=str,
+        default="data/cache/batches",
+        help=(
+            "Directory of batch input and output files, with one "
+            "subdirectory per backend; output files found there are reused"
+        ),
+    )
+    parser.add_argument(
+        "--batch_poll_interval",
+        type=float,
+        default=30.0,
+        help="Seconds between batch status checks",
+    )
+    parser.add_argument(
+        "--trace_path",
+        type=str,
+        default=None,
+        help=(
+            "JSONL file for per-query, per-stage timing, model calls, tokens "
+            "and cache hits (e.g., data/traces/ginger_trace.jsonl); a summary "
+            "table is printed at the end"
+        ),
+    )
+    parser.add_argument(
+        "--profile_stage",
+        type=str,
+        default=None,
+        help=(
+            "Stage to capture with a profiler when tracing, e.g., clustering or"
+            " summarization"
+        ),
+    )
+    parser.add_argument(
+        "--profiler",
+        choices=["cprofile", "pyinstrument"],
+        default="cprofile",
+        help=(
+            "Profiler used for --profile_stage; output is written next to the "
+            "trace file"
+        ),
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=1,
+        help=(
+            "Number of queries processed in parallel (process pool for "
+            "clustering and reranking, thread pool for GPT calls)"
+        ),
+    )
 
     args = parser.parse_args()
 
-    main(res_length_limit=3, baseline=True)
\ No newline at end of file
+    main(
+        res_length_limit=3,
+        baseline=True,
+        cache_path=args.cache_path,
+        replay=args.replay,
+        max_concurrency=args.max_concurrency,
+        num_workers=args.num_workers,
+        resume=args.resume,
+        reranker=args.reranker,
+        embedding_cache_path=args.embedding_cache_path,
+        small_input_size=args.small_input_size,
+        rephrase_pack_size=args.rephrase_pack_size,
+        batch=args.batch,
+        batch_dir=args.batch_dir,
+        batch_poll_interval=args.batch_poll_interval,
+        trace_path=args.trace_path,
+        profile_stage=args.profile_stage,
+        profiler=args.profiler,
+    )
@@ -0,0 +1,112 @@
+"""Scheduler running independent per-query pipeline jobs concurrently."""
+
+from concurrent.futures import (
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple
+
+CPU_STAGE = "cpu"
+IO_STAGE = "io"
+
+Stage = Tuple[Callable[[Any], Any], str]
+
+
+class QueryScheduler:
+    def __init__(
+        self,
+        num_workers: int = 1,
+        cpu_initializer: Callable[[], None] = None,
+    ) -> None:
+        """Instantiates a scheduler for multi-stage per-query jobs.
+
+        Each job passes through a sequence of stages, where the output of a
+        stage is the input of the next one. CPU-bound stages (e.g., clustering
+        and reranking) are run in a process pool and API-bound stages (e.g.,
+        GPT calls) in a thread pool. Different jobs are in different stages at
+        the same time, so the total run time approaches that of the slowest
+        job instead of the sum over all jobs.
+
+        Args:
+            num_workers (optional): Number of workers in each pool. With a
+              single worker all stages run serially in the calling process.
+              Defaults to 1.
+            cpu_initializer (optional): Function called once in every worker
+              process (and in the calling process when running serially), e.g.,
+              to load models used by CPU-bound stages. Defaults to None.
+        """
+        self._num_workers = num_workers
+        self._cpu_initializer = cpu_initializer
+
+    def run(
+        self, jobs: Iterable[Any], stages: List[Stage]
+    ) -> Iterator[Tuple[int, Any]]:
+        """Runs all jobs through the stages.
+
+        Args:
+            jobs: Inputs of the first stage, one per job.
+            stages: Pairs of stage function and stage type (CPU_STAGE or
+              IO_STAGE). Functions of CPU stages must be picklable, i.e.,
+              defined at module level.
+
+        Yields:
+            Pairs of job index and output of the last stage, in input order.
+        """
+        jobs = list(jobs)
+        if self._num_workers <= 1:
+            if self._cpu_initializer is not None:
+                self._cpu_initializer()
+            for index, job in enumerate(jobs):
+                for stage_function, _ in stages:
+                    job = stage_function(job)
+                yield index, job
+            return
+
+        with ProcessPoolExecutor(
+            max_workers=self._num_workers, initializer=self._cpu_initializer
+        ) as cpu_pool, ThreadPoolExecutor(
+            max_workers=self._num_workers
+        ) as io_pool:
+            pools = {CPU_STAGE: cpu_pool, IO_STAGE: io_pool}
+            futures = [self._chain(job, stages, pools) for job in jobs]
+            for index, future in enumerate(futures):
+                yield index, future.result()
+
+    def _chain(
+        self, job: Any, stages: List[Stage], pools: Dict[str, Executor]
+    ) -> Future:
+        """Submits a job whose stages are chained through future callbacks.
+
+        Args:
+            job: Input of the first stage.
+            stages: Stage functions with their types.
+            pools: Executors by stage type.
+
+        Returns:
+            Future resolved with the output of the last stage.
+        """
+        result: Future = Future()
+
+        def submit(stage_index: int, stage_input: Any) -> None:
+            stage_function, stage_type = stages[stage_index]
+            future = pools[stage_type].submit(stage_function, stage_input)
+            future.add_done_callback(
+                lambda done: on_done(stage_index, done)
+            )
+
+        def on_done(stage_index: int, done: Future) -> None:
+            error = done.exception()
+            if error is not None:
+                result.set_exception(error)
+            elif stage_index + 1 == len(stages):
+                result.set_result(done.result())
+            else:
+                try:
+                    submit(stage_index + 1, done.result())
+                except Exception as submit_error:  # pool shutting down
+                    result.set_exception(submit_error)
+
+        submit(0, job)
+        return result
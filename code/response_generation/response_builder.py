@@ -0,0 +1,113 @@
+"""Incremental assembly of a response from cluster summaries."""
+
+from typing import List
+
+# Expected length of a cluster summary in words. The summary prompt asks for
+# approximately 20 words; the estimate leaves some margin.
+_EXPECTED_SUMMARY_WORDS = 30
+
+
+def count_words(text: str) -> int:
+    """Returns the number of whitespace-separated words in a text."""
+    return len(text.split())
+
+
+class ResponseBuilder:
+    def __init__(
+        self,
+        max_words: int = 400,
+        max_summaries: int = 3,
+        expected_summary_words: int = _EXPECTED_SUMMARY_WORDS,
+    ) -> None:
+        """Instantiates a builder of a response from cluster summaries.
+
+        Summaries are accepted in order while the response stays within
+        max_words and max_summaries. The word count of the response is kept
+        up to date, so that checking a new summary does not require joining
+        and splitting the response again. The builder is closed by the first
+        summary that does not fit; later summaries are not accepted, as in a
+        response that must follow the ranking of the clusters.
+
+        Args:
+            max_words (optional): Maximum number of words in the response.
+              Defaults to 400.
+            max_summaries (optional): Maximum number of summaries. Defaults to
+              3.
+            expected_summary_words (optional): Length of a summary in words
+              assumed before any summary is accepted. Defaults to 30.
+        """
+        self.max_words = max_words
+        self.max_summaries = max_summaries
+        self._expected_summary_words = expected_summary_words
+        self.summaries: List[str] = []
+        self.word_count = 0
+        self.closed = max_summaries <= 0
+
+    def predict_next_length(self) -> float:
+        """Predicts the length in words of the next summary.
+
+        Returns:
+            Mean length of the accepted summaries, or the expected summary
+            length if none has been accepted yet.
+        """
+        if not self.summaries:
+            return self._expected_summary_words
+        return self.word_count / len(self.summaries)
+
+    def expected_to_fit(self, num_candidates: int) -> int:
+        """Predicts how many of the next summaries will be accepted.
+
+        Args:
+            num_candidates: Number of candidate summaries left.
+
+        Returns:
+            Number of summaries predicted to fit in the remaining budget.
+        """
+        if self.closed:
+            return 0
+        remaining_words = self.max_words - self.word_count
+        predicted = max(self.predict_next_length(), 1)
+        return max(
+            0,
+            min(
+                num_candidates,
+                self.max_summaries - len(self.summaries),
+                int(remaining_words // predicted),
+            ),
+        )
+
+    def exceeds_budget(self, text: str) -> bool:
+        """Checks whether appending text would exceed the word limit.
+
+        The check is monotonic in the text, so it can be applied to a partial
+        summary while it is being generated.
+
+        Args:
+            text: Complete or partial summary.
+
+        Returns:
+            True if the response with the text is longer than max_words.
+        """
+        return self.word_count + count_words(text) > self.max_words
+
+    def add(self, summary: str) -> bool:
+        """Appends a summary if it fits, and closes the builder otherwise.
+
+        Args:
+            summary: Cluster summary.
+
+        Returns:
+            True if the summary was accepted.
+        """
+        if (
+            self.closed
+            or len(self.summaries) >= self.max_summaries
+            or self.exceeds_budget(summary)
+        ):
+            self.closed = True
+            return False
+        self.summaries.append(summary)
+        self.word_count += count_words(summary)
+        if len(self.summaries) >= self.max_summaries:
+            self.closed = True
+        return True
@@ -1,10 +1,199 @@
-import ast
+import argparse
 import pandas as pd
 import random
+from concurrent.futures import ThreadPoolExecutor
 
+from response_generation.config import OPENAI_API_KEY
 from response_generation.detect_response_aspects import GTPAspectsDetector
+from response_generation.utilities.openai_batch import (
+    BatchingClient,
+    LocalBatchBackend,
+    PendingRequestError,
+    install_batching_client,
+    run_in_batches,
+)
 
-def main():
+NO_SOURCES_EXPLANATION = (
+    "This response is based only on the model's internal memory and is not "
+    "grounded in verifiable sources."
+)
+NO_ORIGIN_EXPLANATION = (
+    "The response has no traceable origin, so it's not possible to verify "
+    "each claim against a reliable source."
+)
+MULTIPLE_ASPECTS_EXPLANATION = (
+    "The response covers multiple aspects of the topic, providing a broad "
+    "view."
+)
+SINGLE_ASPECT_EXPLANATION = (
+    "The response focuses on just one aspect and may miss important points "
+    "related to: "
+)
+
+
+def get_compared_responses(explanation_type):
+    """Returns the response columns compared for an explanation type."""
+    if explanation_type == "grounding":
+        return ["ginger_response_support", "llm_zero_shot_response"]
+    elif explanation_type == "source_attribution":
+        return ["ginger_response", "llm_zero_shot_response"]
+    else:
+        return ["ginger_response", "single_aspect_response"]
+
+
+def prefetch_aspects(aspects_detector, responses, pack_size=1):
+    """Requests aspects of all responses; raises if any awaits batch results."""
+    if pack_size > 1:
+        # Every pack is requested even if an earlier one is pending.
+        aspects_detector.detect_aspects_batch(
+            list(dict.fromkeys(responses)), max_pack_size=pack_size
+        )
+        return
+    num_pending = 0
+    for response in dict.fromkeys(responses):
+        try:
+            aspects_detector.detect_aspects(response)
+        except PendingRequestError:
+            num_pending += 1
+    if num_pending:
+        raise PendingRequestError(
+            str(num_pending) + " responses wait for batch results"
+        )
+
+
+def detect_aspects_many(
+    aspects_detector, responses, max_workers=8, pack_size=1
+):
+    """Detects aspects of responses concurrently, once per distinct text.
+
+    Args:
+        aspects_detector: Aspect detector, e.g., GTPAspectsDetector.
+        responses: Response texts, possibly repeated.
+        max_workers (optional): Maximum number of concurrent detection calls.
+          Defaults to 8.
+        pack_size (optional): Maximum number of responses per request. With
+          more than 1, responses are packed with detect_aspects_batch.
+          Defaults to 1.
+
+    Returns:
+        Dictionary mapping every distinct response text to its aspects.
+    """
+    unique_responses = list(dict.fromkeys(responses))
+    if pack_size > 1:
+        aspects = aspects_detector.detect_aspects_batch(
+            unique_responses, max_pack_size=pack_size, max_workers=max_workers
+        )
+        return dict(zip(unique_responses, aspects))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        aspects = executor.map(
+            aspects_detector.detect_aspects, unique_responses
+        )
+        return dict(zip(unique_responses, aspects))
+
+
+def sample_aspects(aspects, num_aspects=4, seed=None):
+    """Samples aspects to show, including at least one covered aspect.
+
+    One covered aspect is drawn first and the remaining aspects are drawn from
+    all other aspects, so a single pass suffices. Lists shorter than
+    num_aspects are returned whole (shuffled), and lists without covered
+    aspects are sampled as they are.
+
+    Args:
+        aspects: Dictionary mapping aspects to 1 (covered) or 0 (not
+          covered).
+        num_aspects (optional): Number of aspects to sample. Defaults to 4.
+        seed (optional): Seed of the sampling, e.g., derived from the row.
+          Defaults to None (not reproducible).
+
+    Returns:
+        Sampled aspects in random order.
+    """
+    rng = random.Random(seed)
+    keys = list(aspects)
+    num_aspects = min(num_aspects, len(keys))
+    covered = [k for k in keys if aspects[k] == 1]
+    if not covered or num_aspects == 0:
+        return rng.sample(keys, num_aspects)
+    first = rng.choice(covered)
+    others = [k for k in keys if k != first]
+    sampled = [first] + rng.sample(others, num_aspects - 1)
+    rng.shuffle(sampled)
+    return sampled
+
+
+def get_sources_and_explanations(row, order):
+    """Returns the sources and explanations shown with the compared responses.
+
+    Args:
+        row: Input row with explanation_type, source and additional_aspects.
+        order: Response columns in the order in which they are shown.
+
+    Returns:
+        Pair of the sources and pair of the explanations of both responses.
+    """
+    if row["explanation_type"] == "source_attribution":
+        if order[0] == "ginger_response_support":
+            return (row["source"], ""), ("", NO_SOURCES_EXPLANATION)
+        return ("", row["source"]), (NO_SOURCES_EXPLANATION, "")
+    elif row["explanation_type"] == "grounding":
+        if order[0] == "ginger_response":
+            return (row["source"], ""), ("", NO_ORIGIN_EXPLANATION)
+        return ("", row["source"]), (NO_ORIGIN_EXPLANATION, "")
+    single_aspect = SINGLE_ASPECT_EXPLANATION + row["additional_aspects"]
+    if order[0] == "ginger_response":
+        return ("", ""), (MULTIPLE_ASPECTS_EXPLANATION, single_aspect)
+    return ("", ""), (single_aspect, MULTIPLE_ASPECTS_EXPLANATION)
+
+
+def run_aspect_batches(
+    aspects_detector,
+    responses,
+    batch,
+    batch_dir,
+    batch_poll_interval,
+    pack_size=1,
+):
+    """Runs all aspect detection requests as batch jobs.
+
+    Args:
+        aspects_detector: Aspect detector, e.g., GTPAspectsDetector. Its
+          requests are routed through a batching client, which afterwards
+          serves them from the batch results.
+        responses: Response texts, possibly repeated.
+        batch: Batch backend, "openai" or "local".
+        batch_dir: Directory of batch input and output files.
+        batch_poll_interval: Seconds between batch status checks.
+        pack_size (optional): Maximum number of responses per request.
+          Defaults to 1.
+    """
+    batching_client = BatchingClient()
+    install_batching_client(aspects_detector, batching_client)
+    if batch == "local":
+        backend = LocalBatchBackend()
+    else:
+        from openai import OpenAI
+
+        backend = OpenAI(api_key=OPENAI_API_KEY)
+    run_in_batches(
+        lambda: prefetch_aspects(
+            aspects_detector, responses, pack_size=pack_size
+        ),
+        batching_client,
+        backend,
+        batch_dir,
+        poll_interval=batch_poll_interval,
+    )
+
+
+def main(
+    batch=None,
+    batch_dir="data/cache/batches",
+    batch_poll_interval=30.0,
+    max_workers=8,
+    seed=0,
+    aspect_pack_size=1,
+):
     data = pd.read_csv("data/user_study/input_responses.csv")
 
     response_1_correct_aspects = []
@@ -24,86 +213,76 @@ def main():
     response_1_explanations = []
     response_2_explanations = []
 
-    aspects_detector = GTPAspectsDetector()
-
+    # The order of the compared responses of every row is drawn first (seeded
+    # per row, like the aspect sampling below), so that the batch prefetch
+    # and the detection below request the same texts in the same order, and
+    # thus in the same packs.
+    orders = []
     for _, row in data.iterrows():
-        if row["explanation_type"] == "grounding":
-            order = ["ginger_response_support", "llm_zero_shot_response"]
-        elif row["explanation_type"] == "source_attribution":
-            order = ["ginger_response", "llm_zero_shot_response"]
-        else:
-            order = ["ginger_response", "single_aspect_response"]
- 
-        random.shuffle(order)
-        response_1 = row[order[0]]
-        response_2 = row[order[1]]
-        responses_1.append(response_1)
-        responses_2.append(response_2)
+        order = get_compared_responses(row["explanation_type"])
+        random.Random("{}-{}".format(seed, row["query_id"])).shuffle(order)
+        orders.append(order)
+        responses_1.append(row[order[0]])
+        responses_2.append(row[order[1]])
         response_1_types.append(order[0])
         response_2_types.append(order[1])
+    compared_responses = responses_1 + responses_2
 
-
-        if row["explanation_type"] == "source_attribution":
-            if order[0] == "ginger_response_support":
-                response_1_sources.append(row["source"])
-                response_1_explanations.append("")
-                response_2_sources.append("")
-                response_2_explanations.append("This response is based only on the model's internal memory and is not grounded in verifiable sources.")
-            else:
-                response_2_sources.append(row["source"])
-                response_2_explanations.append("")
-                response_1_sources.append("")
-                response_1_explanations.append("This response is based only on the model's internal memory and is not grounded in verifiable sources.")
-        elif row["explanation_type"] == "grounding":
-            if order[0] == "ginger_response":
-                response_1_sources.append(row["source"])
-                response_1_explanations.append("")
-                response_2_sources.append("")
-                response_2_explanations.append("The response has no traceable origin, so it's not possible to verify each claim against a reliable source.")
-            else:
-                response_2_sources.append(row["source"])
-                response_2_explanations.append("")
-                response_1_sources.append("")
-                response_1_explanations.append("The response has no traceable origin, so it's not possible to verify each claim against a reliable source.")
-        else:
-            response_1_sources.append("")
-            response_2_sources.append("")
-            if order[0] == "ginger_response":
-                response_1_explanations.append("The response covers multiple aspects of the topic, providing a broad view.")
-                response_2_explanations.append("The response focuses on just one aspect and may miss important points related to: " + row["additional_aspects"])
-            else:
-                response_2_explanations.append("The response covers multiple aspects of the topic, providing a broad view.")
-                response_1_explanations.append("The response focuses on just one aspect and may miss important points related to: " + row["additional_aspects"])
-            
-
-
-        aspects_response_1 = aspects_detector.detect_aspects(response_1)
-        response_1_correct_aspects.append(
-            [k for k in aspects_response_1 if aspects_response_1[k] == 1]
+    aspects_detector = GTPAspectsDetector()
+    if batch is not None:
+        # All aspect detection requests are run as batch jobs first; the
+        # loop below is then served from the batch results.
+        run_aspect_batches(
+            aspects_detector,
+            compared_responses,
+            batch,
+            batch_dir,
+            batch_poll_interval,
+            pack_size=aspect_pack_size,
         )
+
+    for (_, row), order in zip(data.iterrows(), orders):
+        sources, explanations = get_sources_and_explanations(row, order)
+        response_1_sources.append(sources[0])
+        response_2_sources.append(sources[1])
+        response_1_explanations.append(explanations[0])
+        response_2_explanations.append(explanations[1])
+
+    # The same response appears in several conditions, so aspects are
+    # detected once per distinct response, concurrently.
+    response_aspects = detect_aspects_many(
+        aspects_detector,
+        compared_responses,
+        max_workers=max_workers,
+        pack_size=aspect_pack_size,
+    )
+
+    for query_id, response_1, response_2 in zip(
+        data["query_id"], responses_1, responses_2
+    ):
+        aspects_response_1 = response_aspects[response_1]
+        response_1_correct_aspects.append(list(aspects_response_1.covered))
         response_1_incorrect_aspects.append(
-            [k for k in aspects_response_1 if aspects_response_1[k] == 0]
+            list(aspects_response_1.not_covered)
         )
 
-        aspects_response_2 = aspects_detector.detect_aspects(response_2)
-        response_2_correct_aspects.append(
-            [k for k in aspects_response_2 if aspects_response_2[k] == 1]
-        )
+        aspects_response_2 = response_aspects[response_2]
+        response_2_correct_aspects.append(list(aspects_response_2.covered))
         response_2_incorrect_aspects.append(
-            [k for k in aspects_response_2 if aspects_response_2[k] == 0]
+            list(aspects_response_2.not_covered)
         )
 
-        keys_1 = random.sample(list(aspects_response_1), 4)
-        while sum([aspects_response_1[k] for k in keys_1]) == 0:
-            keys_1 = random.sample(list(aspects_response_1), 4)
+        keys_1 = sample_aspects(
+            aspects_response_1, seed="{}-{}-1".format(seed, query_id)
+        )
         response_1_selected_aspects.append(keys_1)
         response_1_selected_aspects_scores.append(
             [aspects_response_1[k] for k in keys_1]
         )
 
-        keys_2 = random.sample(list(aspects_response_2), 4)
-        while sum([aspects_response_2[k] for k in keys_2]) == 0:
-            keys_2 = random.sample(list(aspects_response_2), 4)
+        keys_2 = sample_aspects(
+            aspects_response_2, seed="{}-{}-2".format(seed, query_id)
+        )
         response_2_selected_aspects.append(keys_2)
         response_2_selected_aspects_scores.append(
             [aspects_response_2[k] for k in keys_2]
@@ -118,15 +297,80 @@ def main():
     # data["response_2_correct_aspects"] = response_2_correct_aspects
     # data["response_2_incorrect_aspects"] = response_2_incorrect_aspects
     data["response_1_aspects"] = response_1_selected_aspects
-    data["response_1_selected_aspects_scores"] = response_1_selected_aspects_scores
+    data[
+        "response_1_selected_aspects_scores"
+    ] = response_1_selected_aspects_scores
     data["response_2_aspects"] = response_2_selected_aspects
-    data["response_2_selected_aspects_scores"] = response_2_selected_aspects_scores
+    data[
+        "response_2_selected_aspects_scores"
+    ] = response_2_selected_aspects_scores
     data["response_1_sources"] = response_1_sources
     data["response_2_sources"] = response_2_sources
     data["response_1_explanations"] = response_1_explanations
     data["response_2_explanations"] = response_2_explanations
 
-    data.to_csv("data/user_study/input_responses_w_explanations.csv", index=False)
+    data.to_csv(
+        "data/user_study/input_responses_w_explanations.csv", index=False
+    )
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(
+        description="Generate explanations for the user study responses"
+    )
+    parser.add_argument(
+        "--batch",
+        choices=["openai", "local"],
+        default=None,
+        help=(
+            "Run aspect detection as offline batch jobs via the OpenAI Batch "
+            "API, or a local stand-in endpoint with placeholder responses"
+        ),
+    )
+    parser.add_argument(
+        "--batch_dir",
+        type=str,
+        default="data/cache/batches",
+        help=(
+            "Directory of batch input and output files, with one "
+            "subdirectory per backend; output files found there are reused"
+        ),
+    )
+    parser.add_argument(
+        "--batch_poll_interval",
+        type=float,
+        default=30.0,
+        help="Seconds between batch status checks",
+    )
+    parser.add_argument(
+        "--max_workers",
+        type=int,
+        default=8,
+        help="Maximum number of concurrent aspect detection calls",
+    )
+    parser.add_argument(
+        "--aspect_pack_size",
+        type=int,
+        default=1,
+        help="Maximum number of responses per aspect detection request",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help=(
+            "Seed of the response order and aspect sampling, combined with "
+            "the query id of every row"
+        ),
+    )
+
+    args = parser.parse_args()
+
+    main(
+        batch=args.batch,
+        batch_dir=args.batch_dir,
+        batch_poll_interval=args.batch_poll_interval,
+        max_workers=args.max_workers,
+        seed=args.seed,
+        aspect_pack_size=args.aspect_pack_size,
+    )
@@ -1,127 +1,403 @@
-import pandas as pd
 import ast
+import json
+
+import numpy as np
+import pandas as pd
+
+NUM_ITEMS = 12
+NUM_TRUST_OPTIONS = 5
+NUM_ASPECTS = 4
+
+RELIABLE_RESPONSE_TYPES = ["ginger_response", "ginger_response_support"]
+UNRELIABLE_RESPONSE_TYPES = ["single_aspect_response", "llm_zero_shot_response"]
+
+# Trust preference categories, from most to least trust in the reliable
+# response.
+TRUST_PREFERENCES = [
+    "Trust more reliable response a lot more",
+    "Trust more reliable response slightly more",
+    "Trust both responses about the same",
+    "Trust more unreliable response slightly more",
+    "Trust more unreliable response a lot more",
+]
+# picked_better by trust preference code; the last entry is for items
+# without a preference (code -1).
+PICKED_BETTER = np.array([True, True, -1, False, False, False], dtype=object)
+
+INPUT_COLUMNS = [
+    "Input.question",
+    "Input.answers",
+    "Input.limitations",
+    "Input.aspects",
+]
+
+# Answer column names of every item, built once.
+TRUST_COLUMNS = [
+    ["Answer.query_{}.trust_{}".format(i, j) for j in range(NUM_TRUST_OPTIONS)]
+    for i in range(NUM_ITEMS)
+]
+JUSTIFICATION_COLUMNS = [
+    ["Answer.query_{}-justification".format(i)] for i in range(NUM_ITEMS)
+]
+ASPECT_COLUMNS = [
+    [
+        "Answer.query_{}-response_{}-aspects.aspect_{}".format(
+            i, res_id, aspect_id
+        )
+        for res_id in range(2)
+        for aspect_id in range(NUM_ASPECTS)
+    ]
+    for i in range(NUM_ITEMS)
+]
+
+
+def answer_block(data, columns, fill_value=False):
+    """Stacks the answer columns of all items into one row per item.
+
+    Args:
+        data: MTurk results with one row per submission.
+        columns: Answer column names of every item (same number per item).
+        fill_value (optional): Value of answer columns missing from the
+          results, e.g., aspect checkboxes of items never shown with aspects.
+          Defaults to False.
+
+    Returns:
+        Array of shape (submissions * NUM_ITEMS, columns per item), ordered by
+        submission and then item.
+    """
+    blocks = [
+        data.reindex(columns=item_columns, fill_value=fill_value).to_numpy()
+        for item_columns in columns
+    ]
+    return np.stack(blocks, axis=1).reshape(len(data) * len(columns), -1)
+
+
+def checked_answers(data, columns):
+    """Returns which checkbox answers of every item are checked.
+
+    Unanswered checkboxes (missing values, e.g., in chunks where a column is
+    partly empty) count as unchecked, as in a comparison with True; astype
+    (bool) would turn them into True.
+
+    Args:
+        data: MTurk results with one row per submission.
+        columns: Checkbox column names of every item.
+
+    Returns:
+        Boolean array shaped like answer_block(data, columns).
+    """
+    return np.equal(answer_block(data, columns), True)
+
+
+def parse_literal(value):
+    """Parses a list field, as JSON or else as a Python literal.
+
+    Fields written as JSON are parsed with the (much faster) JSON parser;
+    fields written as Python reprs, e.g., with single-quoted strings, fall
+    back to ast.literal_eval.
+    """
+    try:
+        return json.loads(value)
+    except ValueError:
+        return ast.literal_eval(value)
+
+
+def parse_selected_aspects_scores(scores):
+    """Parses the scores of the aspects shown for a response.
+
+    Scores that are not a list of NUM_ASPECTS values are returned as -1
+    everywhere, so that they never match an answer.
+    """
+    scores = parse_literal(scores)
+    if len(scores) != NUM_ASPECTS:
+        return [-1] * NUM_ASPECTS
+    return scores
+
+
+def classify_trust_preference(trust, reliable_response_id):
+    """Returns picked_better and the trust preference of an item.
+
+    Reference implementation of classify_trust_preferences for a single item.
+
+    Args:
+        trust: Answers to the five trust options (response 0 a lot more,
+          slightly more, same, response 1 slightly more, a lot more).
+        reliable_response_id: Position of the reliable response, "response_0"
+          or "response_1".
+    """
+    picked_0 = trust[0] or trust[1]
+    picked_1 = trust[3] or trust[4]
+    picked_tie = trust[2]
+
+    trust_preference = None
+
+    if (
+        reliable_response_id == "response_0"
+        and picked_0
+        or reliable_response_id == "response_1"
+        and picked_1
+    ):
+        picked_better = True
+        if trust[0] or trust[4]:
+            trust_preference = "Trust more reliable response a lot more"
+        elif trust[1] or trust[3]:
+            trust_preference = "Trust more reliable response slightly more"
+    elif picked_tie:
+        picked_better = -1
+        trust_preference = "Trust both responses about the same"
+    else:
+        picked_better = False
+        if trust[0] or trust[4]:
+            trust_preference = "Trust more unreliable response a lot more"
+        elif trust[1] or trust[3]:
+            trust_preference = "Trust more unreliable response slightly more"
+
+    return picked_better, trust_preference
+
+
+def classify_trust_preferences(trust, reliable_positions):
+    """Classifies the trust preferences of many items at once.
+
+    Args:
+        trust: Boolean matrix with one row per item and one column per trust
+          option (response 0 a lot more, slightly more, same, response 1
+          slightly more, a lot more).
+        reliable_positions: Position of the reliable response of every item,
+          0 or 1.
+
+    Returns:
+        Categorical with categories TRUST_PREFERENCES, missing for items
+        without an answer. PICKED_BETTER[codes] gives picked_better.
+    """
+    trust = np.asarray(trust, dtype=bool)
+    reliable_positions = np.asarray(reliable_positions)
+    picked_reliable = np.where(
+        reliable_positions == 0,
+        trust[:, 0] | trust[:, 1],
+        trust[:, 3] | trust[:, 4],
+    )
+    a_lot = trust[:, 0] | trust[:, 4]
+    slightly = trust[:, 1] | trust[:, 3]
+    # Conditions are checked in order; an item that picked the reliable
+    # response always has a_lot or slightly set.
+    codes = np.select(
+        [
+            picked_reliable & a_lot,
+            picked_reliable & slightly,
+            trust[:, 2],
+            a_lot,
+            slightly,
+        ],
+        [0, 1, 2, 4, 3],
+        default=-1,
+    )
+    return pd.Categorical.from_codes(codes, categories=TRUST_PREFERENCES)
+
+
+def process_submissions(data, input_data):
+    """Turns MTurk submissions into one record per judged item.
+
+    Args:
+        data: MTurk results with one row per submission of NUM_ITEMS items.
+        input_data: Study inputs with one row per query.
+
+    Returns:
+        Study results with one row per submission and item.
+    """
+    items = pd.DataFrame(
+        {
+            column: data[column].map(
+                lambda value: parse_literal(value)[:NUM_ITEMS]
+            )
+            for column in INPUT_COLUMNS
+        }
+    )
+    items["WorkerId"] = data["WorkerId"].to_numpy()
+    items = items.explode(INPUT_COLUMNS, ignore_index=True)
+
+    # The inputs are indexed by query once and joined to all items.
+    inputs = input_data.drop_duplicates("query").set_index("query")
+    for res_id in range(2):
+        column = "response_" + str(res_id + 1) + "_selected_aspects_scores"
+        inputs[column] = inputs[column].map(parse_selected_aspects_scores)
+    items = items.merge(
+        inputs,
+        how="left",
+        left_on="Input.question",
+        right_index=True,
+        validate="many_to_one",
+    )
+    unknown_queries = items.loc[
+        items["explanation_type"].isna(), "Input.question"
+    ]
+    if len(unknown_queries):
+        raise ValueError(
+            "Queries not found in the inputs: "
+            + str(list(unknown_queries.unique()))
+        )
+
+    reliable_first = (
+        items["response_1_type"].isin(RELIABLE_RESPONSE_TYPES).to_numpy()
+    )
+    responses = np.array(items["Input.answers"].tolist(), dtype=object)
+    reliable_response_ids = np.where(reliable_first, "response_0", "response_1")
+
+    trust = checked_answers(data, TRUST_COLUMNS)
+    trust_preferences = classify_trust_preferences(
+        trust, np.where(reliable_first, 0, 1)
+    )
+
+    aspects_shown = (
+        items["Input.aspects"].map(lambda aspects: aspects != ["", ""])
+    ).to_numpy()
+    aspect_answers = (
+        checked_answers(data, ASPECT_COLUMNS)
+        .astype(int)
+        .reshape(-1, 2, NUM_ASPECTS)
+    )
+    expected_scores = np.stack(
+        [
+            np.array(items["response_1_selected_aspects_scores"].tolist()),
+            np.array(items["response_2_selected_aspects_scores"].tolist()),
+        ],
+        axis=1,
+    )
+    aspect_matches = (aspect_answers == expected_scores).all(axis=2).astype(int)
+
+    return pd.DataFrame(
+        {
+            "queries": items["Input.question"].to_numpy(),
+            "user_ids": items["WorkerId"].to_numpy(),
+            "reliable_response_ids": reliable_response_ids,
+            "reliable_responses": np.where(
+                reliable_first, responses[:, 0], responses[:, 1]
+            ),
+            "unreliable_response_ids": np.where(
+                reliable_first, "response_1", "response_0"
+            ),
+            "unreliable_responses": np.where(
+                reliable_first, responses[:, 1], responses[:, 0]
+            ),
+            "trust_scores": trust.astype(int).tolist(),
+            "picked_better_lst": PICKED_BETTER[trust_preferences.codes],
+            "trust_preferences": trust_preferences,
+            "explanation_type_lst": items["explanation_type"].to_numpy(),
+            "explanation_shown_lst": (
+                items["Input.limitations"].map(
+                    lambda limitations: limitations != ["", ""]
+                )
+            ).to_numpy(),
+            "justifications": answer_block(
+                data, JUSTIFICATION_COLUMNS, fill_value=np.nan
+            ).ravel(),
+            "aspect_scores": [
+                matches.tolist() if shown else -1
+                for matches, shown in zip(aspect_matches, aspects_shown)
+            ],
+        }
+    )
+
+
+def parquet_writer(path):
+    """Opens a Parquet writer of study results.
+
+    In Parquet, picked_better_lst is stored as 1 (picked the reliable
+    response), 0 (picked the unreliable response) or -1 (tie), and
+    aspect_scores is null for items shown without aspects.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError(
+            "Parquet output requires pyarrow: pip install pyarrow"
+        ) from e
+
+    schema = pa.schema(
+        [
+            ("queries", pa.string()),
+            ("user_ids", pa.string()),
+            ("reliable_response_ids", pa.string()),
+            ("reliable_responses", pa.string()),
+            ("unreliable_response_ids", pa.string()),
+            ("unreliable_responses", pa.string()),
+            ("trust_scores", pa.list_(pa.int8())),
+            ("picked_better_lst", pa.int8()),
+            ("trust_preferences", pa.dictionary(pa.int8(), pa.string())),
+            ("explanation_type_lst", pa.string()),
+            ("explanation_shown_lst", pa.bool_()),
+            ("justifications", pa.string()),
+            ("aspect_scores", pa.list_(pa.int8())),
+        ]
+    )
+    return pq.ParquetWriter(path, schema)
+
+
+def write_parquet(writer, study_results):
+    """Appends study results to a Parquet file opened with parquet_writer."""
+    import pyarrow as pa
+
+    study_results = study_results.assign(
+        picked_better_lst=[
+            int(picked_better)
+            for picked_better in study_results["picked_better_lst"]
+        ],
+        aspect_scores=[
+            None if scores == -1 else scores
+            for scores in study_results["aspect_scores"]
+        ],
+    )
+    writer.write_table(
+        pa.Table.from_pandas(
+            study_results, schema=writer.schema, preserve_index=False
+        )
+    )
+
+
+def main(
+    chunk_size=10000, parquet_path="data/user_study/output_processed.parquet"
+):
+    input_data = pd.read_csv(
+        "data/user_study/input_responses_w_explanations.csv"
+    )
+
+    # The MTurk export (comma-separated) is processed in chunks of
+    # submissions, and the results of every chunk are appended to the
+    # outputs, so that memory does not grow with the size of the export.
+    num_submissions = 0
+    num_picked_better = 0
+    num_explanations_shown = 0
+    writer = parquet_writer(parquet_path) if parquet_path else None
+    try:
+        chunks = pd.read_csv(
+            "data/user_study/mturk_output.csv", chunksize=chunk_size
+        )
+        for chunk_id, data in enumerate(chunks):
+            study_results = process_submissions(data, input_data)
+
+            num_submissions += len(data)
+            num_picked_better += sum(study_results["picked_better_lst"])
+            num_explanations_shown += sum(
+                study_results["explanation_shown_lst"]
+            )
+
+            study_results.to_csv(
+                "data/user_study/output_processed.csv",
+                sep=";",
+                index=False,
+                mode="w" if chunk_id == 0 else "a",
+                header=chunk_id == 0,
+            )
+            if writer is not None:
+                write_parquet(writer, study_results)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    print(num_submissions)
+    print(num_picked_better)
+    print(num_explanations_shown)
 
-def main():
-    data = pd.read_csv("data/user_study/mturk_output.csv", sep=";", index=False)
-    print(len(data))
-
-    input_data = pd.read_csv("data/user_study/input_responses_w_explanations.csv")
-
-    reliable_response_types = ["ginger_response", "ginger_response_support"]
-    unreliable_response_types = ["single_aspect_response", "llm_zero_shot_response"]             	
-
-    queries = []
-    user_ids = []
-    reliable_response_ids = []
-    unreliable_response_ids = []
-    reliable_responses = []
-    unreliable_responses = []
-    trust_scores = []
-    picked_better_lst = []
-    explanation_type_lst = []
-    explanation_shown_lst = []
-    justifications = []
-    aspects_scores = []
-    trust_preferences = []
-
-    for sub_id, submission in data.iterrows():
-        submission_queries = ast.literal_eval(submission["Input.question"])
-        submission_responses = ast.literal_eval(submission["Input.answers"])
-        submission_limitations = ast.literal_eval(submission["Input.limitations"])
-        submission_aspects = ast.literal_eval(submission["Input.aspects"])
-        user_id = submission["WorkerId"]
-        
-        for i in range(0, 12):
-            query = submission_queries[i]
-            query_responses = submission_responses[i]
-            input_row = input_data[input_data["query"] == query]
-
-            queries.append(query)
-            user_ids.append(user_id) 
-            
-            if list(input_row["response_1_type"])[0] in reliable_response_types:
-                reliable_response_id = "response_0"
-                reliable_response = query_responses[0]
-                unreliable_response_id = "response_1"
-                unreliable_response = query_responses[1]
-            else:
-                reliable_response_id = "response_1"
-                reliable_response = query_responses[1]
-                unreliable_response_id = "response_0"
-                unreliable_response = query_responses[0]
-            
-            reliable_response_ids.append(reliable_response_id)
-            unreliable_response_ids.append(unreliable_response_id)
-            reliable_responses.append(reliable_response)
-            unreliable_responses.append(unreliable_response)
-
-            trust_scores.append([1 if submission["Answer.query_" + str(i) + ".trust_" + str(j)] else 0 for j in range(0, 5)])
-            picked_0 = True in [submission["Answer.query_" + str(i) + ".trust_0"], submission["Answer.query_" + str(i) + ".trust_1"]]
-            picked_1 = True in [submission["Answer.query_" + str(i) + ".trust_3"], submission["Answer.query_" + str(i) + ".trust_4"]]
-            picked_tie = submission["Answer.query_" + str(i) + ".trust_2"] == True
-
-            trust_preference = None
-
-            if reliable_response_id == "response_0" and picked_0 or reliable_response_id == "response_1" and picked_1:
-                picked_better = True
-                if True in [submission["Answer.query_" + str(i) + ".trust_0"], submission["Answer.query_" + str(i) + ".trust_4"]]:
-                    trust_preference = "Trust more reliable response a lot more"
-                elif True in [submission["Answer.query_" + str(i) + ".trust_1"], submission["Answer.query_" + str(i) + ".trust_3"]]:
-                    trust_preference = "Trust more reliable response slightly more"
-            elif picked_tie:
-                picked_better = -1
-                trust_preference = "Trust both responses about the same"
-            else:
-                picked_better = False
-                if True in [submission["Answer.query_" + str(i) + ".trust_0"], submission["Answer.query_" + str(i) + ".trust_4"]]:
-                    trust_preference = "Trust more unreliable response a lot more"
-                elif True in [submission["Answer.query_" + str(i) + ".trust_1"], submission["Answer.query_" + str(i) + ".trust_3"]]:
-                    trust_preference = "Trust more unreliable response slightly more"
-
-            trust_preferences.append(trust_preference)
-
-            explanation_shown = submission_limitations[i] != ["", ""]
-    
-            picked_better_lst.append(picked_better)
-            explanation_type_lst.append(list(input_row["explanation_type"])[0])
-            explanation_shown_lst.append(explanation_shown)
-            justifications.append(submission["Answer.query_" + str(i) + "-justification"])
-
-            if submission_aspects[i] == ["", ""]:
-                aspects_scores.append(-1)
-            else:
-                res_scores = []
-                for res_id in range(0, 2):
-                    res_score = []
-                    for aspect_id in range(0, 4):
-                        if submission["Answer.query_" + str(i) + "-response_" + str(res_id) + "-aspects.aspect_" + str(aspect_id)] == True:
-                            res_score.append(1)
-                        else:
-                            res_score.append(0)
-                    res_scores.append(int(str(res_score) == input_row["response_" + str(res_id + 1) + "_selected_aspects_scores"]))
-                aspects_scores.append(res_scores)
-
-    study_results = pd.DataFrame({
-        "queries": queries,
-        "user_ids": user_ids,
-        "reliable_response_ids": reliable_response_ids,
-        "reliable_responses": reliable_responses,
-        "unreliable_response_ids": unreliable_response_ids,
-        "unreliable_responses": unreliable_responses,
-        "trust_scores": trust_scores,
-        "picked_better_lst": picked_better_lst,
-        "trust_preferences": trust_preferences,
-        "explanation_type_lst": explanation_type_lst,
-        "explanation_shown_lst": explanation_shown_lst,
-        "justifications": justifications,
-        "aspect_scores": aspects_scores,
-    })
-
-    print(sum(picked_better_lst))
-    print(sum(explanation_shown_lst))
-
-    study_results.to_csv("data/user_study/output_processed.csv", sep=";", index=False)
-    
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
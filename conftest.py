@@ -1 +1,60 @@
 """Configuration for pytest."""
+
+import importlib
+import os
+import sys
+import types
+from dataclasses import dataclass
+from typing import Any, List
+
+# Scripts are run from code/ and import the pipeline components from ginger/,
+# so both directories are put on the import path of the tests.
+_ROOT = os.path.dirname(os.path.abspath(__file__))
+for directory in ("ginger", "code"):
+    sys.path.insert(0, os.path.join(_ROOT, directory))
+
+
+@dataclass
+class _Query:
+    query_id: str
+    question: str
+
+
+@dataclass
+class _ScoredDocument:
+    doc_id: Any
+    content: str
+    score: float = 0.0
+
+
+@dataclass
+class _Ranking:
+    query_id: str
+    scored_docs: List[_ScoredDocument]
+
+
+def _install_missing_module(name: str, **attributes: Any) -> None:
+    """Installs a stand-in for a GINGER module missing from the checkout.
+
+    The stand-in is only used if the module cannot be imported, so tests run
+    against the real module where the GINGER package is installed.
+    """
+    try:
+        importlib.import_module(name)
+    except ImportError:
+        module = types.ModuleType(name)
+        module.__dict__.update(attributes)
+        sys.modules[name] = module
+
+
+_install_missing_module(
+    "response_generation.utilities.ranking",
+    Query=_Query,
+    Ranking=_Ranking,
+    ScoredDocument=_ScoredDocument,
+)
+_install_missing_module(
+    "response_generation.config",
+    DEFAULT_GPT_VERSION="gpt-4",
+    OPENAI_API_KEY="",
+)
@@ -0,0 +1,133 @@
+"""Lightweight clustering of small nugget sets over cached embeddings."""
+
+from typing import TYPE_CHECKING, Any, List, Optional
+
+import numpy as np
+
+from response_generation.pipeline.components.cached_clustering import (
+    CachedBERTopicClustering,
+)
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+_DEFAULT_SIMILARITY_THRESHOLD = 0.5
+_DEFAULT_SMALL_INPUT_SIZE = 15
+
+
+def agglomerative_labels(
+    embeddings: np.ndarray, similarity_threshold: float
+) -> List[int]:
+    """Clusters embeddings with average-linkage agglomerative clustering.
+
+    Clusters are merged while the average cosine similarity between their
+    members is at least similarity_threshold. Labels are numbered by
+    decreasing cluster size, ties broken by first member.
+
+    Args:
+        embeddings: Matrix with one embedding per row.
+        similarity_threshold: Minimum average cosine similarity of merged
+          clusters.
+
+    Returns:
+        Cluster label of every row.
+    """
+    n = len(embeddings)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    normalized = embeddings / np.maximum(norms, 1e-12)
+    similarity = normalized @ normalized.T
+    np.fill_diagonal(similarity, -np.inf)
+    sizes = np.ones(n)
+    members = [[i] for i in range(n)]
+    active = np.ones(n, dtype=bool)
+
+    while active.sum() > 1:
+        masked = np.where(
+            active[:, None] & active[None, :], similarity, -np.inf
+        )
+        a, b = np.unravel_index(np.argmax(masked), masked.shape)
+        if masked[a, b] < similarity_threshold:
+            break
+        # Average linkage (Lance-Williams update): the similarity of the
+        # merged cluster is the size-weighted mean of its parts.
+        merged = (sizes[a] * similarity[a] + sizes[b] * similarity[b]) / (
+            sizes[a] + sizes[b]
+        )
+        similarity[a, :] = merged
+        similarity[:, a] = merged
+        similarity[a, a] = -np.inf
+        sizes[a] += sizes[b]
+        members[a].extend(members[b])
+        active[b] = False
+
+    clusters = sorted(
+        (sorted(members[i]) for i in np.flatnonzero(active)),
+        key=lambda cluster: (-len(cluster), cluster[0]),
+    )
+    labels = [0] * n
+    for label, cluster in enumerate(clusters):
+        for i in cluster:
+            labels[i] = label
+    return labels
+
+
+class AdaptiveClustering:
+    def __init__(
+        self,
+        clustering: Any,
+        embedder: CachedBERTopicClustering,
+        small_input_size: int = _DEFAULT_SMALL_INPUT_SIZE,
+        similarity_threshold: float = _DEFAULT_SIMILARITY_THRESHOLD,
+    ) -> None:
+        """Instantiates a clustering that picks a backend by input size.
+
+        Inputs of at most small_input_size nuggets are clustered with
+        average-linkage agglomerative clustering on cosine similarity, which
+        avoids the fixed cost of UMAP, HDBSCAN and c-TF-IDF. Larger inputs are
+        passed unchanged to the given clustering, e.g., the upstream
+        BERTopicClustering, so their clusters do not depend on this class.
+
+        Args:
+            clustering: Clustering of large inputs, called with the nuggets
+              only.
+            embedder: Clustering whose encoder and embedding cache provide the
+              embeddings of small inputs; its BERTopic model is not used.
+            small_input_size (optional): Largest number of nuggets clustered
+              with the lightweight backend. Defaults to 15.
+            similarity_threshold (optional): Minimum average cosine similarity
+              of merged clusters in the lightweight backend. Defaults to 0.5.
+        """
+        self.clustering = clustering
+        self.embedder = embedder
+        self.small_input_size = small_input_size
+        self.similarity_threshold = similarity_threshold
+
+    def cluster(
+        self, nuggets: List[str], embeddings: Optional[np.ndarray] = None
+    ) -> "pd.DataFrame":
+        """Clusters information nuggets.
+
+        Args:
+            nuggets: Information nuggets.
+            embeddings (optional): Precomputed embeddings of the nuggets, used
+              for small inputs only.
+
+        Returns:
+            Data frame with the nugget in the Document column and its cluster
+            in the Topic column, as returned by BERTopic.
+        """
+        if len(nuggets) > self.small_input_size:
+            return self.clustering.cluster(nuggets)
+        if embeddings is None:
+            embeddings = self.embedder.embed(nuggets)
+
+        import pandas as pd
+
+        return pd.DataFrame(
+            {
+                "Document": nuggets,
+                "Topic": agglomerative_labels(
+                    embeddings, self.similarity_threshold
+                ),
+            }
+        )
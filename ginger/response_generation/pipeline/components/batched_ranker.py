@@ -0,0 +1,278 @@
+"""Batched monoT5/duoT5 reranker with pruning and early termination."""
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Sequence, Tuple
+
+from response_generation.utilities.ranking import (
+    Query,
+    Ranking,
+    ScoredDocument,
+)
+
+_DEFAULT_MONOT5_MODEL = "castorini/monot5-base-msmarco"
+_DEFAULT_DUOT5_MODEL = "castorini/duot5-base-msmarco"
+# Relevance is read from the logits of these tokens at the first decoding
+# step, as in the original monoT5/duoT5 implementations.
+_TRUE_TOKEN = "▁true"
+_FALSE_TOKEN = "▁false"
+
+
+class BatchedDuoT5Reranker:
+    def __init__(
+        self,
+        top_k: int = 3,
+        prune_margin: int = 2,
+        batch_size: int = 16,
+        monot5_model: str = _DEFAULT_MONOT5_MODEL,
+        duot5_model: str = _DEFAULT_DUOT5_MODEL,
+        max_input_length: int = 512,
+        cache_size: int = 100000,
+    ) -> None:
+        """Instantiates a two-stage (pointwise, then pairwise) T5 reranker.
+
+        Candidates are first scored with monoT5 in padded batches. Only the
+        top_k + prune_margin best candidates are compared pairwise with duoT5;
+        the others keep their pointwise order. Pairwise scores are aggregated
+        with the symmetric sum of duoT5, evaluated in batches of candidate
+        pairs. Evaluation stops as soon as the order of the top_k candidates
+        can no longer change, and pair scores are cached by a hash of the query
+        and both documents.
+
+        Args:
+            top_k (optional): Number of top positions whose order has to be
+              exact. Defaults to 3.
+            prune_margin (optional): Number of candidates below top_k that are
+              also compared pairwise. Defaults to 2.
+            batch_size (optional): Number of inputs per model batch. Defaults
+              to 16.
+            monot5_model (optional): Pointwise model name.
+            duot5_model (optional): Pairwise model name.
+            max_input_length (optional): Maximum number of input tokens.
+              Defaults to 512.
+            cache_size (optional): Maximum number of cached pair scores.
+              Defaults to 100000.
+        """
+        self._top_k = top_k
+        self._prune_margin = prune_margin
+        self._batch_size = batch_size
+        self._monot5_model = monot5_model
+        self._duot5_model = duot5_model
+        self._max_input_length = max_input_length
+        self._cache_size = cache_size
+        self._models: Dict[str, tuple] = {}
+        self._pair_cache: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _load(self, model_name: str) -> tuple:
+        """Loads a T5 model with its tokenizer and relevance token ids."""
+        if model_name not in self._models:
+            from transformers import AutoTokenizer, T5ForConditionalGeneration
+
+            tokenizer = AutoTokenizer.from_pretrained(model_name)
+            model = T5ForConditionalGeneration.from_pretrained(model_name)
+            token_ids = tokenizer.convert_tokens_to_ids(
+                [_FALSE_TOKEN, _TRUE_TOKEN]
+            )
+            self._models[model_name] = (tokenizer, model.eval(), token_ids)
+        return self._models[model_name]
+
+    def _true_probabilities(
+        self, model_name: str, inputs: Sequence[str]
+    ) -> List[float]:
+        """Returns the probability of the "true" token for every input.
+
+        Args:
+            model_name: Name of the T5 model.
+            inputs: Model inputs.
+
+        Returns:
+            Probabilities in input order.
+        """
+        import torch
+
+        tokenizer, model, token_ids = self._load(model_name)
+        order = sorted(range(len(inputs)), key=lambda i: len(inputs[i]))
+        probabilities = [0.0] * len(inputs)
+        with torch.inference_mode():
+            for start in range(0, len(order), self._batch_size):
+                batch_indices = order[start : start + self._batch_size]
+                batch = tokenizer(
+                    [inputs[i] for i in batch_indices],
+                    padding=True,
+                    truncation=True,
+                    max_length=self._max_input_length,
+                    return_tensors="pt",
+                )
+                decoder_input_ids = torch.full(
+                    (len(batch_indices), 1),
+                    model.config.decoder_start_token_id,
+                    dtype=torch.long,
+                )
+                logits = model(
+                    **batch, decoder_input_ids=decoder_input_ids
+                ).logits[:, 0, token_ids]
+                batch_probabilities = logits.softmax(dim=-1)[:, 1].tolist()
+                for i, probability in zip(batch_indices, batch_probabilities):
+                    probabilities[i] = probability
+        return probabilities
+
+    @staticmethod
+    def _pair_key(query: str, doc_a: str, doc_b: str) -> str:
+        """Returns the cache key of an ordered document pair."""
+        return hashlib.sha1(
+            "\x1f".join([query, doc_a, doc_b]).encode("utf-8")
+        ).hexdigest()
+
+    def _pair_scores(
+        self, query: str, pairs: List[Tuple[str, str]]
+    ) -> List[float]:
+        """Returns duoT5 probabilities that doc_a is more relevant than doc_b.
+
+        Args:
+            query: Query text.
+            pairs: Ordered document pairs (doc_a, doc_b).
+
+        Returns:
+            Probabilities in pair order.
+        """
+        keys = [self._pair_key(query, a, b) for a, b in pairs]
+        with self._lock:
+            scores = {
+                key: self._pair_cache[key]
+                for key in keys
+                if key in self._pair_cache
+            }
+        missing = [
+            (key, pair) for key, pair in zip(keys, pairs) if key not in scores
+        ]
+        if missing:
+            inputs = [
+                "Query: {} Document0: {} Document1: {} Relevant:".format(
+                    query, a, b
+                )
+                for _, (a, b) in missing
+            ]
+            probabilities = self._true_probabilities(self._duot5_model, inputs)
+            with self._lock:
+                for (key, _), probability in zip(missing, probabilities):
+                    scores[key] = probability
+                    self._pair_cache[key] = probability
+                while len(self._pair_cache) > self._cache_size:
+                    self._pair_cache.popitem(last=False)
+        return [scores[key] for key in keys]
+
+    def _top_k_fixed(
+        self, lower: List[float], upper: List[float], top_k: int
+    ) -> bool:
+        """Checks whether the order of the top_k candidates is settled.
+
+        Args:
+            lower: Lower bounds of the final candidate scores.
+            upper: Upper bounds of the final candidate scores.
+            top_k: Number of top positions.
+
+        Returns:
+            True if no remaining comparison can change the top_k order.
+        """
+        order = sorted(range(len(lower)), key=lambda i: -lower[i])
+        for position in range(min(top_k, len(order) - 1)):
+            candidate = order[position]
+            challengers = order[position + 1 :]
+            if lower[candidate] < max(upper[i] for i in challengers):
+                return False
+        return True
+
+    def _pairwise_order(self, query: str, docs: List[str]) -> List[int]:
+        """Orders candidates by duoT5 symmetric sum with early termination.
+
+        Unordered pairs are evaluated in batches, starting with pairs of
+        candidates ranked highest by the pointwise model. Every pair {i, j}
+        adds p(i, j) + 1 - p(j, i) to the score of i and the complement (out
+        of 2) to the score of j.
+
+        Args:
+            query: Query text.
+            docs: Candidate documents in pointwise order.
+
+        Returns:
+            Candidate indices in final order.
+        """
+        n = len(docs)
+        pairs = sorted(
+            [(i, j) for i in range(n) for j in range(i + 1, n)],
+            key=lambda pair: (pair[1], pair[0]),
+        )
+        lower = [0.0] * n
+        remaining = [n - 1] * n
+        settled = False
+        pairs_per_batch = max(1, self._batch_size // 2)
+        for start in range(0, len(pairs), pairs_per_batch):
+            batch = pairs[start : start + pairs_per_batch]
+            ordered_pairs = []
+            for i, j in batch:
+                ordered_pairs.extend([(docs[i], docs[j]), (docs[j], docs[i])])
+            scores = self._pair_scores(query, ordered_pairs)
+            for index, (i, j) in enumerate(batch):
+                p_ij, p_ji = scores[2 * index], scores[2 * index + 1]
+                lower[i] += p_ij + 1 - p_ji
+                lower[j] += p_ji + 1 - p_ij
+                remaining[i] -= 1
+                remaining[j] -= 1
+            upper = [lower[i] + 2 * remaining[i] for i in range(n)]
+            if start + pairs_per_batch < len(pairs) and self._top_k_fixed(
+                lower, upper, self._top_k
+            ):
+                settled = True
+                break
+
+        order = sorted(range(n), key=lambda i: -lower[i])
+        if not settled:
+            return order
+        # After early termination, candidates outside the top_k have partial
+        # scores only and keep their pointwise order.
+        top = order[: self._top_k]
+        return top + [i for i in range(n) if i not in top]
+
+    def rerank(self, query: Query, ranking: Ranking, k: int) -> Ranking:
+        """Reranks documents with pointwise pruning and pairwise comparison.
+
+        Args:
+            query: Query.
+            ranking: Ranking of candidate documents.
+            k: Number of top documents of the ranking to rerank and return.
+
+        Returns:
+            Reranked documents.
+        """
+        docs = ranking.fetch_topk_docs(k=k, unique=True)
+        if len(docs) > 1:
+            pointwise_scores = self._true_probabilities(
+                self._monot5_model,
+                [
+                    "Query: {} Document: {} Relevant:".format(
+                        query.question, doc.content
+                    )
+                    for doc in docs
+                ],
+            )
+            docs = [
+                doc
+                for _, doc in sorted(
+                    zip(pointwise_scores, docs), key=lambda pair: -pair[0]
+                )
+            ]
+            window = docs[: self._top_k + self._prune_margin]
+            order = self._pairwise_order(
+                query.question, [doc.content for doc in window]
+            )
+            docs = [window[i] for i in order] + docs[len(window) :]
+
+        return Ranking(
+            query_id=query.query_id,
+            scored_docs=[
+                ScoredDocument(doc.doc_id, doc.content, len(docs) - position)
+                for position, doc in enumerate(docs)
+            ],
+        )
@@ -0,0 +1,121 @@
+"""BERTopic clustering of information nuggets over cached embeddings."""
+
+from typing import TYPE_CHECKING, List, Optional
+
+import numpy as np
+
+from response_generation.utilities.embedding_cache import EmbeddingCache
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+class CachedBERTopicClustering:
+    def __init__(
+        self,
+        embedding_model: str,
+        n_neighbors: int,
+        n_components: int,
+        min_cluster_size: int,
+        seed: int,
+        embedding_cache: Optional[EmbeddingCache] = None,
+    ) -> None:
+        """Instantiates a BERTopic clustering that reuses nugget embeddings.
+
+        The sentence encoder, UMAP, HDBSCAN and BERTopic models are created
+        once and reused for every call to cluster; only the fit on the given
+        nuggets is repeated. Nugget embeddings are looked up in the embedding
+        cache and only missing ones are encoded.
+
+        The clustering settings have no defaults: they have to match the
+        clustering the results are compared with, e.g., the upstream
+        BERTopicClustering, so they are always given by the caller.
+
+        Args:
+            embedding_model: Sentence-transformers model name.
+            n_neighbors: Number of UMAP neighbors.
+            n_components: Number of UMAP dimensions.
+            min_cluster_size: Minimum HDBSCAN cluster size.
+            seed: UMAP random state.
+            embedding_cache (optional): Persistent embedding cache. Defaults to
+              None, in which case embeddings are computed on every call.
+        """
+        self._embedding_model_name = embedding_model
+        self.embedding_cache = embedding_cache
+        self._n_neighbors = n_neighbors
+        self._n_components = n_components
+        self._min_cluster_size = min_cluster_size
+        self._seed = seed
+        self._encoder = None
+        self._topic_model = None
+
+    @property
+    def encoder(self):
+        """Sentence encoder, loaded on first use."""
+        if self._encoder is None:
+            from sentence_transformers import SentenceTransformer
+
+            self._encoder = SentenceTransformer(self._embedding_model_name)
+        return self._encoder
+
+    @property
+    def topic_model(self):
+        """BERTopic model, created on first use and refitted on every call."""
+        if self._topic_model is None:
+            from bertopic import BERTopic
+            from hdbscan import HDBSCAN
+            from umap import UMAP
+
+            self._topic_model = BERTopic(
+                embedding_model=self.encoder,
+                umap_model=UMAP(
+                    n_neighbors=self._n_neighbors,
+                    n_components=self._n_components,
+                    min_dist=0.0,
+                    metric="cosine",
+                    random_state=self._seed,
+                ),
+                hdbscan_model=HDBSCAN(
+                    min_cluster_size=self._min_cluster_size,
+                    metric="euclidean",
+                    prediction_data=True,
+                ),
+            )
+        return self._topic_model
+
+    def _encode(self, nuggets: List[str]) -> np.ndarray:
+        """Computes embeddings of nuggets with the sentence encoder."""
+        return self.encoder.encode(nuggets, convert_to_numpy=True)
+
+    def embed(self, nuggets: List[str]) -> np.ndarray:
+        """Returns embeddings of nuggets, using the cache if available.
+
+        Args:
+            nuggets: Information nuggets.
+
+        Returns:
+            Matrix with one embedding per nugget.
+        """
+        if self.embedding_cache is None:
+            return self._encode(nuggets)
+        return self.embedding_cache.get_or_compute(nuggets, self._encode)
+
+    def cluster(
+        self, nuggets: List[str], embeddings: Optional[np.ndarray] = None
+    ) -> "pd.DataFrame":
+        """Clusters information nuggets.
+
+        Args:
+            nuggets: Information nuggets.
+            embeddings (optional): Precomputed embeddings of the nuggets.
+              Defaults to None, in which case they are taken from the cache or
+              computed.
+
+        Returns:
+            Document info data frame of BERTopic, with the nugget in the
+            Document column and its cluster in the Topic column.
+        """
+        if embeddings is None:
+            embeddings = self.embed(nuggets)
+        self.topic_model.fit_transform(nuggets, embeddings=embeddings)
+        return self.topic_model.get_document_info(nuggets)
@@ -1,18 +1,80 @@
 """Text summarizer."""
 
+import asyncio
+import json
+import random
+import re
+import threading
 from abc import ABC, abstractmethod
-from typing import List
-
-import pandas as pd
-from openai import OpenAI
-from transformers import pipeline
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from functools import lru_cache
+from types import SimpleNamespace
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
 
 from response_generation.config import DEFAULT_GPT_VERSION, OPENAI_API_KEY
-from response_generation.utilities.generation import num_tokens_from_messages
+from response_generation.utilities import profiling
 from response_generation.utilities.ranking import Ranking
+from response_generation.utilities.response_cache import ResponseCache
+from response_generation.utilities.token_budget import TokenBudget
+
+# Heavy dependencies (pandas, torch, transformers, openai) are imported lazily
+# where they are used, so that importing this module stays cheap.
+if TYPE_CHECKING:
+    import pandas as pd
+    from openai import AsyncOpenAI
+    from transformers import Pipeline
 
 # _DEFAULT_SUMMARIZER_MODEL = "facebook/bart-large-cnn"
 _DEFAULT_SUMMARIZER_MODEL = "Falconsai/text_summarization"
+_DEFAULT_MAX_INPUT_LENGTH = 512
+# Tokenizers without a known input limit report a very large sentinel value.
+_UNBOUNDED_MODEL_LENGTH = int(1e9)
+SUMMARIZER_BACKENDS = ("pytorch", "quantized", "onnx")
+
+# Loaded summarization pipelines shared by all summarizer instances.
+_PIPELINE_REGISTRY: Dict[Tuple[str, str], "Pipeline"] = {}
+_PIPELINE_REGISTRY_LOCK = threading.Lock()
+
+_REPHRASE_PROMPT = [
+    {
+        "role": "system",
+        "content": "Rephrase the response given a query. Do not change the information included in the response. Do not add information not mentioned in the response. Keep the same number of sentences.",
+    },
+]
+_PACKED_REPHRASE_PROMPT = [
+    {
+        "role": "system",
+        "content": "You are given a JSON list of items, each with an id, a query and a response. Rephrase every response given its query. Do not change the information included in the response. Do not add information not mentioned in the response. Keep the same number of sentences. Rephrase every item independently. Answer only with a JSON object that maps the id of every item to its rephrased response.",
+    },
+]
+_JSON_OBJECT_PATTERN = re.compile(r"\{.*\}", re.DOTALL)
+
+
+@lru_cache(maxsize=None)
+def _retryable_errors() -> Tuple[type, ...]:
+    """Returns OpenAI errors after which a request is retried."""
+    from openai import (
+        APIConnectionError,
+        APITimeoutError,
+        InternalServerError,
+        RateLimitError,
+    )
+
+    return (
+        RateLimitError,
+        APIConnectionError,
+        APITimeoutError,
+        InternalServerError,
+    )
 
 
 class Summarizer(ABC):
@@ -33,8 +95,85 @@ class Summarizer(ABC):
         raise NotImplementedError
 
 
+def _load_summarization_pipeline(
+    model_name: str, backend: str
+) -> "Pipeline":
+    """Loads a summarization pipeline with the given inference backend.
+
+    Args:
+        model_name: Hugging Face model name.
+        backend: One of "pytorch" (fp32 PyTorch model), "quantized"
+          (dynamically int8-quantized PyTorch model) and "onnx" (model
+          exported to ONNX Runtime, requires optimum[onnxruntime]).
+
+    Raises:
+        ValueError: If the backend is not supported.
+        ImportError: If the ONNX backend is requested without optimum.
+
+    Returns:
+        Summarization pipeline.
+    """
+    import torch
+    from transformers import AutoModelForSeq2SeqLM, AutoTokenizer, pipeline
+
+    if backend == "pytorch":
+        return pipeline("summarization", model=model_name)
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    if backend == "quantized":
+        model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
+        model = torch.ao.quantization.quantize_dynamic(
+            model.eval(), {torch.nn.Linear}, dtype=torch.qint8
+        )
+    elif backend == "onnx":
+        try:
+            from optimum.onnxruntime import ORTModelForSeq2SeqLM
+        except ImportError as e:
+            raise ImportError(
+                "The ONNX backend requires optimum: "
+                "pip install optimum[onnxruntime]"
+            ) from e
+        model = ORTModelForSeq2SeqLM.from_pretrained(model_name, export=True)
+    else:
+        raise ValueError(
+            "Unsupported backend {}, expected one of {}".format(
+                backend, SUMMARIZER_BACKENDS
+            )
+        )
+    return pipeline("summarization", model=model, tokenizer=tokenizer)
+
+
+def get_summarization_pipeline(
+    model_name: str = _DEFAULT_SUMMARIZER_MODEL, backend: str = "pytorch"
+) -> "Pipeline":
+    """Returns a process-wide shared summarization pipeline.
+
+    The pipeline is loaded on the first request for a model and backend and
+    reused afterwards.
+
+    Args:
+        model_name (optional): Hugging Face model name. Defaults to
+          file-level constant _DEFAULT_SUMMARIZER_MODEL.
+        backend (optional): Inference backend. Defaults to "pytorch".
+
+    Returns:
+        Summarization pipeline.
+    """
+    key = (model_name, backend)
+    with _PIPELINE_REGISTRY_LOCK:
+        if key not in _PIPELINE_REGISTRY:
+            _PIPELINE_REGISTRY[key] = _load_summarization_pipeline(
+                model_name, backend
+            )
+        return _PIPELINE_REGISTRY[key]
+
+
 class HuggingFaceSummarizer(Summarizer):
-    def __init__(self, model_name: str = _DEFAULT_SUMMARIZER_MODEL) -> None:
+    def __init__(
+        self,
+        model_name: str = _DEFAULT_SUMMARIZER_MODEL,
+        backend: str = "pytorch",
+    ) -> None:
         """Instantiates a summarizer based on a Hugging Face model.
 
         The summarization is based on the Pipelines API developed by Hugging
@@ -44,8 +183,146 @@ class HuggingFaceSummarizer(Summarizer):
         Args:
             model_name (optional): Hugging Face model name. Defaults to
               file-level constant _DEFAULT_SUMMARIZER_MODEL.
+            backend (optional): Inference backend, one of "pytorch",
+              "quantized" (dynamic int8 quantization of linear layers) and
+              "onnx" (ONNX Runtime). Defaults to "pytorch".
+
+        The model is loaded on first use and shared with other summarizers
+        using the same model and backend.
         """  # noqa
-        self._summarizer = pipeline("summarization", model=model_name)
+        if backend not in SUMMARIZER_BACKENDS:
+            raise ValueError(
+                "Unsupported backend {}, expected one of {}".format(
+                    backend, SUMMARIZER_BACKENDS
+                )
+            )
+        self._model_name = model_name
+        self._backend = backend
+
+    @property
+    def _summarizer(self) -> "Pipeline":
+        """Summarization pipeline, loaded on first access."""
+        return get_summarization_pipeline(self._model_name, self._backend)
+
+    def _max_input_length(self) -> int:
+        """Returns the maximum number of input tokens the model accepts."""
+        model_max_length = self._summarizer.tokenizer.model_max_length
+        if model_max_length and model_max_length < _UNBOUNDED_MODEL_LENGTH:
+            return model_max_length
+        config = self._summarizer.model.config
+        for attribute in ("max_position_embeddings", "n_positions"):
+            if getattr(config, attribute, None):
+                return getattr(config, attribute)
+        return _DEFAULT_MAX_INPUT_LENGTH
+
+    def _encode_inputs(self, text: str, chunk: bool) -> List[List[int]]:
+        """Tokenizes text into model inputs that fit the context window.
+
+        Args:
+            text: Text to summarize.
+            chunk: Whether to split an oversize text into consecutive chunks.
+              Otherwise, the text is truncated.
+
+        Returns:
+            List of input token ids (with prefix and special tokens), one per
+            chunk.
+        """
+        tokenizer = self._summarizer.tokenizer
+        prefix = getattr(self._summarizer.model.config, "prefix", None) or ""
+        max_input_length = self._max_input_length()
+        input_ids = tokenizer(
+            prefix + text, truncation=True, max_length=max_input_length
+        )["input_ids"]
+        if not chunk or len(input_ids) < max_input_length:
+            return [input_ids]
+
+        window = max_input_length - len(
+            tokenizer(prefix, truncation=False)["input_ids"]
+        )
+        text_ids = tokenizer.encode(text, add_special_tokens=False)
+        chunks = [
+            tokenizer.decode(text_ids[start : start + window])
+            for start in range(0, len(text_ids), window)
+        ]
+        return tokenizer(
+            [prefix + c for c in chunks],
+            truncation=True,
+            max_length=max_input_length,
+        )["input_ids"]
+
+    def summarize_batch(
+        self,
+        texts: List[str],
+        min_length: int = 10,
+        max_length: int = 250,
+        batch_size: int = 8,
+        num_threads: int = None,
+        chunk: bool = False,
+    ) -> List[str]:
+        """Summarizes texts in padded batches using a Hugging Face model.
+
+        Inputs are sorted by token length so that every batch holds inputs of
+        similar length, which minimizes padding. Texts exceeding the model
+        context window are truncated or, if chunk is set, split into chunks
+        whose summaries are concatenated.
+
+        Args:
+            texts: Texts to summarize.
+            min_length (optional): Minimum number of tokens in the summary.
+              Defaults to 10 tokens.
+            max_length (optional): Maximum number of tokens in the summary.
+              Defaults to 250 tokens.
+            batch_size (optional): Number of inputs per batch. Defaults to 8.
+            num_threads (optional): Number of CPU threads used by PyTorch.
+              Defaults to None (PyTorch default).
+            chunk (optional): Whether to chunk instead of truncating oversize
+              texts. Defaults to False.
+
+        Returns:
+            Abstractive summaries in the same order as the texts.
+        """
+        import torch
+
+        tokenizer = self._summarizer.tokenizer
+        model = self._summarizer.model
+
+        inputs = []
+        for text_index, text in enumerate(texts):
+            for input_ids in self._encode_inputs(text, chunk):
+                inputs.append((text_index, input_ids))
+        order = sorted(
+            range(len(inputs)), key=lambda i: len(inputs[i][1]), reverse=True
+        )
+
+        previous_num_threads = torch.get_num_threads()
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        input_summaries: List[str] = [""] * len(inputs)
+        try:
+            with torch.inference_mode():
+                for start in range(0, len(order), batch_size):
+                    batch_indices = order[start : start + batch_size]
+                    batch = tokenizer.pad(
+                        {"input_ids": [inputs[i][1] for i in batch_indices]},
+                        return_tensors="pt",
+                    ).to(model.device)
+                    output_ids = model.generate(
+                        **batch, min_length=min_length, max_length=max_length
+                    )
+                    decoded = tokenizer.batch_decode(
+                        output_ids,
+                        skip_special_tokens=True,
+                        clean_up_tokenization_spaces=False,
+                    )
+                    for i, summary in zip(batch_indices, decoded):
+                        input_summaries[i] = summary
+        finally:
+            torch.set_num_threads(previous_num_threads)
+
+        summaries: List[List[str]] = [[] for _ in texts]
+        for (text_index, _), summary in zip(inputs, input_summaries):
+            summaries[text_index].append(summary)
+        return [" ".join(text_summaries) for text_summaries in summaries]
 
     def summarize_ranking(
         self,
@@ -56,6 +333,9 @@ class HuggingFaceSummarizer(Summarizer):
     ) -> str:
         """Summarizes passages using a Hugging Face model.
 
+        The concatenated passages are truncated to the model context window,
+        i.e., the lowest ranked passages are cut first.
+
         Args:
             passages: Passages to summarize.
             k (optional): Maximum number of passages to consider for the
@@ -71,10 +351,9 @@ class HuggingFaceSummarizer(Summarizer):
         topk = passages.fetch_topk_docs(k=k, unique=True)
         texts = list(map(lambda p: p.content, topk))
         text = " ".join(texts)
-        summary = self._summarizer(
-            text, min_length=min_length, max_length=max_length
-        )
-        return summary[0]["summary_text"]
+        return self.summarize_batch(
+            [text], min_length=min_length, max_length=max_length
+        )[0]
 
     def summarize_text(
         self, text: str, min_length: int = 10, max_length: int = 250,
@@ -91,15 +370,64 @@ class HuggingFaceSummarizer(Summarizer):
         Returns:
             Abstractive summary of passages.
         """
-        summary = self._summarizer(
-            text, min_length=min_length, max_length=max_length
-        )
-        return summary[0]["summary_text"]
+        return self.summarize_batch(
+            [text], min_length=min_length, max_length=max_length
+        )[0]
+
+
+@dataclass
+class SummarizationRequest:
+    """Single request to a GPT summarizer.
+
+    Use the passages, aspects and text constructors, which build the input
+    sample in the same way as the corresponding GPTSummarizer methods. The
+    input sample consists of a fixed content_prefix and the input_text, which
+    may be trimmed to fit the context window of the model. The optional
+    stage names the profiling stage the request is attributed to.
+    """
+
+    prompt: List[Dict[str, str]]
+    input_text: str
+    max_length: int
+    seed: Optional[int] = None
+    content_prefix: str = ""
+    stage: Optional[str] = None
+
+    @classmethod
+    def passages(
+        cls, query: str, passages: str, prompt: str, max_length: int = 300
+    ) -> "SummarizationRequest":
+        """Creates a request equivalent to GPTSummarizer.summarize_passages."""
+        content_prefix = "Question: {} Passage: ".format(query)
+        return cls(prompt, passages, max_length, 13, content_prefix)
+
+    @classmethod
+    def aspects(
+        cls, query: str, passages: str, prompt: str, max_length: int = 300
+    ) -> "SummarizationRequest":
+        """Creates a request equivalent to GPTSummarizer.summarize_aspects."""
+        content_prefix = "Question: {} Relevant information: ".format(query)
+        return cls(prompt, passages, max_length, 13, content_prefix)
+
+    @classmethod
+    def text(
+        cls, text: str, prompt: str, max_length: int = 100
+    ) -> "SummarizationRequest":
+        """Creates a request equivalent to GPTSummarizer.summarize_text."""
+        return cls(prompt, text, max_length)
+
+    def messages(self) -> List[Dict[str, str]]:
+        """Returns the prompt messages followed by the input sample."""
+        content = self.content_prefix + self.input_text
+        return self.prompt + [{"role": "user", "content": content}]
 
 
 class GPTSummarizer(Summarizer):
     def __init__(
-        self, api_key: str, gpt_version: str = DEFAULT_GPT_VERSION
+        self,
+        api_key: str,
+        gpt_version: str = DEFAULT_GPT_VERSION,
+        cache: ResponseCache = None,
     ) -> None:
         """Instantiates a summarizer based on OpenAI's GPT model.
 
@@ -107,9 +435,191 @@ class GPTSummarizer(Summarizer):
             api_key: OpenAI API key.
             gpt_version (optional): OpenAI GPT model version. Defaults to
               file-level constant DEFAULT_GPT_VERSION.
+            cache (optional): Persistent response cache shared by all
+              summarization methods. Defaults to None (no caching).
         """  # noqa
+        from openai import OpenAI
+
         self._openai_client = OpenAI(api_key=api_key)
         self._gpt_version = gpt_version
+        self._cache = cache
+        self._token_budget = TokenBudget(gpt_version)
+
+    def token_counters(self) -> Dict[str, int]:
+        """Returns the number of calls, used tokens and trimmed inputs."""
+        return self._token_budget.counters()
+
+    def _complete(
+        self, messages: List[Dict[str, str]], max_length: int, seed: int = None
+    ) -> str:
+        """Generates a chat completion, reusing a cached response if available.
+
+        Args:
+            messages: Prompt messages including the input sample.
+            max_length: Maximum number of tokens in the completion.
+            seed (optional): Sampling seed. Defaults to None.
+
+        Returns:
+            Generated text.
+        """
+        key = None
+        if self._cache is not None:
+            key = ResponseCache.make_key(
+                self._gpt_version, messages, max_tokens=max_length, seed=seed
+            )
+            cached_response = self._cache.get(key)
+            if cached_response is not None:
+                return cached_response
+
+        request = {
+            "model": self._gpt_version,
+            "messages": messages,
+            "max_tokens": max_length,
+        }
+        if seed is not None:
+            request["seed"] = seed
+        response = self._openai_client.chat.completions.create(**request)
+        self._token_budget.record_usage(getattr(response, "usage", None))
+        predicted_response = response.choices[0].message.content
+
+        if key is not None:
+            self._cache.put(key, predicted_response)
+        return predicted_response
+
+    def _fit(
+        self, request: SummarizationRequest
+    ) -> Optional[SummarizationRequest]:
+        """Trims the text of a request to fit the context window of the model.
+
+        Args:
+            request: Summarization request.
+
+        Returns:
+            Request that fits the context window, or None if even the prompt
+            alone does not fit.
+        """
+        text = self._token_budget.fit(
+            request.prompt,
+            request.content_prefix,
+            request.input_text,
+            max_tokens=request.max_length,
+        )
+        if text is None:
+            return None
+        if text is request.input_text:
+            return request
+        return replace(request, input_text=text)
+
+    def summarize(self, request: SummarizationRequest) -> str:
+        """Runs a single summarization request.
+
+        Oversize input text is trimmed to fit the context window of the model.
+
+        Args:
+            request: Summarization request.
+
+        Returns:
+            Generated summary or "-1" if the prompt alone is too long.
+        """
+        with profiling.stage(request.stage):
+            request = self._fit(request)
+            if request is None:
+                return "-1"
+            return self._complete(
+                request.messages(), request.max_length, seed=request.seed
+            )
+
+    def summarize_streaming(
+        self, request: SummarizationRequest, stop: Callable[[str], bool]
+    ) -> Optional[str]:
+        """Runs a summarization request, streaming the completion.
+
+        The partial completion is passed to stop after every received chunk.
+        As soon as stop returns True, the stream is closed, which cancels the
+        generation of the remaining tokens. Only complete summaries are
+        cached.
+
+        Args:
+            request: Summarization request.
+            stop: Function deciding from the partial completion whether to
+              cancel the generation.
+
+        Returns:
+            Generated summary, None if the generation was cancelled, or "-1"
+            if the prompt alone is too long.
+        """
+        with profiling.stage(request.stage):
+            request = self._fit(request)
+            if request is None:
+                return "-1"
+            return self._complete_streaming(request, stop)
+
+    def _complete_streaming(
+        self, request: SummarizationRequest, stop: Callable[[str], bool]
+    ) -> Optional[str]:
+        """Streams the completion of a request that fits the context window.
+
+        Args:
+            request: Summarization request.
+            stop: Function deciding from the partial completion whether to
+              cancel the generation.
+
+        Returns:
+            Generated summary, or None if the generation was cancelled.
+        """
+        messages = request.messages()
+        key = None
+        if self._cache is not None:
+            key = ResponseCache.make_key(
+                self._gpt_version,
+                messages,
+                max_tokens=request.max_length,
+                seed=request.seed,
+            )
+            cached_response = self._cache.get(key)
+            if cached_response is not None:
+                return cached_response
+
+        stream_request = {
+            "model": self._gpt_version,
+            "messages": messages,
+            "max_tokens": request.max_length,
+            "stream": True,
+            "stream_options": {"include_usage": True},
+        }
+        if request.seed is not None:
+            stream_request["seed"] = request.seed
+        stream = self._openai_client.chat.completions.create(**stream_request)
+        parts: List[str] = []
+        usage = None
+        try:
+            for chunk in stream:
+                usage = getattr(chunk, "usage", None) or usage
+                if not chunk.choices:
+                    continue
+                parts.append(chunk.choices[0].delta.content or "")
+                if stop("".join(parts)):
+                    # Usage is not reported for cancelled streams, so it is
+                    # estimated from the prompt and the received tokens.
+                    self._token_budget.record_usage(
+                        SimpleNamespace(
+                            prompt_tokens=self._token_budget.count_messages(
+                                messages[:-1], messages[-1]
+                            ),
+                            completion_tokens=self._token_budget.count_text(
+                                "".join(parts)
+                            ),
+                        )
+                    )
+                    return None
+        finally:
+            stream.close()
+        self._token_budget.record_usage(usage)
+        predicted_response = "".join(parts)
+
+        if key is not None:
+            self._cache.put(key, predicted_response)
+        return predicted_response
 
     def summarize_aspects(
         self, query: str, passages: str, prompt: str, max_length: int = 300,
@@ -126,27 +636,9 @@ class GPTSummarizer(Summarizer):
         Returns:
             Abstractive summary of text as an answer to a query.
         """
-        input_sample = {
-            "role": "user",
-            "content": "Question: {} Relevant information: {}".format(query, passages),
-        }
-        if (
-            num_tokens_from_messages(
-                prompt + [input_sample], model=self._gpt_version
-            )
-            > 4095
-        ):
-            return "-1"
-        else:
-            response = self._openai_client.chat.completions.create(
-                model=self._gpt_version,
-                messages=prompt + [input_sample],
-                max_tokens=max_length,
-                seed=13,
-            )
-            predicted_response = response.choices[0].message.content
-
-        return predicted_response
+        return self.summarize(
+            SummarizationRequest.aspects(query, passages, prompt, max_length)
+        )
 
     def summarize_passages(
         self, query: str, passages: str, prompt: str, max_length: int = 300,
@@ -163,27 +655,9 @@ class GPTSummarizer(Summarizer):
         Returns:
             Abstractive summary of text as an answer to a query.
         """
-        input_sample = {
-            "role": "user",
-            "content": "Question: {} Passage: {}".format(query, passages),
-        }
-        if (
-            num_tokens_from_messages(
-                prompt + [input_sample], model=self._gpt_version
-            )
-            > 4095
-        ):
-            return "-1"
-        else:
-            response = self._openai_client.chat.completions.create(
-                model=self._gpt_version,
-                messages=prompt + [input_sample],
-                max_tokens=max_length,
-                seed=13,
-            )
-            predicted_response = response.choices[0].message.content
-
-        return predicted_response
+        return self.summarize(
+            SummarizationRequest.passages(query, passages, prompt, max_length)
+        )
 
     def summarize_text(
         self, text: str, prompt: str, max_length: int = 100,
@@ -199,63 +673,367 @@ class GPTSummarizer(Summarizer):
         Returns:
             Abstractive summary of text.
         """
-        input_sample = {
-            "role": "user",
-            "content": text,
-        }
-        if (
-            num_tokens_from_messages(
-                prompt + [input_sample], model=self._gpt_version
+        return self.summarize(
+            SummarizationRequest.text(text, prompt, max_length)
+        )
+
+
+class AsyncGPTSummarizer(GPTSummarizer):
+    def __init__(
+        self,
+        api_key: str,
+        gpt_version: str = DEFAULT_GPT_VERSION,
+        cache: ResponseCache = None,
+        max_concurrency: int = 8,
+        max_retries: int = 6,
+        backoff_base: float = 1.0,
+        backoff_max: float = 60.0,
+    ) -> None:
+        """Instantiates an asynchronous summarizer based on OpenAI's GPT model.
+
+        Blocking summarization methods inherited from GPTSummarizer remain
+        available. Requests passed to summarize_many are run concurrently.
+
+        Args:
+            api_key: OpenAI API key.
+            gpt_version (optional): OpenAI GPT model version. Defaults to
+              file-level constant DEFAULT_GPT_VERSION.
+            cache (optional): Persistent response cache. Defaults to None.
+            max_concurrency (optional): Maximum number of requests in flight.
+              Defaults to 8.
+            max_retries (optional): Maximum number of retries of a request
+              that failed due to rate limiting or a transient error. Defaults
+              to 6.
+            backoff_base (optional): Initial backoff in seconds, doubled after
+              every retry. Defaults to 1 second.
+            backoff_max (optional): Maximum backoff in seconds. Defaults to 60
+              seconds.
+        """
+        super().__init__(api_key, gpt_version=gpt_version, cache=cache)
+        self._api_key = api_key
+        self._max_concurrency = max_concurrency
+        self._max_retries = max_retries
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        self._async_clients: Dict[
+            asyncio.AbstractEventLoop, "AsyncOpenAI"
+        ] = {}
+        self._thread_local = threading.local()
+        # Event loops created by summarize_many_sync, closed by close.
+        self._loops: List[asyncio.AbstractEventLoop] = []
+        self._loops_lock = threading.Lock()
+        # Creates the asynchronous client of an event loop; replaced, e.g., to
+        # route requests through a batching client (see openai_batch).
+        self._async_client_factory: Optional[Callable[[], Any]] = None
+
+    def _async_client(self) -> "AsyncOpenAI":
+        """Returns an asynchronous OpenAI client bound to the running loop."""
+        if self._async_client_factory is not None:
+            return self._async_client_factory()
+        from openai import AsyncOpenAI
+
+        loop = asyncio.get_running_loop()
+        if loop not in self._async_clients:
+            # Retries are handled by _acomplete to respect the backoff policy.
+            self._async_clients[loop] = AsyncOpenAI(
+                api_key=self._api_key, max_retries=0
             )
-            > 4095
-        ):
-            return "-1"
-        else:
-            response = self._openai_client.chat.completions.create(
-                model=self._gpt_version,
-                messages=prompt + [input_sample],
-                max_tokens=max_length,
+        return self._async_clients[loop]
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        """Computes the delay before retrying a failed request.
+
+        The delay given by the retry-after header of a rate limit response
+        takes precedence over exponential backoff.
+
+        Args:
+            attempt: Number of the failed attempt (starting from 0).
+            error: Error raised by the failed request.
+
+        Returns:
+            Delay in seconds.
+        """
+        response = getattr(error, "response", None)
+        if response is not None:
+            retry_after = response.headers.get("retry-after")
+            try:
+                return min(float(retry_after), self._backoff_max)
+            except (TypeError, ValueError):
+                pass
+        delay = min(self._backoff_base * 2 ** attempt, self._backoff_max)
+        return delay * (0.5 + random.random() / 2)
+
+    async def _acomplete(
+        self, messages: List[Dict[str, str]], max_length: int, seed: int = None
+    ) -> str:
+        """Asynchronously generates a chat completion with retries.
+
+        Args:
+            messages: Prompt messages including the input sample.
+            max_length: Maximum number of tokens in the completion.
+            seed (optional): Sampling seed. Defaults to None.
+
+        Returns:
+            Generated text.
+        """
+        key = None
+        if self._cache is not None:
+            key = ResponseCache.make_key(
+                self._gpt_version, messages, max_tokens=max_length, seed=seed
             )
-            predicted_response = response.choices[0].message.content
+            cached_response = self._cache.get(key)
+            if cached_response is not None:
+                return cached_response
+
+        request = {
+            "model": self._gpt_version,
+            "messages": messages,
+            "max_tokens": max_length,
+        }
+        if seed is not None:
+            request["seed"] = seed
+        for attempt in range(self._max_retries + 1):
+            try:
+                response = await self._async_client().chat.completions.create(
+                    **request
+                )
+                break
+            except _retryable_errors() as error:
+                if attempt == self._max_retries:
+                    raise
+                await asyncio.sleep(self._backoff(attempt, error))
+        self._token_budget.record_usage(getattr(response, "usage", None))
+        predicted_response = response.choices[0].message.content
 
+        if key is not None:
+            self._cache.put(key, predicted_response)
         return predicted_response
 
+    async def asummarize(self, request: SummarizationRequest) -> str:
+        """Asynchronously runs a single summarization request.
+
+        Args:
+            request: Summarization request.
+
+        Returns:
+            Generated summary or "-1" if the prompt alone is too long.
+        """
+        with profiling.stage(request.stage):
+            request = self._fit(request)
+            if request is None:
+                return "-1"
+            return await self._acomplete(
+                request.messages(), request.max_length, seed=request.seed
+            )
+
+    async def summarize_many(
+        self, requests: List[SummarizationRequest]
+    ) -> List[str]:
+        """Runs summarization requests concurrently.
+
+        At most max_concurrency requests are in flight at the same time. If
+        requests fail, the first error is raised once all requests are done.
+
+        Args:
+            requests: Summarization requests.
+
+        Returns:
+            Generated summaries in the same order as the requests.
+        """
+        semaphore = asyncio.Semaphore(self._max_concurrency)
+
+        async def run(request: SummarizationRequest) -> str:
+            async with semaphore:
+                return await self.asummarize(request)
+
+        results = await asyncio.gather(
+            *[run(r) for r in requests], return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return list(results)
+
+    def summarize_many_sync(
+        self, requests: List[SummarizationRequest]
+    ) -> List[str]:
+        """Blocking wrapper around summarize_many.
+
+        Every calling thread reuses its own event loop, so that the
+        asynchronous client and its connection pool are kept across calls.
+        The loops are closed by close.
+
+        Args:
+            requests: Summarization requests.
+
+        Returns:
+            Generated summaries in the same order as the requests.
+        """
+        if not requests:
+            return []
+        loop = getattr(self._thread_local, "loop", None)
+        if loop is None:
+            loop = asyncio.new_event_loop()
+            self._thread_local.loop = loop
+            with self._loops_lock:
+                self._loops.append(loop)
+        return loop.run_until_complete(self.summarize_many(requests))
+
+    def close(self) -> None:
+        """Closes the event loops of summarize_many_sync and their clients.
+
+        Must be called once no thread uses the summarizer any more.
+        """
+        with self._loops_lock:
+            loops, self._loops = self._loops, []
+        for loop in loops:
+            client = self._async_clients.pop(loop, None)
+            if client is not None:
+                loop.run_until_complete(client.close())
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.close()
+
+
+def _run_requests(
+    summarizer: GPTSummarizer,
+    requests: List[SummarizationRequest],
+    max_workers: int,
+) -> List[str]:
+    """Runs summarization requests concurrently, preserving their order.
+
+    Asynchronous summarizers run the requests on their event loop; other
+    summarizers run them in a thread pool.
+    """
+    if isinstance(summarizer, AsyncGPTSummarizer):
+        return summarizer.summarize_many_sync(requests)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(summarizer.summarize, requests))
+
+
+def _parse_packed_response(text: str, item_ids: List[str]) -> Dict[str, str]:
+    """Parses the rephrased responses of a packed rephrasing request.
+
+    Args:
+        text: Model output, expected to contain a JSON object mapping item ids
+          to rephrased responses.
+        item_ids: Ids of the items in the request.
+
+    Returns:
+        Rephrased responses by item id. Items that are missing or malformed
+        in the output are left out.
+    """
+    match = _JSON_OBJECT_PATTERN.search(text or "")
+    if match is None:
+        return {}
+    try:
+        parsed = json.loads(match.group(0))
+    except ValueError:
+        return {}
+    if not isinstance(parsed, dict):
+        return {}
+    return {
+        item_id: parsed[item_id].strip()
+        for item_id in item_ids
+        if isinstance(parsed.get(item_id), str) and parsed[item_id].strip()
+    }
+
 
 def rephrase_response(
-    data: pd.DataFrame, response_type: str, summarizer: Summarizer
+    data: "pd.DataFrame",
+    response_type: str,
+    summarizer: GPTSummarizer = None,
+    pack_size: int = 1,
+    max_length: int = 300,
+    max_workers: int = 8,
 ) -> List[str]:
-    rephrased_responses = []
-    prompt = [
-        {
-            "role": "system",
-            "content": "Rephrase the response given a query. Do not change the information included in the response. Do not add information not mentioned in the response. Keep the same number of sentences.",
-        },
+    """Rephrases responses given their queries.
+
+    With pack_size 1, every response is rephrased by its own request. With a
+    larger pack_size, up to pack_size responses are sent in a single request
+    as a JSON list and the model is asked for a JSON object with one
+    rephrased response per item. Items that cannot be parsed from the output
+    of a packed request are rephrased by individual requests. Requests are
+    run concurrently. Empty responses are not rephrased.
+
+    Args:
+        data: Data frame with a query column and a response column.
+        response_type: Name of the response column.
+        summarizer (optional): GPT summarizer whose client and cache are used.
+          Defaults to a new GPTSummarizer.
+        pack_size (optional): Maximum number of responses per request.
+          Defaults to 1.
+        max_length (optional): Maximum number of tokens of a rephrased
+          response. Defaults to 300.
+        max_workers (optional): Number of threads used to run requests of a
+          summarizer that is not asynchronous. Defaults to 8.
+
+    Returns:
+        Rephrased responses in the order of the data frame rows.
+    """
+    if summarizer is None:
+        summarizer = GPTSummarizer(api_key=OPENAI_API_KEY)
+    queries = list(data["query"])
+    responses = list(data[response_type])
+    # Empty responses, e.g., of queries without clusters, stay empty.
+    rephrased_responses: List[Optional[str]] = [
+        None if response else "" for response in responses
+    ]
+    texts = [
+        "Query: " + query + " Response: " + response if response else ""
+        for query, response in zip(queries, responses)
     ]
-    summarizer = GPTSummarizer(api_key=OPENAI_API_KEY)
 
-    for _, row in data.iterrows():
-        rephrased_responses.append(
-            summarizer.summarize_text(
-                text="Query: "
-                + row["query"]
-                + " Response: "
-                + row[response_type],
-                prompt=prompt,
-                max_length=300,
+    if pack_size > 1:
+        indices = [i for i, r in enumerate(rephrased_responses) if r is None]
+        packs = [
+            indices[start : start + pack_size]
+            for start in range(0, len(indices), pack_size)
+        ]
+        packed_requests = [
+            SummarizationRequest.text(
+                json.dumps(
+                    [
+                        {
+                            "id": str(i),
+                            "query": queries[i],
+                            "response": responses[i],
+                        }
+                        for i in pack
+                    ]
+                ),
+                _PACKED_REPHRASE_PROMPT,
+                max_length=max_length * len(pack),
             )
-        )
+            for pack in packs
+        ]
+        outputs = _run_requests(summarizer, packed_requests, max_workers)
+        for pack, output in zip(packs, outputs):
+            parsed = _parse_packed_response(output, [str(i) for i in pack])
+            for i in pack:
+                rephrased_responses[i] = parsed.get(str(i))
+
+    missing = [i for i, r in enumerate(rephrased_responses) if r is None]
+    single_requests = [
+        SummarizationRequest.text(texts[i], _REPHRASE_PROMPT, max_length)
+        for i in missing
+    ]
+    outputs = _run_requests(summarizer, single_requests, max_workers)
+    for i, output in zip(missing, outputs):
+        rephrased_responses[i] = output
 
     return rephrased_responses
 
 
 if __name__ == "__main__":
+    import pandas as pd  # noqa: F811
+
     # Example of response rephrasing with GPT-4
     path = "data/generated_responses/5_relevant/cast-bertopic-bm25-gpt4.csv"
     data = pd.read_csv(path)
 
     summarizer = GPTSummarizer(api_key=OPENAI_API_KEY)
     rephrased_responses = rephrase_response(
-        data, "clusters_based_response", summarizer
+        data, "clusters_based_response", summarizer, pack_size=4
     )
     data["rephrased_clusters_based_response"] = rephrased_responses
 
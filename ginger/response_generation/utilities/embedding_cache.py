@@ -0,0 +1,202 @@
+"""Persistent cache of text embeddings, memory-mapped from disk."""
+
+import fcntl
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from response_generation.utilities import profiling
+
+_DTYPE = np.float16
+_KEYS_FILE = "keys.txt"
+_VECTORS_FILE = "vectors.f16"
+_META_FILE = "meta.json"
+_LOCK_FILE = ".lock"
+
+
+class EmbeddingCache:
+    def __init__(self, path: str) -> None:
+        """Instantiates an on-disk cache of text embeddings.
+
+        Embeddings are stored as float16 rows of a flat file that is
+        memory-mapped for reading, and are addressed by a hash of the text.
+        Row keys are stored one per line in a separate file, in row order.
+        Both files are append-only; appends are serialized with a file lock,
+        so that several worker processes can share the same cache.
+
+        Args:
+            path: Directory of the cache files.
+        """
+        self._path = path
+        os.makedirs(path, exist_ok=True)
+        self._keys_path = os.path.join(path, _KEYS_FILE)
+        self._vectors_path = os.path.join(path, _VECTORS_FILE)
+        self._meta_path = os.path.join(path, _META_FILE)
+        self._lock_path = os.path.join(path, _LOCK_FILE)
+        self._lock = threading.Lock()
+        self._index: Dict[str, int] = {}
+        self._keys_offset = 0
+        self._dim: Optional[int] = None
+        self._vectors: Optional[np.memmap] = None
+        self.hits = 0
+        self.misses = 0
+        with self._lock:
+            self._sync()
+
+    @staticmethod
+    def make_key(text: str) -> str:
+        """Returns the cache key of a text."""
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    @contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        """Holds an exclusive lock on the cache files."""
+        with open(self._lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _sync(self) -> None:
+        """Loads rows appended to the cache files since the last sync."""
+        if self._dim is None and os.path.exists(self._meta_path):
+            with open(self._meta_path) as meta_file:
+                self._dim = json.load(meta_file)["dim"]
+        if not os.path.exists(self._keys_path):
+            return
+        with open(self._keys_path, "rb") as keys_file:
+            keys_file.seek(self._keys_offset)
+            data = keys_file.read()
+        # Only complete lines are read; a partially written line is picked up
+        # by a later sync.
+        data = data[: data.rfind(b"\n") + 1]
+        for key in data.decode("ascii").splitlines():
+            self._index.setdefault(key, len(self._index))
+        self._keys_offset += len(data)
+        if self._index and (
+            self._vectors is None or self._vectors.shape[0] < len(self._index)
+        ):
+            self._vectors = np.memmap(
+                self._vectors_path,
+                dtype=_DTYPE,
+                mode="r",
+                shape=(len(self._index), self._dim),
+            )
+
+    def get_many(self, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """Returns cached embeddings of texts.
+
+        Args:
+            texts: Texts to look up.
+
+        Returns:
+            Float32 embedding of every text, or None for texts not cached.
+        """
+        keys = [self.make_key(text) for text in texts]
+        with self._lock:
+            if any(key not in self._index for key in keys):
+                self._sync()
+            embeddings = [
+                np.asarray(self._vectors[self._index[key]], dtype=np.float32)
+                if key in self._index
+                else None
+                for key in keys
+            ]
+            hits = sum(embedding is not None for embedding in embeddings)
+            self.hits += hits
+            self.misses += len(keys) - hits
+        profiling.record_cache_hit(hits)
+        return embeddings
+
+    def put_many(self, texts: Sequence[str], embeddings: np.ndarray) -> None:
+        """Stores embeddings of texts.
+
+        Args:
+            texts: Texts.
+            embeddings: Embeddings of the texts, one row per text.
+        """
+        embeddings = np.asarray(embeddings, dtype=_DTYPE)
+        with self._lock, self._file_lock():
+            # Rows appended by other processes are loaded first, so that
+            # texts are not stored twice and row numbers stay consistent.
+            self._sync()
+            if self._dim is None:
+                self._dim = embeddings.shape[1]
+                with open(self._meta_path, "w") as meta_file:
+                    json.dump({"dim": self._dim, "dtype": "float16"}, meta_file)
+            elif embeddings.shape[1] != self._dim:
+                raise ValueError(
+                    "Expected embeddings of dimension {}, got {}".format(
+                        self._dim, embeddings.shape[1]
+                    )
+                )
+            new_keys, new_rows = [], []
+            for text, embedding in zip(texts, embeddings):
+                key = self.make_key(text)
+                if key not in self._index and key not in new_keys:
+                    new_keys.append(key)
+                    new_rows.append(embedding)
+            if not new_keys:
+                return
+            # Vectors are written before keys: a key is only visible once its
+            # row is complete. Rows without a key, left by an interrupted
+            # append, are dropped.
+            size = len(self._index) * self._dim * np.dtype(_DTYPE).itemsize
+            if os.path.exists(self._vectors_path):
+                if os.path.getsize(self._vectors_path) > size:
+                    os.truncate(self._vectors_path, size)
+            with open(self._vectors_path, "ab") as vectors_file:
+                vectors_file.write(np.stack(new_rows).tobytes())
+            with open(self._keys_path, "ab") as keys_file:
+                keys_file.write("".join(k + "\n" for k in new_keys).encode())
+            self._sync()
+
+    def get_or_compute(
+        self,
+        texts: Sequence[str],
+        encode: Callable[[List[str]], np.ndarray],
+    ) -> np.ndarray:
+        """Returns embeddings of texts, computing and storing missing ones.
+
+        Args:
+            texts: Texts to embed.
+            encode: Function computing embeddings of a list of texts.
+
+        Returns:
+            Float32 matrix with one embedding per text.
+        """
+        embeddings = self.get_many(texts)
+        missing = list(
+            dict.fromkeys(
+                text
+                for text, embedding in zip(texts, embeddings)
+                if embedding is None
+            )
+        )
+        if missing:
+            # Computed embeddings are rounded to the stored precision, so that
+            # results do not depend on whether the cache was warm.
+            computed = np.asarray(encode(missing), dtype=_DTYPE)
+            self.put_many(missing, computed)
+            computed = computed.astype(np.float32)
+            by_text = dict(zip(missing, computed))
+            embeddings = [
+                by_text[text] if embedding is None else embedding
+                for text, embedding in zip(texts, embeddings)
+            ]
+        return np.stack(embeddings)
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the number of hits, misses and stored embeddings."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._index),
+            }
@@ -0,0 +1,513 @@
+"""Offline batch mode for OpenAI chat completion requests.
+
+In batch mode, components keep issuing chat completion requests as usual, but
+through a BatchingClient. The client answers requests whose results are
+already known and records all other requests before raising
+PendingRequestError. A driver (run_in_batches) repeatedly runs a job, writes
+the recorded requests to a JSONL batch file, submits it to the OpenAI Batch
+API (or to the local stand-in LocalBatchBackend), waits for the batch to
+complete and merges its results back by custom id, until the job completes
+without pending requests.
+"""
+
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterator, List, Optional, TypeVar
+
+from response_generation.utilities.response_cache import ResponseCache
+
+_ENDPOINT = "/v1/chat/completions"
+_TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+# Request parameters that only affect how a response is delivered.
+_DELIVERY_PARAMETERS = ("stream", "stream_options")
+_SENTENCE_BOUNDARY_PATTERN = re.compile(r"(?<=[.!?])\s+")
+# Vocabulary and free-text length of mock responses.
+_MOCK_WORDS = (
+    "energy climate market policy health research water city data school "
+    "history music travel food science sport design film ocean planet"
+).split()
+_DEFAULT_MOCK_WORDS = 20
+
+T = TypeVar("T")
+
+
+class PendingRequestError(Exception):
+    """Raised when the response to a request is not available yet."""
+
+
+def _usage(usage: Optional[Dict[str, int]]) -> Optional[SimpleNamespace]:
+    """Converts usage reported in a batch result to a response attribute."""
+    if not usage:
+        return None
+    return SimpleNamespace(
+        prompt_tokens=usage.get("prompt_tokens"),
+        completion_tokens=usage.get("completion_tokens"),
+    )
+
+
+def _completion(content: str, usage: Optional[Dict[str, int]]) -> Any:
+    """Builds an object shaped like a chat completion response."""
+    message = SimpleNamespace(role="assistant", content=content)
+    return SimpleNamespace(
+        choices=[SimpleNamespace(index=0, message=message)],
+        usage=_usage(usage),
+    )
+
+
+class _CompletionStream:
+    """Stream with a single chunk carrying a complete response."""
+
+    def __init__(self, content: str, usage: Optional[Dict[str, int]]) -> None:
+        delta = SimpleNamespace(role="assistant", content=content)
+        self._chunks = [
+            SimpleNamespace(
+                choices=[SimpleNamespace(index=0, delta=delta)], usage=None
+            ),
+            SimpleNamespace(choices=[], usage=_usage(usage)),
+        ]
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self._chunks)
+
+    def close(self) -> None:
+        pass
+
+
+class BatchingClient:
+    def __init__(self) -> None:
+        """Instantiates a stand-in for the OpenAI client used in batch mode.
+
+        The client exposes chat.completions.create. Requests are identified by
+        a custom id, the hash of the request (see ResponseCache.make_key).
+        Known results are returned as chat completions (or as a single-chunk
+        stream for streaming requests); unknown requests are recorded as
+        pending and PendingRequestError is raised.
+        """
+        self._results: Dict[str, Dict[str, Any]] = {}
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(
+            completions=SimpleNamespace(create=self.create)
+        )
+
+    @staticmethod
+    def make_custom_id(body: Dict[str, Any]) -> str:
+        """Returns the custom id of a request body."""
+        return ResponseCache.make_key(**body)
+
+    def create(self, **request: Any) -> Any:
+        """Returns the result of a chat completion request if known.
+
+        Args:
+            request: Chat completion request parameters.
+
+        Raises:
+            PendingRequestError: If the result is not known yet. The request
+              is recorded for the next batch.
+
+        Returns:
+            Chat completion, or a stream if the request asks for streaming.
+        """
+        body = {
+            name: value
+            for name, value in request.items()
+            if name not in _DELIVERY_PARAMETERS
+        }
+        custom_id = self.make_custom_id(body)
+        with self._lock:
+            result = self._results.get(custom_id)
+            if result is None:
+                self._pending[custom_id] = body
+                raise PendingRequestError(custom_id)
+        if request.get("stream"):
+            return _CompletionStream(result["content"], result["usage"])
+        return _completion(result["content"], result["usage"])
+
+    def as_async(self) -> Any:
+        """Returns a view of the client with an asynchronous create method."""
+
+        async def create(**request: Any) -> Any:
+            return self.create(**request)
+
+        return SimpleNamespace(
+            chat=SimpleNamespace(completions=SimpleNamespace(create=create))
+        )
+
+    @property
+    def num_pending(self) -> int:
+        """Number of requests waiting for the next batch."""
+        with self._lock:
+            return len(self._pending)
+
+    def write_batch_file(self, path: str) -> int:
+        """Writes pending requests to a JSONL batch input file.
+
+        Args:
+            path: Path of the batch file.
+
+        Returns:
+            Number of written requests.
+        """
+        with self._lock:
+            pending = dict(self._pending)
+        with open(path, "w", encoding="utf-8") as batch_file:
+            for custom_id, body in pending.items():
+                line = {
+                    "custom_id": custom_id,
+                    "method": "POST",
+                    "url": _ENDPOINT,
+                    "body": body,
+                }
+                batch_file.write(json.dumps(line, ensure_ascii=False) + "\n")
+        return len(pending)
+
+    def merge_results(self, lines: List[str]) -> int:
+        """Merges lines of a batch output file into the known results.
+
+        Failed requests stay pending and are retried in the next batch.
+
+        Args:
+            lines: Lines of the batch output file.
+
+        Returns:
+            Number of merged results.
+        """
+        merged = 0
+        with self._lock:
+            for line in lines:
+                if not line.strip():
+                    continue
+                output = json.loads(line)
+                response = output.get("response") or {}
+                if output.get("error") or response.get("status_code") != 200:
+                    continue
+                body = response["body"]
+                self._results[output["custom_id"]] = {
+                    "content": body["choices"][0]["message"]["content"],
+                    "usage": body.get("usage"),
+                }
+                self._pending.pop(output["custom_id"], None)
+                merged += 1
+        return merged
+
+    def load_results(self, path: str) -> int:
+        """Merges the results of a previously downloaded batch output file."""
+        with open(path, encoding="utf-8") as output_file:
+            return self.merge_results(output_file.readlines())
+
+
+def install_batching_client(component: Any, client: BatchingClient) -> None:
+    """Routes the OpenAI requests of a component through a batching client.
+
+    Works with components that keep their client in _openai_client, i.e.,
+    GPTSummarizer, GPTNuggetDetector and GTPAspectsDetector. Asynchronous
+    summarizers also get the asynchronous view of the client.
+
+    Args:
+        component: Component issuing chat completion requests.
+        client: Batching client.
+    """
+    component._openai_client = client
+    if hasattr(component, "_async_client_factory"):
+        component._async_client_factory = client.as_async
+
+
+def submit_batch(
+    backend: Any,
+    batch_path: str,
+    poll_interval: float = 30.0,
+    timeout: float = 24 * 3600,
+) -> List[str]:
+    """Submits a batch file and waits for its results.
+
+    Args:
+        backend: OpenAI client or LocalBatchBackend.
+        batch_path: Path of the JSONL batch input file.
+        poll_interval (optional): Seconds between status checks. Defaults to
+          30 seconds.
+        timeout (optional): Maximum number of seconds to wait. Defaults to 24
+          hours, the completion window of the batch.
+
+    Raises:
+        RuntimeError: If the batch does not complete.
+
+    Returns:
+        Lines of the batch output file.
+    """
+    with open(batch_path, "rb") as batch_file:
+        input_file = backend.files.create(file=batch_file, purpose="batch")
+    batch = backend.batches.create(
+        input_file_id=input_file.id,
+        endpoint=_ENDPOINT,
+        completion_window="24h",
+    )
+    deadline = time.monotonic() + timeout
+    while batch.status not in _TERMINAL_STATUSES:
+        if time.monotonic() > deadline:
+            raise RuntimeError(
+                "Batch {} did not complete in time".format(batch.id)
+            )
+        time.sleep(poll_interval)
+        batch = backend.batches.retrieve(batch.id)
+    if batch.status != "completed" or not batch.output_file_id:
+        raise RuntimeError(
+            "Batch {} ended with status {}".format(batch.id, batch.status)
+        )
+    return backend.files.content(batch.output_file_id).text.splitlines()
+
+
+def run_in_batches(
+    job: Callable[[], T],
+    client: BatchingClient,
+    backend: Any,
+    work_dir: str,
+    max_passes: int = 10,
+    poll_interval: float = 30.0,
+) -> T:
+    """Runs a job in batch mode until it has no pending requests.
+
+    The job is expected to record as many requests as possible before raising
+    PendingRequestError, e.g., by deferring queries with pending requests to
+    the next pass. Batch input and output files are kept in a subdirectory
+    of work_dir per kind of backend (local or openai); output files of
+    earlier runs with the same kind of backend are merged first, so that an
+    interrupted run can be resumed without resubmitting finished batches,
+    while mock results of LocalBatchBackend are never reused by a run against
+    the OpenAI Batch API.
+
+    Args:
+        job: Function running the job with its components routed through the
+          client.
+        client: Batching client.
+        backend: OpenAI client or LocalBatchBackend.
+        work_dir: Directory of the per-backend directories of batch files.
+        max_passes (optional): Maximum number of runs of the job. Defaults to
+          10.
+        poll_interval (optional): Seconds between status checks of a batch.
+          Defaults to 30 seconds.
+
+    Raises:
+        RuntimeError: If the job still has pending requests after max_passes.
+
+    Returns:
+        Result of the job.
+    """
+    backend_name = (
+        "local" if isinstance(backend, LocalBatchBackend) else "openai"
+    )
+    work_dir = os.path.join(work_dir, backend_name)
+    os.makedirs(work_dir, exist_ok=True)
+    for name in sorted(os.listdir(work_dir)):
+        if name.endswith("-output.jsonl"):
+            client.load_results(os.path.join(work_dir, name))
+
+    for pass_index in range(max_passes):
+        try:
+            return job()
+        except PendingRequestError:
+            if client.num_pending == 0:
+                raise
+        batch_name = "batch-{}-{:02d}".format(
+            time.strftime("%Y%m%d-%H%M%S"), pass_index
+        )
+        batch_path = os.path.join(work_dir, batch_name + "-input.jsonl")
+        num_requests = client.write_batch_file(batch_path)
+        print("Submitting batch of {} requests".format(num_requests))
+        lines = submit_batch(backend, batch_path, poll_interval)
+        output_path = os.path.join(work_dir, batch_name + "-output.jsonl")
+        with open(output_path, "w", encoding="utf-8") as output_file:
+            output_file.write("\n".join(lines) + "\n")
+        client.merge_results(lines)
+    raise RuntimeError(
+        "Requests still pending after {} passes".format(max_passes)
+    )
+
+
+def _mock_aspects(rng: random.Random) -> Dict[str, List[str]]:
+    """Returns covered and not covered aspects of a passage."""
+    aspects = rng.sample(_MOCK_WORDS, 8)
+    return {"covered": aspects[:4], "not_covered": aspects[4:]}
+
+
+def _mock_sentence(rng: random.Random, num_words: int) -> str:
+    """Returns a sentence of random words."""
+    words = [rng.choice(_MOCK_WORDS) for _ in range(num_words)]
+    return " ".join(words).capitalize() + "."
+
+
+def _json_items(content: str) -> List[Dict[str, Any]]:
+    """Returns the items of the JSON list of a packed request."""
+    return json.loads(content[content.index("[") :])
+
+
+def mock_response(
+    body: Dict[str, Any],
+    rng: Optional[random.Random] = None,
+    num_words: int = _DEFAULT_MOCK_WORDS,
+) -> str:
+    """Returns a deterministic response following the protocol of a request.
+
+    Nugget detection requests (whose system prompt asks for <IN> annotations)
+    get the passage with every sentence annotated, aspect detection requests
+    get a JSON object with covered and not covered aspects (per passage id for
+    packed requests) and packed (JSON) rephrasing requests get a JSON object
+    with one response per item id. Other requests, e.g., summaries, get
+    num_words random words.
+
+    Args:
+        body: Chat completion request body.
+        rng (optional): Random generator of the response content. Defaults to
+          None, in which case it is seeded by a hash of the messages.
+        num_words (optional): Length of free-text responses in words.
+          Defaults to 20.
+
+    Returns:
+        Response content.
+    """
+    messages = body["messages"]
+    system = messages[0]["content"] if len(messages) > 1 else ""
+    content = messages[-1]["content"]
+    if rng is None:
+        rng = random.Random(
+            hashlib.sha256(
+                json.dumps(messages, sort_keys=True).encode("utf-8")
+            ).hexdigest()
+        )
+    if "<IN>" in system:
+        passage = content.split("Passage:", 1)[-1].strip()
+        sentences = _SENTENCE_BOUNDARY_PATTERN.split(passage)
+        return " ".join("<IN>" + s + "</IN>" for s in sentences if s)
+    if "aspects" in system.lower():
+        if content.startswith("Passages:"):
+            return json.dumps(
+                {
+                    item["id"]: _mock_aspects(rng)
+                    for item in _json_items(content)
+                }
+            )
+        return json.dumps(_mock_aspects(rng))
+    if "JSON" in system:
+        return json.dumps(
+            {
+                item["id"]: _mock_sentence(rng, num_words)
+                for item in _json_items(content)
+            },
+            ensure_ascii=False,
+        )
+    return " ".join(rng.choice(_MOCK_WORDS) for _ in range(num_words)) + "."
+
+
+class LocalBatchBackend:
+    def __init__(
+        self,
+        responder: Callable[[Dict[str, Any]], str] = mock_response,
+        polls_until_complete: int = 1,
+    ) -> None:
+        """Instantiates an in-process stand-in for the OpenAI Batch API.
+
+        Implements the parts of files and batches used by submit_batch.
+        Every request of a batch is answered by responder, and a batch is
+        reported as completed after the given number of status checks.
+
+        Args:
+            responder (optional): Function returning the response content for
+              a request body. Defaults to mock_response, deterministic
+              responses following the protocol of every prompt.
+            polls_until_complete (optional): Number of retrievals before a
+              batch completes. Defaults to 1.
+        """
+        self._responder = responder
+        self._polls_until_complete = polls_until_complete
+        self._files: Dict[str, bytes] = {}
+        self._batches: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self.files = SimpleNamespace(
+            create=self._create_file, content=self._file_content
+        )
+        self.batches = SimpleNamespace(
+            create=self._create_batch, retrieve=self._retrieve_batch
+        )
+
+    def _add_file(self, data: bytes) -> str:
+        """Stores file content and returns its id."""
+        with self._lock:
+            file_id = "file-{}".format(len(self._files))
+            self._files[file_id] = data
+        return file_id
+
+    def _create_file(self, file: io.BufferedReader, purpose: str) -> Any:
+        """Uploads a file."""
+        return SimpleNamespace(id=self._add_file(file.read()), purpose=purpose)
+
+    def _file_content(self, file_id: str) -> Any:
+        """Returns the content of a file."""
+        return SimpleNamespace(text=self._files[file_id].decode("utf-8"))
+
+    def _create_batch(
+        self, input_file_id: str, endpoint: str, completion_window: str
+    ) -> Any:
+        """Creates a batch from an uploaded input file."""
+        with self._lock:
+            batch_id = "batch-{}".format(len(self._batches))
+            self._batches[batch_id] = {
+                "input_file_id": input_file_id,
+                "polls": 0,
+                "output_file_id": None,
+            }
+        return self._retrieve_batch(batch_id, poll=False)
+
+    def _run_batch(self, input_file_id: str) -> str:
+        """Answers all requests of an input file and returns the output id."""
+        output_lines = []
+        for line in self._files[input_file_id].decode("utf-8").splitlines():
+            request = json.loads(line)
+            content = self._responder(request["body"])
+            output_lines.append(
+                json.dumps(
+                    {
+                        "custom_id": request["custom_id"],
+                        "response": {
+                            "status_code": 200,
+                            "body": {
+                                "choices": [
+                                    {
+                                        "index": 0,
+                                        "message": {
+                                            "role": "assistant",
+                                            "content": content,
+                                        },
+                                    }
+                                ],
+                                "usage": {
+                                    "prompt_tokens": 0,
+                                    "completion_tokens": len(content.split()),
+                                },
+                            },
+                        },
+                        "error": None,
+                    }
+                )
+            )
+        return self._add_file("\n".join(output_lines).encode("utf-8"))
+
+    def _retrieve_batch(self, batch_id: str, poll: bool = True) -> Any:
+        """Returns the status of a batch, running it once it is due."""
+        batch = self._batches[batch_id]
+        if poll:
+            batch["polls"] += 1
+        if (
+            batch["output_file_id"] is None
+            and batch["polls"] >= self._polls_until_complete
+        ):
+            batch["output_file_id"] = self._run_batch(batch["input_file_id"])
+        status = "completed" if batch["output_file_id"] else "in_progress"
+        return SimpleNamespace(
+            id=batch_id, status=status, output_file_id=batch["output_file_id"]
+        )
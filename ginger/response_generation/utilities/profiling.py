@@ -0,0 +1,340 @@
+"""Per-query, per-stage timing and cost instrumentation of the pipeline.
+
+A QueryTrace collects, for every stage of a query, the wall time, the number
+of model calls, prompt and completion tokens and cache hits. Code running
+inside trace.stage(name) is attributed to that stage: components report model
+calls and cache hits with record_call and record_cache_hit, which add them to
+the innermost active stage (tracked in a context variable, so concurrent
+asyncio tasks and threads started with a copied context are attributed
+correctly). Nested stages are opened with the module-level stage function.
+Traces are picklable, so a trace can travel with a query record through
+worker processes. StageProfiler writes finished traces to a JSONL file and
+summarizes them per stage.
+"""
+
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import partial
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+PROFILERS = ("cprofile", "pyinstrument")
+
+# Innermost active stage as a pair of trace and stage name.
+_active_stage: contextvars.ContextVar[
+    Optional[Tuple["QueryTrace", str]]
+] = contextvars.ContextVar("active_stage", default=None)
+# Only one profiler can be active in a process at a time.
+_capture_lock = threading.Lock()
+
+
+def _new_stats() -> Dict[str, float]:
+    """Returns empty counters of a stage."""
+    return {
+        "seconds": 0.0,
+        "calls": 0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "cache_hits": 0,
+    }
+
+
+class QueryTrace:
+    def __init__(
+        self,
+        query_id: str,
+        capture_stage: str = None,
+        profiler: str = "cprofile",
+        capture_dir: str = None,
+    ) -> None:
+        """Instantiates the trace of a query.
+
+        Args:
+            query_id: Query identifier.
+            capture_stage (optional): Name of a stage to capture with a
+              profiler. Defaults to None (no capture).
+            profiler (optional): Profiler used for the captured stage, one of
+              "cprofile" and "pyinstrument". Defaults to "cprofile".
+            capture_dir (optional): Directory for profiler output, named
+              <query_id>-<stage>.prof (cProfile) or .html (pyinstrument).
+        """
+        if profiler not in PROFILERS:
+            raise ValueError(
+                "Unsupported profiler {}, expected one of {}".format(
+                    profiler, PROFILERS
+                )
+            )
+        self.query_id = query_id
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self._capture_stage = capture_stage
+        self._profiler = profiler
+        self._capture_dir = capture_dir
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def add(self, stage_name: str, **counters: float) -> None:
+        """Adds to the counters of a stage.
+
+        Args:
+            stage_name: Stage name.
+            counters: Increments by counter name (seconds, calls,
+              prompt_tokens, completion_tokens, cache_hits).
+        """
+        with self._lock:
+            stats = self.stages.setdefault(stage_name, _new_stats())
+            for name, value in counters.items():
+                stats[name] += value
+
+    @contextmanager
+    def stage(self, stage_name: str) -> Iterator[None]:
+        """Attributes the time and model calls of a code block to a stage.
+
+        Args:
+            stage_name: Stage name.
+        """
+        token = _active_stage.set((self, stage_name))
+        start = time.perf_counter()
+        try:
+            if stage_name == self._capture_stage:
+                with self._capture(stage_name):
+                    yield
+            else:
+                yield
+        finally:
+            self.add(stage_name, seconds=time.perf_counter() - start)
+            _active_stage.reset(token)
+
+    @contextmanager
+    def _capture(self, stage_name: str) -> Iterator[None]:
+        """Runs a code block under a profiler and saves its output.
+
+        The block is not captured if another block is being captured in the
+        same process.
+        """
+        if not _capture_lock.acquire(blocking=False):
+            yield
+            return
+        try:
+            os.makedirs(self._capture_dir or ".", exist_ok=True)
+            path = os.path.join(
+                self._capture_dir or ".",
+                "{}-{}".format(self.query_id, stage_name),
+            )
+            if self._profiler == "pyinstrument":
+                from pyinstrument import Profiler
+
+                profiler = Profiler()
+                profiler.start()
+                try:
+                    yield
+                finally:
+                    profiler.stop()
+                    with open(path + ".html", "w") as output_file:
+                        output_file.write(profiler.output_html())
+            else:
+                import cProfile
+
+                profiler = cProfile.Profile()
+                profiler.enable()
+                try:
+                    yield
+                finally:
+                    profiler.disable()
+                    profiler.dump_stats(path + ".prof")
+        finally:
+            _capture_lock.release()
+
+    def records(self) -> List[Dict[str, Any]]:
+        """Returns one trace record per stage."""
+        with self._lock:
+            return [
+                dict(query_id=self.query_id, stage=stage_name, **stats)
+                for stage_name, stats in self.stages.items()
+            ]
+
+
+@contextmanager
+def stage(stage_name: Optional[str]) -> Iterator[None]:
+    """Opens a nested stage in the trace of the active stage, if any.
+
+    Args:
+        stage_name: Stage name. If None, the block stays in the active stage.
+    """
+    active = _active_stage.get()
+    if active is None or stage_name is None:
+        yield
+        return
+    with active[0].stage(stage_name):
+        yield
+
+
+def record_call(
+    prompt_tokens: Optional[int] = 0, completion_tokens: Optional[int] = 0
+) -> None:
+    """Counts a model call and its tokens in the active stage, if any."""
+    active = _active_stage.get()
+    if active is not None:
+        active[0].add(
+            active[1],
+            calls=1,
+            prompt_tokens=prompt_tokens or 0,
+            completion_tokens=completion_tokens or 0,
+        )
+
+
+def record_cache_hit(count: int = 1) -> None:
+    """Counts cache hits in the active stage, if any."""
+    active = _active_stage.get()
+    if active is not None and count:
+        active[0].add(active[1], cache_hits=count)
+
+
+class _InstrumentedCompletions:
+    """Proxy of chat.completions that records every call."""
+
+    def __init__(self, completions: Any) -> None:
+        self._completions = completions
+
+    def create(self, **request: Any) -> Any:
+        response = self._completions.create(**request)
+        usage = getattr(response, "usage", None)
+        record_call(
+            getattr(usage, "prompt_tokens", 0),
+            getattr(usage, "completion_tokens", 0),
+        )
+        return response
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._completions, name)
+
+
+class _InstrumentedChat:
+    """Proxy of the chat namespace of an OpenAI client."""
+
+    def __init__(self, chat: Any) -> None:
+        self.completions = _InstrumentedCompletions(chat.completions)
+        self._chat = chat
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._chat, name)
+
+
+class _InstrumentedClient:
+    """Proxy of an OpenAI client that records chat completion calls."""
+
+    def __init__(self, client: Any) -> None:
+        self.chat = _InstrumentedChat(client.chat)
+        self._client = client
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._client, name)
+
+
+def instrument_client(component: Any) -> None:
+    """Records the calls of a component that does not report them itself.
+
+    Wraps the OpenAI client kept in the _openai_client attribute of the
+    component, e.g., of GPTNuggetDetector. Components that count tokens with
+    TokenBudget (GPTSummarizer, GTPAspectsDetector) already report their
+    calls and must not be instrumented again.
+
+    Args:
+        component: Component issuing chat completion requests.
+    """
+    component._openai_client = _InstrumentedClient(component._openai_client)
+
+
+class StageProfiler:
+    def __init__(
+        self,
+        trace_path: str,
+        capture_stage: str = None,
+        profiler: str = "cprofile",
+        capture_dir: str = None,
+    ) -> None:
+        """Instantiates a collector of query traces.
+
+        Args:
+            trace_path: Path of the JSONL trace file, with one record per
+              query and stage. The file is overwritten.
+            capture_stage (optional): Name of a stage to capture with a
+              profiler. Defaults to None (no capture).
+            profiler (optional): Profiler used for the captured stage.
+              Defaults to "cprofile".
+            capture_dir (optional): Directory for profiler output. Defaults to
+              the directory of the trace file.
+        """
+        directory = os.path.dirname(trace_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._trace_file = open(trace_path, "w", encoding="utf-8")
+        self._capture_stage = capture_stage
+        self._profiler = profiler
+        self._capture_dir = capture_dir or directory or "."
+        self._records: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def trace_factory(self) -> Callable[[str], QueryTrace]:
+        """Returns a function creating query traces with the capture settings.
+
+        Unlike the profiler itself, which holds the open trace file, the
+        function is picklable and can be passed to worker processes.
+        """
+        return partial(
+            QueryTrace,
+            capture_stage=self._capture_stage,
+            profiler=self._profiler,
+            capture_dir=self._capture_dir,
+        )
+
+    def new_trace(self, query_id: str) -> QueryTrace:
+        """Returns a new trace of a query with the capture settings."""
+        return self.trace_factory()(query_id)
+
+    def add(self, trace: QueryTrace) -> None:
+        """Writes the records of a finished trace to the trace file."""
+        records = trace.records()
+        with self._lock:
+            for record in records:
+                self._trace_file.write(json.dumps(record) + "\n")
+            self._trace_file.flush()
+            self._records.extend(records)
+
+    def summary(self) -> str:
+        """Returns a table of the counters per stage, summed over queries.
+
+        The time of a stage includes the time of its nested stages. Stages
+        whose requests run concurrently report the sum of their request
+        times.
+        """
+        import pandas as pd
+
+        if not self._records:
+            return "No stages recorded"
+        records = pd.DataFrame(self._records)
+        table = records.groupby("stage", sort=False).agg(
+            queries=("query_id", "nunique"),
+            total_seconds=("seconds", "sum"),
+            mean_seconds=("seconds", "mean"),
+            p95_seconds=("seconds", lambda s: s.quantile(0.95)),
+            calls=("calls", "sum"),
+            prompt_tokens=("prompt_tokens", "sum"),
+            completion_tokens=("completion_tokens", "sum"),
+            cache_hits=("cache_hits", "sum"),
+        )
+        return table.round(3).to_string()
+
+    def close(self) -> None:
+        """Closes the trace file."""
+        self._trace_file.close()
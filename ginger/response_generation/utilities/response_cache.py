@@ -0,0 +1,200 @@
+"""Persistent content-addressed cache for OpenAI chat completion responses."""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from response_generation.utilities import profiling
+
+_DEFAULT_MAX_SIZE_BYTES = 512 * 1024 * 1024
+
+
+class ReplayMissError(KeyError):
+    """Raised when a response is not cached and the cache is in replay mode."""
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        path: str,
+        max_size_bytes: int = _DEFAULT_MAX_SIZE_BYTES,
+        replay: bool = False,
+    ) -> None:
+        """Instantiates an on-disk SQLite cache for model responses.
+
+        Entries are addressed by a hash of the request (model, messages,
+        max_tokens and seed). When the total size of stored responses exceeds
+        max_size_bytes, least recently used entries are evicted.
+
+        Args:
+            path: Path to the SQLite database file.
+            max_size_bytes (optional): Maximum total size of cached responses
+              in bytes. Defaults to 512 MB.
+            replay (optional): Whether to open the cache in read-only replay
+              mode. In replay mode nothing is written to the cache and misses
+              raise ReplayMissError instead of calling the model. Defaults to
+              False.
+        """
+        self._path = path
+        self._max_size_bytes = max_size_bytes
+        self.replay = replay
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._total_size = 0
+
+        if replay:
+            self._connection = sqlite3.connect(
+                "file:{}?mode=ro".format(path),
+                uri=True,
+                check_same_thread=False,
+            )
+        else:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(path, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, "
+                "response TEXT NOT NULL, "
+                "size INTEGER NOT NULL, "
+                "last_access REAL NOT NULL)"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS responses_last_access "
+                "ON responses (last_access)"
+            )
+            self._connection.commit()
+            # The total size of stored responses is kept up to date by put
+            # and _evict, so that it is summed up only once.
+            self._total_size = self._connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()[0]
+
+    @staticmethod
+    def make_key(
+        model: str,
+        messages: List[Dict[str, str]],
+        max_tokens: Optional[int] = None,
+        seed: Optional[int] = None,
+        **kwargs: Any,
+    ) -> str:
+        """Computes the content address of a chat completion request.
+
+        Args:
+            model: Model name.
+            messages: Prompt messages including the input sample.
+            max_tokens (optional): Maximum number of generated tokens.
+            seed (optional): Sampling seed.
+            kwargs: Any other request parameters that affect the response.
+
+        Returns:
+            Hex digest identifying the request.
+        """
+        request = {
+            "model": model,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "seed": seed,
+        }
+        request.update(kwargs)
+        serialized = json.dumps(request, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Returns cached response for a key and updates hit/miss counters.
+
+        Args:
+            key: Request key (see make_key).
+
+        Raises:
+            ReplayMissError: If the key is not cached in replay mode.
+
+        Returns:
+            Cached response or None if the key is not cached.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT response FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                if self.replay:
+                    raise ReplayMissError(key)
+                return None
+            self.hits += 1
+            profiling.record_cache_hit()
+            if not self.replay:
+                self._connection.execute(
+                    "UPDATE responses SET last_access = ? WHERE key = ?",
+                    (time.time(), key),
+                )
+                self._connection.commit()
+            return row[0]
+
+    def put(self, key: str, response: str) -> None:
+        """Stores a response and evicts least recently used entries if needed.
+
+        Does nothing in replay mode or for responses without content (None),
+        e.g., completions stopped by a content filter.
+
+        Args:
+            key: Request key (see make_key).
+            response: Model response.
+        """
+        if self.replay or response is None:
+            return
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT size FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                self._total_size -= row[0]
+            self._total_size += size
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(key, response, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, response, size, time.time()),
+            )
+            self._evict()
+            self._connection.commit()
+
+    def _evict(self) -> None:
+        """Deletes least recently used entries until the size limit is met."""
+        if self._total_size <= self._max_size_bytes:
+            return
+        rows = self._connection.execute(
+            "SELECT key, size FROM responses ORDER BY last_access ASC"
+        ).fetchall()
+        stale_keys = []
+        for key, size in rows:
+            if self._total_size <= self._max_size_bytes:
+                break
+            stale_keys.append((key,))
+            self._total_size -= size
+        self._connection.executemany(
+            "DELETE FROM responses WHERE key = ?", stale_keys
+        )
+
+    def stats(self) -> Dict[str, int]:
+        """Returns hit/miss counters and the number of cached entries."""
+        with self._lock:
+            entries, size = self._connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": entries,
+            "size_bytes": size,
+        }
+
+    def close(self) -> None:
+        """Closes the underlying database connection."""
+        self._connection.close()
@@ -0,0 +1,217 @@
+"""Token counting and budgeting for OpenAI chat completion requests."""
+
+import threading
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from response_generation.utilities import profiling
+
+if TYPE_CHECKING:
+    from tiktoken import Encoding
+
+# Context windows (prompt and completion tokens) of OpenAI chat models. Model
+# names are matched by longest prefix, e.g., "gpt-4-0613" matches "gpt-4".
+_CONTEXT_WINDOWS = {
+    "gpt-3.5-turbo": 16385,
+    "gpt-3.5-turbo-instruct": 4096,
+    "gpt-4": 8192,
+    "gpt-4-32k": 32768,
+    "gpt-4-turbo": 128000,
+    "gpt-4-1106": 128000,
+    "gpt-4-0125": 128000,
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+}
+_DEFAULT_CONTEXT_WINDOW = 4096
+# Completion tokens reserved when a request does not set max_tokens.
+_DEFAULT_COMPLETION_RESERVE = 1024
+# Every message is wrapped in <|start|>{role}\n{content}<|end|>\n and every
+# reply is primed with <|start|>assistant<|message|>.
+_TOKENS_PER_MESSAGE = 3
+_TOKENS_PER_REPLY = 3
+
+Messages = List[Dict[str, str]]
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str) -> "Encoding":
+    """Returns the (cached) tiktoken encoding of a model.
+
+    Args:
+        model: OpenAI model name.
+
+    Returns:
+        Encoding used by the model; cl100k_base for unknown models.
+    """
+    import tiktoken
+
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def get_context_window(model: str) -> int:
+    """Returns the context window of a model in tokens.
+
+    Args:
+        model: OpenAI model name.
+
+    Returns:
+        Context window of the longest matching known model name, or 4096 for
+        unknown models.
+    """
+    matches = [name for name in _CONTEXT_WINDOWS if model.startswith(name)]
+    if not matches:
+        return _DEFAULT_CONTEXT_WINDOW
+    return _CONTEXT_WINDOWS[max(matches, key=len)]
+
+
+class TokenBudget:
+    def __init__(self, model: str, context_window: int = None) -> None:
+        """Instantiates a token budget for requests to an OpenAI model.
+
+        Token counts of fixed prompt prefixes (e.g., system prompts) are cached,
+        so that only the variable input is tokenized for every request. Token
+        usage reported by the API is accumulated in per-budget counters.
+
+        Args:
+            model: OpenAI model name.
+            context_window (optional): Context window of the model in tokens.
+              Defaults to the known context window of the model.
+        """
+        self._model = model
+        self._encoding = get_encoding(model)
+        self.context_window = context_window or get_context_window(model)
+        self._prefix_tokens: Dict[Tuple[Tuple[str, str], ...], int] = {}
+        self._lock = threading.Lock()
+        self._counters = {
+            "calls": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "trimmed_inputs": 0,
+        }
+
+    def count_text(self, text: str) -> int:
+        """Returns the number of tokens in a text."""
+        return len(self._encoding.encode(text))
+
+    def _count_message(self, message: Dict[str, str]) -> int:
+        """Returns the number of tokens of a single message."""
+        return _TOKENS_PER_MESSAGE + sum(
+            self.count_text(value) for value in message.values()
+        )
+
+    def count_prompt(self, prompt: Messages) -> int:
+        """Returns the (cached) number of tokens of fixed prompt messages.
+
+        Args:
+            prompt: Prompt messages, e.g., a system prompt.
+
+        Returns:
+            Number of tokens of the messages without reply priming.
+        """
+        key = tuple(tuple(sorted(message.items())) for message in prompt)
+        if key not in self._prefix_tokens:
+            self._prefix_tokens[key] = sum(
+                self._count_message(message) for message in prompt
+            )
+        return self._prefix_tokens[key]
+
+    def count_messages(
+        self, prompt: Messages, input_sample: Dict[str, str]
+    ) -> int:
+        """Returns the number of prompt tokens of a request.
+
+        Args:
+            prompt: Fixed prompt messages.
+            input_sample: Variable input message.
+
+        Returns:
+            Number of tokens billed as prompt tokens.
+        """
+        return (
+            self.count_prompt(prompt)
+            + self._count_message(input_sample)
+            + _TOKENS_PER_REPLY
+        )
+
+    def input_limit(self, max_tokens: Optional[int] = None) -> int:
+        """Returns the number of prompt tokens left for a request.
+
+        Args:
+            max_tokens (optional): Maximum number of completion tokens of the
+              request. Defaults to a reserve of 1024 tokens.
+
+        Returns:
+            Maximum number of prompt tokens.
+        """
+        if max_tokens is None:
+            max_tokens = _DEFAULT_COMPLETION_RESERVE
+        return self.context_window - max_tokens
+
+    def fit(
+        self,
+        prompt: Messages,
+        content_prefix: str,
+        text: str,
+        max_tokens: Optional[int] = None,
+    ) -> Optional[str]:
+        """Trims text so that a request fits the context window.
+
+        The input message of the request is content_prefix followed by text.
+        Only text is trimmed, keeping its beginning.
+
+        Args:
+            prompt: Fixed prompt messages.
+            content_prefix: Fixed beginning of the input message.
+            text: Variable part of the input message.
+            max_tokens (optional): Maximum number of completion tokens.
+
+        Returns:
+            Text, trimmed if needed, or None if the request does not fit even
+            with an empty text.
+        """
+        limit = self.input_limit(max_tokens)
+        input_sample = {"role": "user", "content": content_prefix + text}
+        if self.count_messages(prompt, input_sample) <= limit:
+            return text
+
+        input_sample["content"] = content_prefix
+        available = limit - self.count_messages(prompt, input_sample)
+        if available <= 0:
+            return None
+        text_tokens = self._encoding.encode(text)
+        # Token boundaries may shift when decoding a prefix, so the trimmed
+        # text is re-counted and shortened until it fits.
+        while available > 0:
+            trimmed = self._encoding.decode(text_tokens[:available])
+            input_sample["content"] = content_prefix + trimmed
+            if self.count_messages(prompt, input_sample) <= limit:
+                with self._lock:
+                    self._counters["trimmed_inputs"] += 1
+                return trimmed
+            available -= 1
+        return None
+
+    def record_usage(self, usage: Any) -> None:
+        """Accumulates the token usage of a completed request.
+
+        The call is also reported to the active profiling stage, if any.
+
+        Args:
+            usage: Usage reported by the API (with prompt_tokens and
+              completion_tokens attributes), or None if not reported.
+        """
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        with self._lock:
+            self._counters["calls"] += 1
+            self._counters["prompt_tokens"] += prompt_tokens
+            self._counters["completion_tokens"] += completion_tokens
+        profiling.record_call(prompt_tokens, completion_tokens)
+
+    def counters(self) -> Dict[str, int]:
+        """Returns a copy of the usage counters."""
+        with self._lock:
+            return dict(self._counters)
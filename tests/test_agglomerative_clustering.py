@@ -0,0 +1,60 @@
+"""Tests for the size-based choice of the nugget clustering."""
+
+import numpy as np
+
+from response_generation.pipeline.components.agglomerative_clustering import (
+    AdaptiveClustering,
+    agglomerative_labels,
+)
+
+EMBEDDINGS = {
+    "Solar is cheap": [1.0, 0.0],
+    "Solar costs little": [0.9, 0.1],
+    "Wind is variable": [0.0, 1.0],
+}
+
+
+class FakeEmbedder:
+    def __init__(self):
+        self.calls = []
+
+    def embed(self, nuggets):
+        self.calls.append(list(nuggets))
+        return np.array([EMBEDDINGS[nugget] for nugget in nuggets])
+
+
+class FakeClustering:
+    def __init__(self):
+        self.calls = []
+
+    def cluster(self, nuggets):
+        self.calls.append(list(nuggets))
+        return "clustered"
+
+
+def test_agglomerative_labels_merge_similar_embeddings():
+    embeddings = np.array(list(EMBEDDINGS.values()))
+
+    assert agglomerative_labels(embeddings, 0.5) == [0, 0, 1]
+    assert agglomerative_labels(embeddings, 1.0) == [0, 1, 2]
+
+
+def test_small_inputs_are_clustered_over_embeddings():
+    clustering, embedder = FakeClustering(), FakeEmbedder()
+    adaptive = AdaptiveClustering(clustering, embedder, small_input_size=3)
+
+    result = adaptive.cluster(list(EMBEDDINGS))
+
+    assert list(result["Topic"]) == [0, 0, 1]
+    assert embedder.calls == [list(EMBEDDINGS)]
+    assert clustering.calls == []
+
+
+def test_large_inputs_keep_the_given_clustering():
+    clustering, embedder = FakeClustering(), FakeEmbedder()
+    adaptive = AdaptiveClustering(clustering, embedder, small_input_size=2)
+
+    assert adaptive.cluster(list(EMBEDDINGS)) == "clustered"
+    assert clustering.calls == [list(EMBEDDINGS)]
+    # Large inputs are not embedded for the lightweight backend.
+    assert embedder.calls == []
@@ -0,0 +1,47 @@
+"""Tests for the attribution of nugget clusters to passages."""
+
+from response_generation.attribution import AttributionIndex
+
+
+def make_index():
+    index = AttributionIndex(
+        {
+            1: ["Solar is cheap", "Wind is variable"],
+            2: ["Wind is variable", "Wind"],
+            3: ["Storage is costly"],
+        }
+    )
+    index.add_cluster(0, ["Wind is variable", "Storage is costly"])
+    index.add_cluster(1, ["Solar is cheap"])
+    return index
+
+
+def test_supporting_docs_in_passage_order():
+    index = make_index()
+
+    assert index.supporting_docs(0) == [1, 2, 3]
+    assert index.supporting_docs(1) == [1]
+
+
+def test_substrings_of_other_nuggets_are_not_attributed():
+    index = make_index()
+    index.add_cluster(2, ["Wind"])
+
+    # "Wind" only comes from passage 2, although it occurs in the text of
+    # nuggets of passage 1.
+    assert index.supporting_docs(2) == [2]
+
+
+def test_unknown_clusters_and_nuggets_have_no_support():
+    index = make_index()
+    index.add_cluster(3, ["Not detected in any passage"])
+
+    assert index.supporting_docs(3) == []
+    assert index.supporting_docs(42) == []
+
+
+def test_nuggets_repeated_in_a_passage_are_counted_once():
+    index = AttributionIndex({1: ["Nugget", "Nugget"], 2: ["Nugget"]})
+    index.add_cluster(0, ["Nugget"])
+
+    assert index.supporting_docs(0) == [1, 2]
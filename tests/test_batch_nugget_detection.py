@@ -0,0 +1,40 @@
+"""Tests for concurrent, memoized nugget detection."""
+
+import threading
+
+import pytest
+
+from response_generation.batch_nugget_detection import BatchNuggetDetector
+
+
+class CountingDetector:
+    """Nugget detector returning the sentences of a passage."""
+
+    def __init__(self):
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def detect_nuggets(self, query, passage):
+        with self._lock:
+            self.calls += 1
+        return passage.split(". ")
+
+
+def test_repeated_passages_are_detected_once():
+    detector = CountingDetector()
+    with BatchNuggetDetector(detector, max_workers=4) as batch_detector:
+        nuggets = batch_detector.detect_nuggets_many(
+            "Query", ["A. B", "C", "A. B"]
+        )
+        nuggets.append(batch_detector.detect_nuggets("Query", "C"))
+
+    assert nuggets == [["A", "B"], ["C"], ["A", "B"], ["C"]]
+    assert detector.calls == 2
+
+
+def test_close_shuts_down_the_thread_pool():
+    batch_detector = BatchNuggetDetector(CountingDetector())
+    batch_detector.close()
+
+    with pytest.raises(RuntimeError):
+        batch_detector.detect_nuggets("Query", "A")
@@ -0,0 +1,127 @@
+"""Tests for the batched monoT5/duoT5 reranker."""
+
+import re
+from types import SimpleNamespace
+
+from response_generation.pipeline.components.batched_ranker import (
+    BatchedDuoT5Reranker,
+)
+
+_POINTWISE_PATTERN = re.compile(r"Document: (.*) Relevant:")
+_PAIRWISE_PATTERN = re.compile(r"Document0: (.*) Document1: (.*) Relevant:")
+
+
+class ScoredReranker(BatchedDuoT5Reranker):
+    """Reranker with given pointwise and pairwise relevance, without models.
+
+    Pointwise scores are looked up by document, and the pairwise model
+    prefers the document with the higher exact relevance.
+    """
+
+    def __init__(self, pointwise, exact, **kwargs):
+        super().__init__(**kwargs)
+        self._pointwise = pointwise
+        self._exact = exact
+        self.pairwise_inputs = []
+
+    def _true_probabilities(self, model_name, inputs):
+        if model_name == self._monot5_model:
+            return [
+                self._pointwise[_POINTWISE_PATTERN.search(i).group(1)]
+                for i in inputs
+            ]
+        self.pairwise_inputs.extend(inputs)
+        pairs = [_PAIRWISE_PATTERN.search(i).groups() for i in inputs]
+        return [float(self._exact[a] > self._exact[b]) for a, b in pairs]
+
+
+class CandidateRanking:
+    """Ranking of candidate documents in the given order."""
+
+    def __init__(self, docs):
+        self._docs = [
+            SimpleNamespace(doc_id=i, content=doc) for i, doc in enumerate(docs)
+        ]
+
+    def fetch_topk_docs(self, k, unique=True):
+        return self._docs[:k]
+
+
+def rerank(reranker, docs):
+    query = SimpleNamespace(query_id="1", question="Query")
+    ranking = reranker.rerank(query, CandidateRanking(docs), len(docs))
+    return [doc.content for doc in ranking.scored_docs]
+
+
+def test_pairwise_order_within_the_pruning_window():
+    reranker = ScoredReranker(
+        pointwise={"a": 0.9, "b": 0.8, "c": 0.7, "d": 0.6, "e": 0.5},
+        exact={"a": 1, "b": 2, "c": 3, "d": 0, "e": 5},
+        top_k=2,
+        prune_margin=1,
+    )
+
+    # Only a, b and c are compared pairwise; d and e keep their pointwise
+    # order although e is the most relevant document.
+    assert rerank(reranker, ["e", "d", "c", "b", "a"]) == [
+        "c",
+        "b",
+        "a",
+        "d",
+        "e",
+    ]
+    assert not any(
+        "Document0: e" in i or "Document1: e" in i
+        for i in reranker.pairwise_inputs
+    )
+
+
+def test_early_termination_when_top_k_is_settled():
+    docs = ["a", "b", "c", "d", "e", "f"]
+    reranker = ScoredReranker(
+        pointwise={doc: 1 - i / 10 for i, doc in enumerate(docs)},
+        exact={doc: -i for i, doc in enumerate(docs)},
+        top_k=1,
+        prune_margin=5,
+        batch_size=2,
+    )
+
+    assert rerank(reranker, docs) == docs
+    # Candidate a wins its comparisons first and cannot be caught up with
+    # before all 15 pairs are evaluated.
+    assert len(reranker.pairwise_inputs) < 2 * 15
+
+
+def test_pair_scores_are_cached():
+    reranker = ScoredReranker(
+        pointwise={"a": 0.9, "b": 0.8, "c": 0.7},
+        exact={"a": 3, "b": 2, "c": 1},
+        top_k=3,
+    )
+
+    rerank(reranker, ["a", "b", "c"])
+    num_inputs = len(reranker.pairwise_inputs)
+    rerank(reranker, ["c", "b", "a"])
+
+    assert num_inputs == 6
+    assert len(reranker.pairwise_inputs) == num_inputs
+
+
+def test_pair_cache_is_bounded():
+    reranker = ScoredReranker(
+        pointwise={"a": 0.9, "b": 0.8, "c": 0.7},
+        exact={"a": 3, "b": 2, "c": 1},
+        top_k=3,
+        cache_size=2,
+    )
+
+    rerank(reranker, ["a", "b", "c"])
+
+    assert len(reranker._pair_cache) == 2
+
+
+def test_single_candidate_is_not_scored():
+    reranker = ScoredReranker(pointwise={}, exact={})
+
+    assert rerank(reranker, ["a"]) == ["a"]
+    assert reranker.pairwise_inputs == []
@@ -0,0 +1,69 @@
+"""Tests for the append-only checkpoint store."""
+
+import numpy as np
+
+from response_generation.checkpoint import CheckpointStore
+
+
+def test_records_round_trip(tmp_path):
+    store = CheckpointStore(str(tmp_path / "checkpoint.jsonl"))
+    record = {
+        "query_id": "1_1",
+        "clusters": [(0, "Nugget")],
+        "support_passages": {"Summary": [1, 2]},
+        "cluster_nuggets": {np.int64(0): ["Nugget"]},
+        "score": np.float64(0.5),
+    }
+
+    store.append(record)
+
+    assert store.load() == {
+        "1_1": {
+            "query_id": "1_1",
+            "clusters": [(0, "Nugget")],
+            "support_passages": {"Summary": [1, 2]},
+            "cluster_nuggets": {0: ["Nugget"]},
+            "score": 0.5,
+        }
+    }
+
+
+def test_last_record_of_a_key_wins(tmp_path):
+    store = CheckpointStore(str(tmp_path / "checkpoint.jsonl"))
+    store.append({"query_id": "1", "response": "First"})
+    store.append({"query_id": "2", "response": "Other"})
+    store.append({"query_id": "1", "response": "Second"})
+
+    assert store.ordered_records(["2", "1", "3"]) == [
+        {"query_id": "2", "response": "Other"},
+        {"query_id": "1", "response": "Second"},
+    ]
+
+
+def test_recover_drops_torn_last_line(tmp_path):
+    path = tmp_path / "checkpoint.jsonl"
+    store = CheckpointStore(str(path))
+    store.append({"query_id": "1", "response": "Done"})
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"key": "2", "record": "{\'query_id\': ')
+
+    assert store.recover() == {"1"}
+
+    store.append({"query_id": "2", "response": "Resumed"})
+    assert store.completed_keys() == {"1", "2"}
+    assert path.read_text(encoding="utf-8").count("\n") == 2
+
+
+def test_recover_of_missing_store(tmp_path):
+    store = CheckpointStore(str(tmp_path / "runs" / "checkpoint.jsonl"))
+
+    assert store.recover() == set()
+
+
+def test_reset_removes_records(tmp_path):
+    store = CheckpointStore(str(tmp_path / "checkpoint.jsonl"))
+    store.append({"query_id": "1", "response": "Done"})
+
+    store.reset()
+
+    assert store.load() == {}
@@ -0,0 +1,43 @@
+"""Tests for parsing aspect detection responses."""
+
+import pytest
+
+from response_generation import detect_response_aspects
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "**Covered in the passage:**\n"
+        "1. **Cost**\n"
+        "2. Safety\n"
+        "\n"
+        "**Not covered in the passage:**\n"
+        "1. History\n"
+        "2. Law",
+        "- Covered:\n- Cost\n- Safety\n- Not covered:\n- History\n- Law",
+    ],
+    ids=["bold_headers", "bulleted_headers"],
+)
+def test_parse_aspects_plain_text_headers(text):
+    result = detect_response_aspects.parse_aspects(text)
+
+    assert result.covered == ("Cost", "Safety")
+    assert result.not_covered == ("History", "Law")
+
+
+def test_parse_aspects_plain_text_headers_streamed():
+    text = "- Covered:\n- Cost\n- Not covered:\n- History"
+    parser = detect_response_aspects._AspectStreamParser(json_format=False)
+
+    pairs = [pair for char in text for pair in parser.feed(char)]
+
+    assert pairs + parser.close() == [("Cost", 1), ("History", 0)]
+
+
+def test_parse_aspects_without_content():
+    result = detect_response_aspects.parse_aspects(None)
+
+    assert result.covered == ()
+    assert result.not_covered == ()
+    assert len(result) == 0
@@ -0,0 +1,49 @@
+"""Tests for the sampling of aspects shown with the explanations."""
+
+import pytest
+
+from response_generation.detect_response_aspects import AspectDetectionResult
+from user_study.generate_explanations import sample_aspects
+
+ASPECTS = AspectDetectionResult.from_pairs(
+    [("Cost", 0), ("Safety", 1), ("History", 0), ("Law", 0), ("Jobs", 0)]
+)
+
+
+def test_same_seed_gives_same_sample():
+    assert sample_aspects(ASPECTS, seed="0-q1-1") == sample_aspects(
+        ASPECTS, seed="0-q1-1"
+    )
+
+
+def test_seeds_give_different_samples():
+    samples = {
+        tuple(sample_aspects(ASPECTS, seed="0-q{}-1".format(i)))
+        for i in range(20)
+    }
+
+    assert len(samples) > 1
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_sample_includes_a_covered_aspect(seed):
+    sampled = sample_aspects(ASPECTS, seed=seed)
+
+    assert len(sampled) == 4
+    assert len(set(sampled)) == 4
+    assert "Safety" in sampled
+
+
+def test_short_lists_are_returned_whole():
+    aspects = AspectDetectionResult.from_pairs([("Cost", 1), ("Law", 0)])
+
+    assert sorted(sample_aspects(aspects, seed=0)) == ["Cost", "Law"]
+
+
+def test_lists_without_covered_aspects_are_sampled():
+    aspects = AspectDetectionResult.from_pairs(
+        [("Cost", 0), ("Law", 0), ("Jobs", 0)]
+    )
+
+    assert len(sample_aspects(aspects, num_aspects=2, seed=0)) == 2
+    assert sample_aspects(aspects, num_aspects=0, seed=0) == []
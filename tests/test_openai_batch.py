@@ -0,0 +1,77 @@
+"""Tests for the offline batch mode of OpenAI requests."""
+
+import json
+import os
+import random
+from types import SimpleNamespace
+
+from response_generation.utilities.openai_batch import (
+    BatchingClient,
+    LocalBatchBackend,
+    mock_response,
+    run_in_batches,
+)
+
+MESSAGES = [{"role": "user", "content": "Summarize the passage."}]
+
+
+def run(backend, work_dir):
+    client = BatchingClient()
+
+    def job():
+        response = client.chat.completions.create(
+            model="gpt-4", messages=MESSAGES
+        )
+        return response.choices[0].message.content
+
+    return run_in_batches(job, client, backend, str(work_dir), poll_interval=0)
+
+
+def remote_backend(responder):
+    # Same endpoint as LocalBatchBackend, but not recognized as local.
+    local = LocalBatchBackend(responder=responder)
+    return SimpleNamespace(files=local.files, batches=local.batches)
+
+
+def test_outputs_are_reused_by_the_same_backend(tmp_path):
+    assert run(LocalBatchBackend(lambda body: "first"), tmp_path) == "first"
+    assert run(LocalBatchBackend(lambda body: "second"), tmp_path) == "first"
+    assert os.listdir(tmp_path) == ["local"]
+
+
+def test_local_outputs_are_not_reused_by_openai_backend(tmp_path):
+    assert run(LocalBatchBackend(lambda body: "mock"), tmp_path) == "mock"
+    assert run(remote_backend(lambda body: "real"), tmp_path) == "real"
+    assert sorted(os.listdir(tmp_path)) == ["local", "openai"]
+
+
+def test_mock_response_follows_protocol():
+    nuggets = mock_response(
+        {
+            "messages": [
+                {"role": "system", "content": "Annotate with <IN> tags."},
+                {"role": "user", "content": "Passage: Solar. Wind!"},
+            ]
+        }
+    )
+    packed = mock_response(
+        {
+            "messages": [
+                {"role": "system", "content": "Answer in JSON."},
+                {"role": "user", "content": 'Items: [{"id": "a"}]'},
+            ]
+        }
+    )
+
+    assert nuggets == "<IN>Solar.</IN> <IN>Wind!</IN>"
+    assert list(json.loads(packed)) == ["a"]
+
+
+def test_mock_response_uses_given_rng_and_length():
+    body = {"messages": MESSAGES}
+
+    assert mock_response(body) == mock_response(body)
+    assert len(mock_response(body, num_words=5).split()) == 5
+    assert mock_response(body, random.Random(1)) == mock_response(
+        body, random.Random(1)
+    )
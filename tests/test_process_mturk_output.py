@@ -0,0 +1,55 @@
+"""Tests for processing the MTurk results of the user study."""
+
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from user_study.process_mturk_output import (
+    NUM_TRUST_OPTIONS,
+    PICKED_BETTER,
+    TRUST_COLUMNS,
+    checked_answers,
+    classify_trust_preference,
+    classify_trust_preferences,
+)
+
+# Every combination of answers to the trust options.
+TRUST_ANSWERS = list(
+    itertools.product([False, True], repeat=NUM_TRUST_OPTIONS)
+)
+
+
+@pytest.mark.parametrize("reliable_position", [0, 1])
+def test_classify_trust_preferences_matches_reference(reliable_position):
+    trust = np.array(TRUST_ANSWERS)
+    reliable_positions = np.full(len(trust), reliable_position)
+
+    trust_preferences = classify_trust_preferences(trust, reliable_positions)
+
+    reliable_response_id = "response_" + str(reliable_position)
+    expected = [
+        classify_trust_preference(answers, reliable_response_id)
+        for answers in TRUST_ANSWERS
+    ]
+    assert list(PICKED_BETTER[trust_preferences.codes]) == [
+        picked_better for picked_better, _ in expected
+    ]
+    assert [
+        None if pd.isna(trust_preference) else trust_preference
+        for trust_preference in trust_preferences
+    ] == [trust_preference for _, trust_preference in expected]
+
+
+def test_checked_answers_treats_unanswered_as_unchecked():
+    data = pd.DataFrame(
+        [[True, np.nan, False, np.nan, True]], columns=TRUST_COLUMNS[0]
+    )
+
+    trust = checked_answers(data, TRUST_COLUMNS)
+
+    assert trust.dtype == bool
+    assert trust[0].tolist() == [True, False, False, False, True]
+    # Checkboxes of items missing from the results are unchecked.
+    assert not trust[1:].any()
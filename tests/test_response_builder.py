@@ -0,0 +1,64 @@
+"""Tests for the incremental assembly of responses."""
+
+from response_generation.response_builder import ResponseBuilder, count_words
+
+
+def words(n):
+    return " ".join(["word"] * n)
+
+
+def test_summaries_are_accepted_until_max_summaries():
+    builder = ResponseBuilder(max_words=100, max_summaries=2)
+
+    assert builder.add(words(5))
+    assert not builder.closed
+    assert builder.add(words(7))
+
+    assert builder.closed
+    assert not builder.add(words(1))
+    assert builder.summaries == [words(5), words(7)]
+    assert builder.word_count == 12
+
+
+def test_word_count_matches_joined_response():
+    builder = ResponseBuilder(max_words=100, max_summaries=3)
+    for summary in ["Solar is  cheap.", "Wind\tis variable.", "Storage."]:
+        builder.add(summary)
+
+    assert builder.word_count == count_words(" ".join(builder.summaries))
+
+
+def test_first_summary_over_budget_closes_builder():
+    builder = ResponseBuilder(max_words=10, max_summaries=3)
+
+    assert builder.add(words(6))
+    assert builder.exceeds_budget(words(5))
+    assert not builder.add(words(5))
+
+    # A later summary that would fit is not accepted, so that the response
+    # follows the ranking of the clusters.
+    assert builder.closed
+    assert not builder.add(words(1))
+    assert builder.summaries == [words(6)]
+
+
+def test_expected_to_fit_uses_mean_summary_length():
+    builder = ResponseBuilder(
+        max_words=40, max_summaries=5, expected_summary_words=20
+    )
+
+    assert builder.predict_next_length() == 20
+    assert builder.expected_to_fit(10) == 2
+
+    builder.add(words(4))
+    builder.add(words(6))
+
+    assert builder.predict_next_length() == 5
+    # 30 words left for 5-word summaries, capped by the 3 summaries left.
+    assert builder.expected_to_fit(10) == 3
+    assert builder.expected_to_fit(1) == 1
+
+
+def test_closed_builder_expects_nothing():
+    assert ResponseBuilder(max_summaries=0).expected_to_fit(3) == 0
+    assert not ResponseBuilder(max_summaries=0).add("Solar is cheap.")
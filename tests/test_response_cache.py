@@ -0,0 +1,88 @@
+"""Tests for the persistent response cache."""
+
+import pytest
+
+from response_generation.utilities.response_cache import (
+    ReplayMissError,
+    ResponseCache,
+)
+
+
+def test_make_key_depends_on_request():
+    messages = [{"role": "user", "content": "Query"}]
+
+    key = ResponseCache.make_key("gpt-4", messages, max_tokens=10)
+
+    assert key == ResponseCache.make_key("gpt-4", messages, max_tokens=10)
+    assert key != ResponseCache.make_key("gpt-4", messages, max_tokens=20)
+    assert key != ResponseCache.make_key("gpt-3.5", messages, max_tokens=10)
+
+
+def test_get_counts_hits_and_misses(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+
+    assert cache.get("a") is None
+    cache.put("a", "Response")
+
+    assert cache.get("a") == "Response"
+    assert cache.stats() == {
+        "hits": 1,
+        "misses": 1,
+        "entries": 1,
+        "size_bytes": len("Response"),
+    }
+
+
+def test_put_skips_responses_without_content(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+
+    cache.put("a", None)
+
+    assert cache.get("a") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_put_evicts_least_recently_used(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), max_size_bytes=10)
+    cache.put("a", "aaaa")
+    cache.put("b", "bbbb")
+    # Reading a makes b the least recently used entry.
+    cache.get("a")
+
+    cache.put("c", "cccc")
+
+    assert cache.get("a") == "aaaa"
+    assert cache.get("b") is None
+    assert cache.get("c") == "cccc"
+    assert cache.stats()["size_bytes"] == 8
+
+
+def test_put_replacing_entry_keeps_size(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = ResponseCache(path, max_size_bytes=10)
+    cache.put("a", "aaaa")
+    cache.put("a", "aaaaaa")
+    cache.put("b", "bbbb")
+    cache.close()
+
+    # The total size is read back when the cache is opened again.
+    cache = ResponseCache(path, max_size_bytes=10)
+    cache.put("c", "c")
+
+    assert cache.get("a") is None
+    assert cache.get("b") == "bbbb"
+    assert cache.get("c") == "c"
+
+
+def test_replay_reads_without_writing(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = ResponseCache(path)
+    cache.put("a", "Response")
+    cache.close()
+
+    replay_cache = ResponseCache(path, replay=True)
+    replay_cache.put("b", "Other response")
+
+    assert replay_cache.get("a") == "Response"
+    with pytest.raises(ReplayMissError):
+        replay_cache.get("b")
@@ -0,0 +1,89 @@
+"""Tests for token counting and budgeting."""
+
+from types import SimpleNamespace
+
+import pytest
+
+from response_generation.utilities import token_budget
+from response_generation.utilities.token_budget import (
+    TokenBudget,
+    get_context_window,
+)
+
+PROMPT = [{"role": "system", "content": "Summarize"}]
+
+
+class CharacterEncoding:
+    """Encoding with one token per character, so no download is needed."""
+
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, text):
+        self.encoded.append(text)
+        return [ord(c) for c in text]
+
+    def decode(self, tokens):
+        return "".join(chr(t) for t in tokens)
+
+
+@pytest.fixture
+def budget(monkeypatch):
+    encoding = CharacterEncoding()
+    monkeypatch.setattr(token_budget, "get_encoding", lambda model: encoding)
+    return TokenBudget("gpt-4", context_window=100)
+
+
+def test_get_context_window_matches_longest_prefix():
+    assert get_context_window("gpt-4-0613") == 8192
+    assert get_context_window("gpt-4o-mini-2024-07-18") == 128000
+    assert get_context_window("unknown") == 4096
+
+
+def test_count_messages(budget):
+    input_sample = {"role": "user", "content": "abc"}
+
+    # Messages: 3 + len("system") + len("Summarize") and 3 + len("user") + 3,
+    # plus 3 tokens priming the reply.
+    assert budget.count_messages(PROMPT, input_sample) == 18 + 10 + 3
+
+
+def test_count_prompt_is_cached(budget):
+    budget.count_prompt(PROMPT)
+    encoded = list(budget._encoding.encoded)
+
+    budget.count_prompt(PROMPT)
+
+    assert budget._encoding.encoded == encoded
+
+
+def test_fit_keeps_text_that_fits(budget):
+    assert budget.fit(PROMPT, "Query: ", "short", max_tokens=10) == "short"
+    assert budget.counters()["trimmed_inputs"] == 0
+
+
+def test_fit_trims_the_end_of_long_text(budget):
+    text = "x" * 200
+
+    trimmed = budget.fit(PROMPT, "Query: ", text, max_tokens=10)
+
+    input_sample = {"role": "user", "content": "Query: " + trimmed}
+    assert text.startswith(trimmed)
+    assert budget.count_messages(PROMPT, input_sample) == 90
+    assert budget.counters()["trimmed_inputs"] == 1
+
+
+def test_fit_returns_none_without_room_for_text(budget):
+    assert budget.fit(PROMPT, "Query: ", "text", max_tokens=90) is None
+
+
+def test_record_usage_accumulates_counters(budget):
+    budget.record_usage(SimpleNamespace(prompt_tokens=10, completion_tokens=5))
+    budget.record_usage(None)
+
+    assert budget.counters() == {
+        "calls": 2,
+        "prompt_tokens": 10,
+        "completion_tokens": 5,
+        "trimmed_inputs": 0,
+    }